@@ -1,9 +1,11 @@
 import telebot
-import yfinance as yf
 import extremities
 import pandas as pd
 import logging
 import config
+import instrumentation
+import risk_daemon
+import scenarios
 
 # Configure logging
 logging.basicConfig(
@@ -13,14 +15,16 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Initialize bot with token from config
-bot = telebot.TeleBot(config.TELEGRAM_BOT_TOKEN)
+bot = telebot.TeleBot(config.require_telegram_token())
 
 @bot.message_handler(commands=['Run'])
+@instrumentation.timed('bot_handler', report='TelegramBot')
 def check_sectors(message):
     """Execute comprehensive portfolio risk checks and send alerts via Telegram."""
     try:
         logger.info("Starting portfolio risk check")
-        df = pd.read_excel(config.FINISHED_PORTFOLIO_PATH)
+        with instrumentation.stage('excel_read'):
+            df = pd.read_excel(config.FINISHED_PORTFOLIO_PATH)
 
         alert_message = ""
 
@@ -80,9 +84,52 @@ def check_sectors(message):
         error_msg = f"Error running portfolio checks: {str(e)}"
         logger.error(f"Unexpected error: {e}", exc_info=True)
         bot.reply_to(message, error_msg)
+    finally:
+        instrumentation.count('bot_commands')
 
 
-if __name__ == '__main__':
+@bot.message_handler(commands=['Status'])
+@instrumentation.timed('bot_handler', report='TelegramBot')
+def daemon_status(message):
+    """Reply with the latest results held by the risk daemon."""
+    try:
+        status = risk_daemon.query('status')
+        lines = [f"Risk daemon updated {status['updated']} (last bar {status['last_bar']})",
+                 f"{status['universe']} tickers tracked, {status['positions']} positions"]
+        for name, job in status['jobs'].items():
+            lines.append(f"{name}: {job['status']} at {job['last_run']} ({job['seconds']}s), next {job['next_run']}")
+        violations = status['violations']
+        lines.append("-----------------------------------------")
+        lines += [f"|  {v}  |" for v in violations] or ["✅ All portfolio risk checks passed!"]
+        bot.reply_to(message, "\n".join(lines))
+    except ConnectionError as e:
+        logger.error(f"Risk daemon unavailable: {e}")
+        bot.reply_to(message, "Risk daemon is not running. Start it with: python risk_daemon.py serve")
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}", exc_info=True)
+        bot.reply_to(message, f"Error reading risk daemon status: {str(e)}")
+    finally:
+        instrumentation.count('bot_commands')
+
+
+@bot.message_handler(commands=['Stress'])
+@instrumentation.timed('bot_handler', report='TelegramBot')
+def stress_test(message):
+    """Reply with the worst historical and user-defined scenarios for the current portfolio."""
+    try:
+        result = scenarios.run_stress()
+        bot.reply_to(message, scenarios.format_report(result, config.STRESS_BOT_TOP))
+    except FileNotFoundError as e:
+        logger.error(f"Portfolio file not found: {e}")
+        bot.reply_to(message, "Transformed portfolio not found. Run main.py first.")
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}", exc_info=True)
+        bot.reply_to(message, f"Error running stress test: {str(e)}")
+    finally:
+        instrumentation.count('bot_commands')
+
+
+def run():
     logger.info("Starting Telegram bot...")
     try:
         bot.polling(none_stop=True)
@@ -90,3 +137,7 @@ if __name__ == '__main__':
         logger.info("Bot stopped by user")
     except Exception as e:
         logger.error(f"Bot stopped due to error: {e}", exc_info=True)
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(run, 'TelegramBot')
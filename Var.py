@@ -1,13 +1,20 @@
+import argparse
+import os
+import re
+
 import numpy as np
 import pandas as pd
-import yfinance as yf
-from pandas_datareader import data as pdr
 import datetime as dt
-import openpyxl
-from openpyxl.styles import PatternFill
-from scipy.stats import norm
 import logging
 import config
+import instrumentation
+import market_data
+import universe
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+# Imported on first use; volatility_models itself imports Var
+volatility_models = lazy_import('volatility_models')
 
 # Configure logging
 logging.basicConfig(
@@ -16,7 +23,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Per-ticker columns written next to Var; every one of them is "higher is riskier"
+TAIL_METRICS = ['ES', 'MaxDrawdown', 'Volatility', 'DownsideDev']
+QUALITY_METRICS = ['Var'] + TAIL_METRICS
+# Bootstrap confidence bounds of Var, written when VAR_BOOTSTRAP_RESAMPLES is set
+INTERVAL_COLUMNS = ['VarLow', 'VarHigh']
+TRADING_DAYS = 252
+
 
+@instrumentation.timed('var_compute')
 def calc_var(initial_investment, weights, data):
     """
     Calculate 1-day Value at Risk (VaR) using parametric method.
@@ -35,23 +50,178 @@ def calc_var(initial_investment, weights, data):
         avg_rets = returns.mean()
         port_mean = avg_rets.dot(weights)
         port_stdev = np.sqrt(weights.T.dot(cov_matrix).dot(weights))
-        mean_investment = (1 + port_mean) * initial_investment
-        stdev_investment = initial_investment * port_stdev
-
-        # 95% confidence level (5% tail risk)
-        confidence_level = 0.05
-        cutoff = norm.ppf(confidence_level, mean_investment, stdev_investment)
-        var_1d = initial_investment - cutoff
-
-        return var_1d
+        return var_from_moments(initial_investment, port_mean, port_stdev)
     except Exception as e:
         logger.error(f"Error calculating VaR: {e}")
         raise
 
 
+def var_from_moments(initial_investment, mean, stdev):
+    """
+    1-day parametric VaR from the mean and standard deviation of daily returns.
+
+    Accepts scalars or arrays, so callers that keep running return moments per
+    ticker can revalue many tickers in one call.
+    """
+    mean_investment = (1 + mean) * initial_investment
+    stdev_investment = initial_investment * stdev
+
+    # 95% confidence level (5% tail risk)
+    confidence_level = 0.05
+    cutoff = stats.norm.ppf(confidence_level, mean_investment, stdev_investment)
+    return initial_investment - cutoff
+
+
+@instrumentation.timed('var_compute')
+def risk_metrics(initial_investment, weights, prices):
+    """
+    VaR and tail metrics for every ticker of a price panel in one vectorized pass.
+
+    Returns are taken between consecutive valid closes, as calc_var sees them
+    on each ticker's dropna() history, so with VAR_VOL_MODEL = 'sample' Var
+    matches calc_var exactly. With 'ewma' or 'garch', Var uses the model's
+    next-day volatility forecast instead.
+
+    Args:
+        initial_investment: Portfolio value
+        weights: Position weight array, as for calc_var (single-ticker weight)
+        prices: DataFrame of closes (dates x symbols); gaps may be NaN
+
+    Returns:
+        DataFrame indexed by symbol with columns:
+            Var: 1-day parametric VaR in dollars
+            ES: Expected Shortfall in dollars, the mean loss on the days beyond
+                the historical (1 - CONFIDENCE_LEVEL) quantile
+            MaxDrawdown: Largest peak-to-trough fall of the close, as a fraction
+            Volatility: Annualized standard deviation of daily returns
+            DownsideDev: Annualized root mean square of negative daily returns
+        Tickers with fewer than two returns are NaN.
+    """
+    weight = float(np.sum(weights))
+    p = prices.to_numpy(dtype=np.float64)
+    previous = pd.DataFrame(p).ffill().shift(1).to_numpy()
+    r = weight * (p / previous - 1)
+    valid = ~np.isnan(r)
+    n = valid.sum(axis=0)
+    ok = n >= 2
+    p, r, valid, n = p[:, ok], r[:, ok], valid[:, ok], n[ok]
+    rz = np.where(valid, r, 0.0)
+
+    mean = rz.sum(axis=0) / n
+    stdev = np.sqrt((np.where(valid, r - mean, 0.0) ** 2).sum(axis=0) / (n - 1))
+    downside = np.sqrt((np.minimum(rz, 0.0) ** 2).sum(axis=0) / n)
+
+    # Historical quantile per column (linear interpolation, as np.quantile), gaps sorted to the end
+    ordered = np.sort(np.where(valid, r, np.inf), axis=0)
+    position = (n - 1) * (1 - config.CONFIDENCE_LEVEL)
+    lo = np.floor(position).astype(np.intp)
+    hi = np.minimum(lo + 1, n - 1)
+    cols = np.arange(r.shape[1])
+    cutoff = ordered[lo, cols] + (position - lo) * (ordered[hi, cols] - ordered[lo, cols])
+    tail = valid & (r <= cutoff)
+    shortfall = -(rz * tail).sum(axis=0) / tail.sum(axis=0)
+
+    peak = np.fmax.accumulate(p, axis=0)
+    drawdown = -np.nanmin(p / peak - 1, axis=0)
+
+    metrics = pd.DataFrame({
+        'Var': var_from_moments(initial_investment, mean, stdev),
+        'ES': initial_investment * shortfall,
+        'MaxDrawdown': drawdown,
+        'Volatility': stdev * np.sqrt(TRADING_DAYS),
+        'DownsideDev': downside * np.sqrt(TRADING_DAYS),
+    }, index=prices.columns[ok])
+    if config.VAR_VOL_MODEL != 'sample':
+        metrics['Var'] = volatility_models.model_var(initial_investment, weights, prices[metrics.index])
+    return metrics.reindex(prices.columns)
+
+
+@instrumentation.timed('var_bootstrap')
+def bootstrap_var(initial_investment, weights, prices, resamples=None, block=None, interval=None, seed=0):
+    """
+    Moving-block bootstrap confidence interval of each ticker's sample VaR.
+
+    One set of block start indices is drawn for all tickers, so every resample
+    is the same run of dates across the panel. Sums of returns, squared returns
+    and valid-return counts over every possible block come from cumulative
+    sums; a resample's moments are then a gather of its blocks' rows,
+    batched over resamples and done for all tickers at once.
+
+    Args:
+        initial_investment: Portfolio value
+        weights: Position weight array, as for risk_metrics
+        prices: DataFrame of closes (dates x symbols); gaps may be NaN
+        resamples: Bootstrap resamples (default: config.VAR_BOOTSTRAP_RESAMPLES)
+        block: Block length in days, keeping volatility clusters together
+            (default: config.VAR_BOOTSTRAP_BLOCK)
+        interval: Two-sided coverage of the interval (default: config.VAR_BOOTSTRAP_INTERVAL)
+        seed: Seed of the block draws, so reruns give the same intervals
+
+    Returns:
+        DataFrame indexed by symbol with VarLow and VarHigh in dollars; NaN
+        for tickers with fewer than two returns
+    """
+    resamples = resamples or config.VAR_BOOTSTRAP_RESAMPLES
+    block = block or config.VAR_BOOTSTRAP_BLOCK
+    interval = interval or config.VAR_BOOTSTRAP_INTERVAL
+    weight = float(np.sum(weights))
+    p = prices.to_numpy(dtype=np.float64)
+    previous = pd.DataFrame(p).ffill().shift(1).to_numpy()
+    r = (weight * (p / previous - 1))[1:]
+    valid = ~np.isnan(r)
+    rz = np.where(valid, r, 0.0)
+    days, tickers = r.shape
+    block = max(1, min(block, days))
+    blocks = max(1, days // block)
+
+    def block_sums(values):
+        c = np.concatenate([np.zeros((1, tickers)), np.cumsum(values, axis=0)])
+        return c[block:] - c[:-block]
+
+    # Per-block sums stacked so one gather fetches all three for every ticker
+    sums = np.stack([block_sums(valid.astype(np.float64)), block_sums(rz), block_sums(rz ** 2)], axis=1)
+    starts = np.random.default_rng(seed).integers(0, days - block + 1, size=(resamples, blocks))
+
+    var = np.empty((resamples, tickers))
+    # Chunks keep the gathered (resamples, blocks, 3, tickers) array around 64 MB
+    chunk = max(1, int(8e6 // (blocks * 3 * max(tickers, 1))))
+    for i in range(0, resamples, chunk):
+        n, s1, s2 = sums[starts[i:i + chunk]].sum(axis=1).transpose(1, 0, 2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = s1 / n
+            stdev = np.sqrt(np.maximum(s2 - s1 * mean, 0.0) / (n - 1))
+        var[i:i + chunk] = np.where(n >= 2, var_from_moments(initial_investment, mean, stdev), np.nan)
+
+    # Resamples that drew too few of a sparse ticker's returns are ignored; NaN sorts last
+    var.sort(axis=0)
+    count = (~np.isnan(var)).sum(axis=0)
+    tail = (1 - interval) / 2
+    cols = np.arange(tickers)
+
+    def quantile(q):
+        position = np.maximum(count - 1, 0) * q
+        lo = np.floor(position).astype(np.intp)
+        hi = np.minimum(lo + 1, np.maximum(count - 1, 0))
+        value = var[lo, cols] + (position - lo) * (var[hi, cols] - var[lo, cols])
+        return np.where(valid.sum(axis=0) >= 2, value, np.nan)
+
+    return pd.DataFrame({'VarLow': quantile(tail), 'VarHigh': quantile(1 - tail)}, index=prices.columns)
+
+
+def var_intervals(initial_investment, weights, prices):
+    """bootstrap_var when VAR_BOOTSTRAP_RESAMPLES is set, else None."""
+    if config.VAR_BOOTSTRAP_RESAMPLES <= 0:
+        return None
+    if config.VAR_VOL_MODEL != 'sample':
+        logger.warning(f"VaR confidence intervals describe the sample estimator; "
+                       f"skipped with VAR_VOL_MODEL = '{config.VAR_VOL_MODEL}'")
+        return None
+    return bootstrap_var(initial_investment, weights, prices)
+
+
 def add_var_to_alltickers(path, initial_inv, weights, start_date):
     """
-    Calculate VaR for all tickers in the master list and save to Excel.
+    Calculate VaR and tail metrics for all tickers in the master list and save to Excel.
 
     Args:
         path: Path to alltickers Excel file
@@ -61,27 +231,32 @@ def add_var_to_alltickers(path, initial_inv, weights, start_date):
     """
     try:
         logger.info(f"Loading tickers from {path}")
-        df = pd.read_excel(path)
-        df['Var'] = 0
-        df['Qual'] = 0
+        with instrumentation.stage('excel_read'):
+            df = pd.read_excel(path)
+        df['Var'] = 0.0
+        # The previous labels stay until rating, which may keep them under QUALITY_TIERING = 'interval'
+        if 'Qual' not in df.columns:
+            df['Qual'] = ''
         tickers = df['Symbol'].tolist()
-        bad_tickers = []
-
-        for index, ticker in enumerate(tickers):
-            try:
-                logger.info(f"Processing {index + 1}/{len(tickers)}: {ticker}")
-                data = pdr.get_data_yahoo([ticker], start=start_date, end=dt.date.today())['Close']
-                df.at[index, 'Var'] = calc_var(initial_inv, weights, data)
-            except Exception as e:
-                logger.warning(f"Failed to calculate VaR for {ticker}: {e}")
-                bad_tickers.append(ticker)
+        prices = market_data.get_provider().get_history(tickers, start=start_date, end=dt.date.today())
 
+        logger.info(f"Computing VaR and tail metrics for {len(tickers)} tickers")
+        metrics = risk_metrics(initial_inv, weights, prices).reindex(tickers)
+        bad_tickers = metrics.index[metrics['Var'].isna()].tolist()
         if bad_tickers:
             logger.warning(f"Failed tickers: {bad_tickers}")
+        for column in QUALITY_METRICS:
+            df[column] = metrics[column].fillna(0.0).to_numpy()
+        intervals = var_intervals(initial_inv, weights, prices)
+        if intervals is not None:
+            intervals = intervals.reindex(tickers)
+            for column in INTERVAL_COLUMNS:
+                df[column] = intervals[column].to_numpy()
 
         df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
-        df = df.sort_values(by='Var')
-        df.to_excel(path, index=False)
+        df = df.sort_values(by=config.QUALITY_METRIC)
+        with instrumentation.stage('excel_write'):
+            df.to_excel(path, index=False)
         logger.info(f"VaR data saved to {path}")
 
     except Exception as e:
@@ -89,10 +264,25 @@ def add_var_to_alltickers(path, initial_inv, weights, start_date):
         raise
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="VaR and tail metrics for the master list or a named universe")
+    parser.add_argument('--universe', nargs='+',
+                        help="TradingView list names, asset classes or 'all' (union); default: the master list")
+    parser.add_argument('--exclude', action='append', default=[], help="Universe whose symbols are left out")
+    parser.add_argument('--output', help="Excel file for a universe run (default: outputs/var_<universe>.xlsx)")
+    args = parser.parse_args(argv)
+
+    weights = np.array(config.WEIGHTS)
+    if not args.universe:
+        add_var_to_alltickers(config.ALL_TICKERS_PATH, config.INITIAL_INVESTMENT, weights, config.START_DATE_FOR_VAR)
+        return
+
+    selected = universe.select(args.universe, exclude=args.exclude)
+    output = args.output or os.path.join('outputs', f"var_{re.sub(r'[^a-z0-9]+', '_', selected.name.lower()).strip('_')}.xlsx")
+    logger.info(f"Universe {selected.name}: {len(selected)} symbols")
+    pd.DataFrame({'Symbol': selected.symbols}).to_excel(output, index=False)
+    add_var_to_alltickers(output, config.INITIAL_INVESTMENT, weights, config.START_DATE_FOR_VAR)
+
+
 if __name__ == '__main__':
-    add_var_to_alltickers(
-        config.ALL_TICKERS_PATH,
-        config.INITIAL_INVESTMENT,
-        np.array(config.WEIGHTS),
-        config.START_DATE_FOR_VAR
-    )
+    instrumentation.run_main(main, 'Var')
@@ -0,0 +1,274 @@
+"""
+Offline performance benchmarks for the VaR, portfolio and stop-loss code paths.
+Runs every stage against deterministic synthetic data served by an in-memory
+market data provider, and saves timings and peak memory as JSON.
+
+Usage:
+    python -m benchmarks.run_benchmarks --tickers 500 --years 5
+    python -m benchmarks.run_benchmarks --compare outputs/benchmarks/<previous>.json
+"""
+import argparse
+import contextlib
+import datetime as dt
+import io
+import json
+import logging
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from unittest import mock
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+import numpy as np
+import pandas as pd
+
+import config
+import extremities
+import factor_model
+import limit_replay
+import live_var
+import main as portfolio_main
+import market_data
+import price_panel
+import stopLossFunctions
+import Var
+import var_backtest
+from benchmarks import synthetic
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR = REPO_DIR / 'outputs' / 'benchmarks'
+
+
+def measure(run, setup=None, repeat=3):
+    """
+    Time a callable and record its peak traced memory.
+
+    Timing runs are separate from the traced run so tracemalloc overhead does
+    not inflate the reported seconds. An untimed warm-up run first pays for
+    any dependencies the code path imports lazily.
+    """
+    if setup:
+        setup()
+    run()
+
+    seconds = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'seconds': seconds,
+        'best_seconds': min(seconds),
+        'mean_seconds': sum(seconds) / len(seconds),
+        'peak_mb': peak / 1024 ** 2,
+    }
+
+
+def build_cases(workdir, closes, sectors, n_positions, n_pairs, pair_hours):
+    """Return {name: (run, setup)} for every benchmarked code path."""
+    tickers = list(closes.columns)
+    holdings = tickers[:n_positions]
+    weights = np.array(config.WEIGHTS)
+    start_date = closes.index[0].strftime('%Y-%m-%d')
+
+    alltickers_path = str(workdir / 'alltickers.xlsx')
+    portfolio_csv = str(workdir / 'actualportfolio.csv')
+    portfolio_xlsx = str(workdir / 'actualportfolio.xlsx')
+
+    alltickers = synthetic.alltickers_frame(tickers)
+    # Leave a few holdings out of the master list so get_var also exercises the fetch path
+    cached_alltickers = alltickers[~alltickers['Symbol'].isin(holdings[:3])]
+    portfolio = synthetic.transformed_portfolio(holdings, closes, config.NET_LIQUIDITY, sectors)
+    portfolio_rated = portfolio.assign(Var=alltickers.set_index('Symbol').loc[holdings, 'Var'].to_numpy(),
+                                       Qual=alltickers.set_index('Symbol').loc[holdings, 'Qual'].to_numpy())
+    export = synthetic.broker_export(holdings, closes)
+    export.to_csv(portfolio_csv, index=False)
+    # The same export with one position resized, for the incremental re-evaluation
+    changed_csv = str(workdir / 'actualportfolio_changed.csv')
+    changed = export.copy()
+    changed.loc[0, 'Position'] = f"{int(str(changed.loc[0, 'Position']).replace(',', '')) * 2:,}"
+    changed.to_csv(changed_csv, index=False)
+
+    ratio_closes, ratio_highs, ratio_lows = synthetic.pair_ratio_panel(n_pairs, pair_hours)
+    positions = synthetic.pairs_positions(n_pairs)
+    single = closes[[tickers[0]]]
+    # Monthly snapshots of the holdings with varying sizes, replayed over every date
+    rng = np.random.default_rng(0)
+    snapshot_dates = closes.index[::21]
+    snapshots = pd.DataFrame(rng.integers(-500, 500, size=(len(snapshot_dates), len(holdings))).astype(float),
+                             index=snapshot_dates, columns=holdings)
+    qualities = alltickers.set_index('Symbol')['Qual']
+
+    def replay_limits():
+        held = limit_replay._positions_on(closes.index, snapshots=snapshots)
+        timeline, _ = limit_replay.replay(held, closes, sectors, qualities, config.NET_LIQUIDITY)
+        limit_replay.episodes(timeline, limit_replay.breaches(timeline))
+    # Tick batches of a few names each moving the book's amounts, as the live VaR worker applies them
+    returns = closes.pct_change(fill_method=None).iloc[1:]
+    model = factor_model.FactorModel.fit(returns, sectors)
+    book = rng.integers(-500, 500, size=len(model.symbols)).astype(float) * closes.iloc[-1].to_numpy()
+    tick_rows = rng.integers(0, len(model.symbols), size=(1000, 5))
+    tick_amounts = book[tick_rows] * (1 + rng.normal(0, 0.001, size=tick_rows.shape))
+
+    def live_var_updates():
+        live = live_var.IncrementalFactorVar(model, book)
+        for rows, amounts in zip(tick_rows, tick_amounts):
+            rows, first = np.unique(rows, return_index=True)
+            live.update(rows, amounts[first])
+            live.var()
+    price_panel.write_panel({'Close': closes}, workdir / 'panel')
+    panel = price_panel.PricePanel(workdir / 'panel')
+
+    def write_alltickers():
+        alltickers[['Symbol']].to_excel(alltickers_path, index=False)
+
+    def write_get_var_inputs():
+        cached_alltickers.to_excel(alltickers_path, index=False)
+        portfolio.to_excel(portfolio_xlsx, index=False)
+
+    def cold_transform():
+        Path(config.PORTFOLIO_STATE_PATH).unlink(missing_ok=True)
+
+    def previous_transform():
+        cold_transform()
+        portfolio_main.transform_df(portfolio_csv, config.NET_LIQUIDITY)
+
+    def quiet(func, *args):
+        with contextlib.redirect_stdout(io.StringIO()):
+            func(*args)
+
+    return {
+        'Var.calc_var': (lambda: Var.calc_var(config.INITIAL_INVESTMENT, weights, single), None),
+        'Var.risk_metrics': (lambda: Var.risk_metrics(config.INITIAL_INVESTMENT, weights, closes), None),
+        'Var.bootstrap_var': (
+            lambda: Var.bootstrap_var(config.INITIAL_INVESTMENT, weights, closes, resamples=1000, block=10), None),
+        'var_backtest.backtest': (lambda: var_backtest.backtest(closes, window=min(250, len(closes) // 2)), None),
+        'Var.add_var_to_alltickers': (
+            lambda: Var.add_var_to_alltickers(alltickers_path, config.INITIAL_INVESTMENT, weights, start_date),
+            write_alltickers),
+        'price_panel.frame': (lambda: panel.frame('Close', holdings), None),
+        'main.get_var': (lambda: portfolio_main.get_var(portfolio_xlsx, alltickers_path), write_get_var_inputs),
+        'main.transform_df': (lambda: portfolio_main.transform_df(portfolio_csv, config.NET_LIQUIDITY), cold_transform),
+        'main.transform_df.one_change': (
+            lambda: portfolio_main.transform_df(changed_csv, config.NET_LIQUIDITY), previous_transform),
+        'extremities.check_sectors': (lambda: extremities.check_sectors(portfolio_rated[['Sector', 'Protfilio Precentage']]), None),
+        'extremities.check_percentage': (lambda: extremities.check_percentage(portfolio_rated), None),
+        'extremities.check_amount': (lambda: extremities.check_amount(portfolio_rated), None),
+        'extremities.check_pos_size': (lambda: extremities.check_pos_size(portfolio_rated), None),
+        'extremities.check_var_quality': (lambda: extremities.check_var_quality(portfolio_rated), None),
+        'limit_replay.replay': (replay_limits, None),
+        'live_var.update': (live_var_updates, None),
+        'extremities.get_corr_mat': (
+            lambda: extremities.get_corr_mat(portfolio_rated, output_file=str(workdir / 'corr_mat.png')), None),
+        'stopLossFunctions.fixed_percentage_stop_loss': (
+            lambda: quiet(stopLossFunctions.fixed_percentage_stop_loss, positions, ratio_closes, 1.02), None),
+        'stopLossFunctions.fixed_time_stop_loss': (
+            lambda: quiet(stopLossFunctions.fixed_time_stop_loss, positions, ratio_closes, pair_hours // 2), None),
+        'stopLossFunctions.atr_stop_loss': (
+            lambda: stopLossFunctions.atr_stop_loss(positions, ratio_closes, ratio_highs, ratio_lows, 0.04), None),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(current, previous_path):
+    """Log best-time and peak-memory ratios against an earlier results file."""
+    with open(previous_path, 'r') as fp:
+        previous = json.load(fp)
+    logger.info(f"Comparing with {previous_path} (commit {previous.get('commit')})")
+    for name, result in current['results'].items():
+        before = previous['results'].get(name)
+        if not before:
+            continue
+        speed = result['best_seconds'] / before['best_seconds'] if before['best_seconds'] else float('nan')
+        memory = result['peak_mb'] / before['peak_mb'] if before['peak_mb'] else float('nan')
+        flag = '  <-- slower' if speed > 1.2 else ''
+        logger.info(f"{name:50s} time x{speed:5.2f}  memory x{memory:5.2f}{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run offline benchmarks on synthetic market data")
+    parser.add_argument('--tickers', type=int, default=500, help="Universe size (10 to 5000)")
+    parser.add_argument('--years', type=float, default=5, help="Years of daily history (1 to 10)")
+    parser.add_argument('--positions', type=int, default=50, help="Portfolio holdings")
+    parser.add_argument('--pairs', type=int, default=200, help="Pairs positions for the stop-loss rules")
+    parser.add_argument('--pair-hours', type=int, default=70, help="Hourly bars per pairs position")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', default=None, help="Only run benchmarks whose name contains this text")
+    parser.add_argument('--output', default=None, help="Results JSON path")
+    parser.add_argument('--compare', default=None, help="Earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # The benchmarked modules log every ticker and limit breach; keep only their errors
+    for name in ('Var', 'main', 'extremities', 'visualization', 'market_data'):
+        logging.getLogger(name).setLevel(logging.ERROR)
+
+    n_tickers = max(10, min(args.tickers, 5000))
+    n_positions = min(args.positions, n_tickers)
+    closes = synthetic.price_panel(n_tickers, args.years, seed=args.seed)
+    sectors = synthetic.sector_map(closes.columns, seed=args.seed)
+    info = {symbol: ({'sector': sector} if sector != 'ETF' else {}) for symbol, sector in sectors.items()}
+    market_data.set_provider(market_data.FrameProvider(closes, info))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        with mock.patch.object(config, 'ALL_TICKERS_PATH', str(workdir / 'alltickers.xlsx')), \
+                mock.patch.object(config, 'PORTFOLIO_PATH_TRANSFORMED', str(workdir / 'actualportfolio.xlsx')), \
+                mock.patch.object(config, 'PORTFOLIO_STATE_PATH', str(workdir / 'portfolio_state.csv')):
+            cases = build_cases(workdir, closes, sectors, n_positions, args.pairs, args.pair_hours)
+            for name, (run, setup) in cases.items():
+                if args.only and args.only not in name:
+                    continue
+                logger.info(f"Running {name}...")
+                results[name] = measure(run, setup, repeat=args.repeat)
+                logger.info(f"{name}: best {results[name]['best_seconds']:.4f}s, "
+                            f"peak {results[name]['peak_mb']:.1f} MB")
+
+    report = {
+        'commit': git_revision(),
+        'timestamp': dt.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'params': {'tickers': n_tickers, 'years': args.years, 'positions': n_positions,
+                   'pairs': args.pairs, 'pair_hours': args.pair_hours, 'repeat': args.repeat, 'seed': args.seed},
+        'results': results,
+    }
+    output = Path(args.output) if args.output else \
+        RESULTS_DIR / f"bench_{report['commit']}_{dt.datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as fp:
+        json.dump(report, fp, indent=2)
+    logger.info(f"Benchmark results saved to {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Deterministic synthetic market data for offline benchmarks.
+Every generator takes a seed, so the same parameters always produce the same data.
+"""
+import numpy as np
+import pandas as pd
+
+SECTORS = ['Technology', 'Energy', 'Healthcare', 'Financial Services', 'Consumer Cyclical',
+           'Communication Services', 'Industrials', 'Utilities', 'ETF']
+
+
+def ticker_names(n_tickers):
+    return [f'T{i:04d}' for i in range(n_tickers)]
+
+
+def price_panel(n_tickers, years, seed=0, end='2024-12-31'):
+    """
+    Daily closes for n_tickers following correlated geometric Brownian motion.
+
+    Returns:
+        DataFrame indexed by business day, one column per ticker
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=end, periods=int(252 * years))
+    market = rng.normal(0.0003, 0.01, size=(len(dates), 1))
+    betas = rng.uniform(0.5, 1.5, size=n_tickers)
+    idio = rng.normal(0, 1, size=(len(dates), n_tickers)) * rng.uniform(0.005, 0.03, size=n_tickers)
+    returns = market * betas + idio
+    start_prices = rng.uniform(5, 500, size=n_tickers)
+    closes = start_prices * np.exp(np.cumsum(returns, axis=0))
+    return pd.DataFrame(closes, index=dates, columns=ticker_names(n_tickers))
+
+
+def sector_map(tickers, seed=0):
+    rng = np.random.default_rng(seed)
+    return dict(zip(tickers, rng.choice(SECTORS, size=len(tickers))))
+
+
+def broker_export(tickers, closes, seed=0):
+    """
+    Portfolio CSV in the broker export layout read by main.transform_df.
+
+    Args:
+        tickers: Symbols held in the portfolio
+        closes: Price panel used for average and last prices
+    """
+    rng = np.random.default_rng(seed)
+    last = closes[tickers].iloc[-1].to_numpy()
+    avg = last * rng.uniform(0.9, 1.1, size=len(tickers))
+    shares = rng.integers(10, 500, size=len(tickers)) * rng.choice([-1, 1], size=len(tickers))
+    market_value = shares * last
+    return pd.DataFrame({
+        'Daily P&L': np.round(rng.normal(0, 200, size=len(tickers))).astype(int),
+        'Financial Instrument': tickers,
+        'Position': [f'{s:,}' for s in shares],
+        'Market Value': [f'{v:,.0f}' for v in market_value],
+        'Avg Price': np.round(avg, 3),
+        'Last': np.round(last, 2),
+        'Change': np.round(rng.normal(0, 2, size=len(tickers)), 2),
+        'Unrealized P&L': np.round((last - avg) * shares).astype(int),
+    })
+
+
+def transformed_portfolio(tickers, closes, net_liquidity, sectors, seed=0):
+    """Portfolio in the layout written by main.transform_df, ready for the risk checks."""
+    export = broker_export(tickers, closes, seed)
+    amount = pd.to_numeric(export['Position'].str.replace(',', '')) * export['Avg Price']
+    return pd.DataFrame({
+        'Symbol': tickers,
+        'Position': np.where(amount > 0, 'LONG', 'SHORT'),
+        'Amount': amount,
+        'Protfilio Precentage': amount.abs() / net_liquidity,
+        'Sector': [sectors[t] for t in tickers],
+    })
+
+
+def alltickers_frame(tickers, seed=0):
+    """Master ticker list with VaR and quality columns, sorted by VaR."""
+    rng = np.random.default_rng(seed)
+    var = np.sort(rng.uniform(1_000, 150_000, size=len(tickers)))
+    qual = np.where(np.arange(len(tickers)) < len(tickers) / 3, 'GOOD',
+                    np.where(np.arange(len(tickers)) < 0.9 * len(tickers), 'MID', 'BAD'))
+    return pd.DataFrame({'Symbol': rng.permutation(tickers), 'Var': var, 'Qual': qual})
+
+
+def pair_ratio_panel(n_positions, hours, seed=0):
+    """
+    Hourly long/short price ratios per pairs position, as used by stopLossFunctions.
+
+    Returns:
+        (closes, highs, lows): DataFrames with one row per position and one column
+        per trading hour since entry, normalized so each position starts at 1.0
+    """
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 0.004, size=(n_positions, hours))
+    closes = np.exp(np.cumsum(steps, axis=1))
+    spread = np.abs(rng.normal(0, 0.002, size=(n_positions, hours)))
+    columns = list(range(hours))
+    return (pd.DataFrame(closes, columns=columns),
+            pd.DataFrame(closes * (1 + spread), columns=columns),
+            pd.DataFrame(closes * (1 - spread), columns=columns))
+
+
+def pairs_positions(n_positions, seed=0):
+    """PositionStore of closed pairs whose open prices give an entry ratio near 1.0."""
+    from position_store import PositionStore
+    rng = np.random.default_rng(seed)
+    open_long = rng.uniform(20, 300, size=n_positions)
+    open_short = open_long * rng.uniform(0.98, 1.02, size=n_positions)
+    start = pd.Timestamp('2024-01-02') + pd.to_timedelta(rng.integers(0, 200, size=n_positions), unit='D')
+    return PositionStore.from_columns(
+        tickerLong=[f'L{i:04d}' for i in range(n_positions)],
+        tickerShort=[f'S{i:04d}' for i in range(n_positions)],
+        startDate=start,
+        endDate=start + pd.Timedelta(days=10),
+        operationLong=['Buy'] * n_positions,
+        operationShort=['Sell'] * n_positions,
+        openPriceLong=open_long,
+        openPriceShort=open_short,
+        ClosePriceLong=open_long * rng.uniform(0.95, 1.05, size=n_positions),
+        ClosePriceShort=open_short * rng.uniform(0.95, 1.05, size=n_positions),
+        terminatedOrClosed=['Close'] * n_positions,
+    )
@@ -13,21 +13,37 @@ load_dotenv()
 BASE_DIR = Path(__file__).parent
 
 # Telegram Configuration
+# Only the bot and live VaR alerts need the token, so it is checked by require_telegram_token()
+# rather than at import; every other script runs without it.
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-if not TELEGRAM_BOT_TOKEN:
-    raise ValueError(
-        "TELEGRAM_BOT_TOKEN not found in environment variables. "
-        "Please copy .env.example to .env and configure your credentials."
-    )
+
+
+def require_telegram_token():
+    """Return the Telegram bot token, raising if it is not configured."""
+    if not TELEGRAM_BOT_TOKEN:
+        raise ValueError(
+            "TELEGRAM_BOT_TOKEN not found in environment variables. "
+            "Please copy .env.example to .env and configure your credentials."
+        )
+    return TELEGRAM_BOT_TOKEN
+
+
+TELEGRAM_ALERT_CHAT_ID = os.getenv('TELEGRAM_ALERT_CHAT_ID', '')  # chat pushed live VaR alerts; empty = log only
+
 
 # Interactive Brokers Configuration
 IB_IP = os.getenv('IB_IP', '127.0.0.1')
 IB_PORT = int(os.getenv('IB_PORT', '7497'))
 IB_CLIENT_ID = int(os.getenv('IB_CLIENT_ID', '1'))
+IB_PORTFOLIO_CLIENT_ID = int(os.getenv('IB_PORTFOLIO_CLIENT_ID', '2'))
+IB_ACCOUNT = os.getenv('IB_ACCOUNT', '')  # empty for the only linked account
+IB_RECONNECT_SECONDS = float(os.getenv('IB_RECONNECT_SECONDS', '5'))  # first wait after a lost connection; doubles
 
 # Portfolio Configuration
 INITIAL_INVESTMENT = float(os.getenv('INITIAL_INVESTMENT', '1000000'))
 NET_LIQUIDITY = float(os.getenv('NET_LIQUIDITY', '294000'))
+PORTFOLIO_SOURCE = os.getenv('PORTFOLIO_SOURCE', 'csv')  # 'csv' (broker export) or 'ib' (live sync)
+MULTI_PORTFOLIO_WORKERS = int(os.getenv('MULTI_PORTFOLIO_WORKERS', '0'))  # 0 = one per account, up to the CPU count
 
 # Risk Thresholds
 SECTOR_PERCENTAGE_LIMIT = float(os.getenv('SECTOR_PERCENTAGE_LIMIT', '0.2'))
@@ -41,18 +57,113 @@ ALLOWED_RATIO_GOOD_TO_TOTAL = float(os.getenv('ALLOWED_RATIO_GOOD_TO_TOTAL', '0.
 POSITION_SIZE = int(os.getenv('POSITION_SIZE', '100'))
 SLEEP_TIME = int(os.getenv('SLEEP_TIME', '10'))
 TARGET_RATIO_MULTIPLIER = float(os.getenv('TARGET_RATIO_MULTIPLIER', '0.92'))
+PAIRS_SIGNAL_MODE = os.getenv('PAIRS_SIGNAL_MODE', 'ratio')  # 'ratio' or 'zscore'
+ZSCORE_WINDOW = int(os.getenv('ZSCORE_WINDOW', '120'))
+ZSCORE_BAR_SECONDS = int(os.getenv('ZSCORE_BAR_SECONDS', '3600'))
+ZSCORE_ENTRY = float(os.getenv('ZSCORE_ENTRY', '2.0'))
+ZSCORE_EXIT = float(os.getenv('ZSCORE_EXIT', '0.5'))
+ZSCORE_STOP = float(os.getenv('ZSCORE_STOP', '4.0'))
+EXECUTION_FILL_TIMEOUT = float(os.getenv('EXECUTION_FILL_TIMEOUT', '10'))  # seconds before a short leg is retried
+EXECUTION_RETRY_ATTEMPTS = int(os.getenv('EXECUTION_RETRY_ATTEMPTS', '2'))
+EXECUTION_LOG_PATH = os.getenv('EXECUTION_LOG_PATH', str(BASE_DIR / 'outputs' / 'pair_executions.csv'))
+
+# Backtest Configuration
+BACKTEST_SLIPPAGE_BPS = float(os.getenv('BACKTEST_SLIPPAGE_BPS', '5'))
+BACKTEST_COMMISSION_PER_SHARE = float(os.getenv('BACKTEST_COMMISSION_PER_SHARE', '0.005'))
+BACKTEST_MIN_COMMISSION = float(os.getenv('BACKTEST_MIN_COMMISSION', '1.0'))
+
+# Pair Screener Configuration
+PAIR_SCREEN_LISTS = [name.strip() for name in os.getenv('PAIR_SCREEN_LISTS', 'S&P 500').split(',') if name.strip()]
+PAIR_SCREEN_START_DATE = os.getenv('PAIR_SCREEN_START_DATE', '2018-01-01')
+PAIR_SCREEN_ADF_LAGS = int(os.getenv('PAIR_SCREEN_ADF_LAGS', '1'))
+PAIR_SCREEN_SIGNIFICANCE = float(os.getenv('PAIR_SCREEN_SIGNIFICANCE', '0.05'))
+PAIR_SCREEN_CHUNK_SIZE = int(os.getenv('PAIR_SCREEN_CHUNK_SIZE', '2000'))
+PAIR_SCREEN_WORKERS = int(os.getenv('PAIR_SCREEN_WORKERS', '0'))  # 0 = one per CPU core
 
 # File Paths
 DATA_DIR = BASE_DIR / 'data'
 ALL_TICKERS_PATH = os.getenv('ALL_TICKERS_PATH', str(DATA_DIR / 'alltickers.xlsx'))
 PORTFOLIO_PATH_ORIGINAL = os.getenv('PORTFOLIO_PATH_ORIGINAL', str(DATA_DIR / 'actualportfolio.csv'))
 PORTFOLIO_PATH_TRANSFORMED = os.getenv('PORTFOLIO_PATH_TRANSFORMED', str(DATA_DIR / 'actualportfolio.xlsx'))
+PORTFOLIO_STATE_PATH = os.getenv('PORTFOLIO_STATE_PATH', str(DATA_DIR / 'portfolio_state.csv'))
+MULTI_PORTFOLIO_SOURCE = os.getenv('MULTI_PORTFOLIO_SOURCE', str(DATA_DIR / 'accounts'))
 FINISHED_PORTFOLIO_PATH = os.getenv('FINISHED_PORTFOLIO_PATH', str(DATA_DIR / 'finished.xlsx'))
 PAIRS_POSITIONS_PATH = os.getenv('PAIRS_POSITIONS_PATH', str(DATA_DIR / 'pairsPositions.xlsx'))
+PORTFOLIO_EXPORTS_DIR = os.getenv('PORTFOLIO_EXPORTS_DIR', str(DATA_DIR / 'exports'))  # dated broker exports for replay
+PAIR_SCREEN_OUTPUT_PATH = os.getenv('PAIR_SCREEN_OUTPUT_PATH', str(DATA_DIR / 'pair_screen.csv'))
+TRADINGVIEW_LISTS_DIR = os.getenv('TRADINGVIEW_LISTS_DIR', str(BASE_DIR / 'TradingView_lists'))
+UNIVERSE_INDEX_PATH = os.getenv('UNIVERSE_INDEX_PATH', str(DATA_DIR / 'universe.json'))
 
 # Data Configuration
 START_DATE_FOR_VAR = os.getenv('START_DATE_FOR_VAR', '2018-01-01')
 
+# VaR Backtest Configuration
+BACKTEST_VAR_WINDOW = int(os.getenv('BACKTEST_VAR_WINDOW', '250'))
+BACKTEST_VAR_YEARS = float(os.getenv('BACKTEST_VAR_YEARS', '5'))
+BACKTEST_VAR_SIGNIFICANCE = float(os.getenv('BACKTEST_VAR_SIGNIFICANCE', '0.05'))
+
+# Factor Model Configuration
+FACTOR_MIN_SECTOR_SIZE = int(os.getenv('FACTOR_MIN_SECTOR_SIZE', '3'))  # smaller sectors load on the market only
+
+# Volatility Model Configuration
+EWMA_DECAY = float(os.getenv('EWMA_DECAY', '0.94'))  # RiskMetrics daily lambda
+VOL_MODEL_DIR = os.getenv('VOL_MODEL_DIR', str(DATA_DIR / 'vol_models'))
+VOL_MODEL_REFIT_DAYS = int(os.getenv('VOL_MODEL_REFIT_DAYS', '30'))  # GARCH parameters older than this are refitted
+VOL_MODEL_WORKERS = int(os.getenv('VOL_MODEL_WORKERS', '0'))  # 0 = one per CPU core
+
+# Stress Test Configuration
+SCENARIOS_PATH = os.getenv('SCENARIOS_PATH', str(DATA_DIR / 'scenarios.json'))
+STRESS_ROLLING_DAYS = int(os.getenv('STRESS_ROLLING_DAYS', '20'))  # 0 disables rolling historical windows
+STRESS_BOT_TOP = int(os.getenv('STRESS_BOT_TOP', '10'))
+
+# Intraday VaR Configuration
+INTRADAY_VAR_INTERVAL = os.getenv('INTRADAY_VAR_INTERVAL', '1h')
+INTRADAY_VAR_LOOKBACK_DAYS = int(os.getenv('INTRADAY_VAR_LOOKBACK_DAYS', '60'))
+INTRADAY_VAR_HORIZON_BARS = int(os.getenv('INTRADAY_VAR_HORIZON_BARS', '1'))
+
+# Market Data Provider Configuration
+MARKET_DATA_PROVIDER = os.getenv('MARKET_DATA_PROVIDER', 'yahoo')  # 'yahoo', 'local' or 'panel'
+MARKET_DATA_DIR = os.getenv('MARKET_DATA_DIR', str(DATA_DIR / 'prices'))
+PRICE_PANEL_DIR = os.getenv('PRICE_PANEL_DIR', str(DATA_DIR / 'panel'))
+PRICE_PANEL_START_DATE = os.getenv('PRICE_PANEL_START_DATE', '2017-01-01')
+YAHOO_REQUESTS_PER_SECOND = float(os.getenv('YAHOO_REQUESTS_PER_SECOND', '2'))
+YAHOO_BURST = int(os.getenv('YAHOO_BURST', '5'))
+YAHOO_MAX_RETRIES = int(os.getenv('YAHOO_MAX_RETRIES', '5'))
+YAHOO_BACKOFF_SECONDS = float(os.getenv('YAHOO_BACKOFF_SECONDS', '1'))
+YAHOO_POOL_SIZE = int(os.getenv('YAHOO_POOL_SIZE', '10'))
+
+# Risk Daemon Configuration
+RISK_DAEMON_HOST = os.getenv('RISK_DAEMON_HOST', '127.0.0.1')
+RISK_DAEMON_PORT = int(os.getenv('RISK_DAEMON_PORT', '8765'))
+RISK_DAEMON_PRICE_INTERVAL_MARKET = int(os.getenv('RISK_DAEMON_PRICE_INTERVAL_MARKET', '900'))  # seconds
+RISK_DAEMON_PRICE_INTERVAL_OVERNIGHT = int(os.getenv('RISK_DAEMON_PRICE_INTERVAL_OVERNIGHT', '3600'))
+RISK_DAEMON_PORTFOLIO_INTERVAL_MARKET = int(os.getenv('RISK_DAEMON_PORTFOLIO_INTERVAL_MARKET', '60'))
+RISK_DAEMON_PORTFOLIO_INTERVAL_OVERNIGHT = int(os.getenv('RISK_DAEMON_PORTFOLIO_INTERVAL_OVERNIGHT', '900'))
+RISK_DAEMON_OVERLAP_DAYS = int(os.getenv('RISK_DAEMON_OVERLAP_DAYS', '5'))  # re-fetched days per price refresh
+RISK_DAEMON_MISSING_RETRY_SECONDS = int(os.getenv('RISK_DAEMON_MISSING_RETRY_SECONDS', '86400'))  # tickers without data
+
+# Live VaR Configuration
+LIVE_VAR_MODEL = os.getenv('LIVE_VAR_MODEL', 'factor')  # 'factor' or 'covariance'
+LIVE_VAR_LIMIT = float(os.getenv('LIVE_VAR_LIMIT', '0.03'))  # alert above this fraction of net liquidation
+LIVE_VAR_COALESCE_SECONDS = float(os.getenv('LIVE_VAR_COALESCE_SECONDS', '0.2'))
+LIVE_VAR_CLIENT_ID = int(os.getenv('LIVE_VAR_CLIENT_ID', '3'))
+LIVE_VAR_REBUILD_BATCHES = int(os.getenv('LIVE_VAR_REBUILD_BATCHES', '1000'))  # full recompute to clear drift
+LIVE_VAR_REPORT_SECONDS = float(os.getenv('LIVE_VAR_REPORT_SECONDS', '60'))
+LIVE_VAR_RETRY_SECONDS = float(os.getenv('LIVE_VAR_RETRY_SECONDS', '60'))  # wait before retrying a failed refit
+
+# Instrumentation Configuration
+METRICS_DIR = os.getenv('METRICS_DIR', str(BASE_DIR / 'outputs' / 'metrics'))
+
+# Visualization Configuration
+VISUALIZATION_DPI = int(os.getenv('VISUALIZATION_DPI', '300'))
+VISUALIZATION_PREVIEW_DPI = int(os.getenv('VISUALIZATION_PREVIEW_DPI', '72'))
+
 # VaR Configuration
 WEIGHTS = [1]  # Can be extended for multi-asset portfolios
 CONFIDENCE_LEVEL = 0.95
+VAR_VOL_MODEL = os.getenv('VAR_VOL_MODEL', 'sample')  # 'sample', 'ewma' or 'garch'
+QUALITY_METRIC = os.getenv('QUALITY_METRIC', 'Var')  # Var, ES, MaxDrawdown, Volatility or DownsideDev
+VAR_BOOTSTRAP_RESAMPLES = int(os.getenv('VAR_BOOTSTRAP_RESAMPLES', '0'))  # 0 = no confidence intervals
+VAR_BOOTSTRAP_BLOCK = int(os.getenv('VAR_BOOTSTRAP_BLOCK', '10'))  # Days per resampled block
+VAR_BOOTSTRAP_INTERVAL = float(os.getenv('VAR_BOOTSTRAP_INTERVAL', '0.90'))
+QUALITY_TIERING = os.getenv('QUALITY_TIERING', 'point')  # 'point' or 'interval'
@@ -1,11 +1,14 @@
 import pandas as pd
-from pandas_datareader import data as pdr
 import numpy as np
 import datetime as dt
-from matplotlib import pyplot as plt
-import seaborn as sns
 import logging
 import config
+import instrumentation
+import market_data
+from lazy_imports import lazy_import
+
+plt = lazy_import('matplotlib.pyplot')
+sns = lazy_import('seaborn')
 
 # Configure logging
 logging.basicConfig(
@@ -15,6 +18,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+@instrumentation.timed('checks')
 def check_sectors(df):
     """Check if any sector exceeds concentration limit."""
     sector_sum = df.groupby(['Sector']).sum()
@@ -27,6 +31,7 @@ def check_sectors(df):
     return violations
 
 
+@instrumentation.timed('checks')
 def check_percentage(df):
     """Check if any individual position exceeds size limit."""
     violations = []
@@ -38,6 +43,7 @@ def check_percentage(df):
     return violations
 
 
+@instrumentation.timed('checks')
 def check_amount(df):
     """Check if total number of positions exceeds limit."""
     positions = df.groupby(['Symbol']).count().sum()['Position']
@@ -48,6 +54,7 @@ def check_amount(df):
     return []
 
 
+@instrumentation.timed('checks')
 def check_pos_size(df):
     """Check if total portfolio exposure exceeds limit (liquidation risk)."""
     total_exposure = df['Protfilio Precentage'].sum()
@@ -58,6 +65,7 @@ def check_pos_size(df):
     return []
 
 
+@instrumentation.timed('checks')
 def check_var_quality(df):
     """Check if portfolio has too many low-quality (high VaR) positions."""
     violations = []
@@ -83,6 +91,7 @@ def check_var_quality(df):
     return violations
 
 
+@instrumentation.timed('correlation')
 def get_corr_mat(df, output_file='corr_mat.png'):
     """
     Generate correlation matrix heatmap for portfolio holdings.
@@ -93,7 +102,7 @@ def get_corr_mat(df, output_file='corr_mat.png'):
     """
     try:
         logger.info("Fetching price data for correlation analysis...")
-        data = pdr.get_data_yahoo(df['Symbol'], start="2022-01-01", end=dt.date.today())['Close']
+        data = market_data.get_provider().get_history(df['Symbol'].tolist(), start="2022-01-01", end=dt.date.today())
         corr = data.corr()
 
         # Create mask for upper triangle
@@ -108,7 +117,8 @@ def get_corr_mat(df, output_file='corr_mat.png'):
             vmax=.3, vmin=-.3, center=0, square=True,
             linewidths=.5, cbar_kws={"shrink": .5}
         )
-        f.savefig(output_file)
+        with instrumentation.stage('render'):
+            f.savefig(output_file)
         logger.info(f"Correlation matrix saved to {output_file}")
         plt.close(f)
 
@@ -117,10 +127,11 @@ def get_corr_mat(df, output_file='corr_mat.png'):
         raise
 
 
-if __name__ == '__main__':
+def run():
     try:
         logger.info("Running portfolio extremity checks...")
-        df = pd.read_excel(config.PORTFOLIO_PATH_TRANSFORMED)
+        with instrumentation.stage('excel_read'):
+            df = pd.read_excel(config.PORTFOLIO_PATH_TRANSFORMED)
 
         # Run all checks
         check_sectors(df)
@@ -136,3 +147,7 @@ if __name__ == '__main__':
     except Exception as e:
         logger.error(f"Error running extremity checks: {e}", exc_info=True)
         raise
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(run, 'extremities')
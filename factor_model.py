@@ -0,0 +1,235 @@
+"""
+Market plus sector factor model for portfolio VaR.
+Each ticker loads on an equal-weighted market factor and on its own sector's
+excess return. Portfolio variance is b'Fb + sum(w^2 d) with b = B'w, so the
+n x n covariance matrix is never built and cost grows as O(n * k).
+
+Usage:
+    python factor_model.py              # holdings only
+    python factor_model.py --universe   # estimate factors from the whole master list
+    python factor_model.py --universe "S&P 500"
+"""
+import argparse
+import datetime as dt
+import logging
+
+import numpy as np
+import pandas as pd
+
+import config
+import instrumentation
+import market_data
+import universe
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MARKET = 'Market'
+
+
+class FactorModel:
+    """
+    Fitted loadings, factor covariance and idiosyncratic variances.
+
+    B is stored sparsely: every ticker has a market beta and at most one
+    sector beta, identified by its sector group (-1 = market only).
+    """
+
+    def __init__(self, symbols, sector_names, group, beta_market, beta_sector, idio_var, factor_cov, mean):
+        self.symbols = pd.Index(symbols)
+        self.sector_names = list(sector_names)
+        self.group = group
+        self.beta_market = beta_market
+        self.beta_sector = beta_sector
+        self.idio_var = idio_var
+        self.factor_cov = factor_cov
+        self.mean = mean
+
+    @property
+    def factor_names(self):
+        return [MARKET] + self.sector_names
+
+    @classmethod
+    @instrumentation.timed('factor_fit')
+    def fit(cls, returns, sectors, min_sector_size=None):
+        """
+        Estimate factor returns, loadings and idiosyncratic variances.
+
+        Args:
+            returns: DataFrame of daily returns (dates x symbols); gaps may be NaN
+            sectors: Series or dict of symbol -> sector name; unknown symbols and
+                sectors with fewer than min_sector_size members load on the market only
+            min_sector_size: Members needed before a sector gets its own factor
+                (default: config.FACTOR_MIN_SECTOR_SIZE)
+
+        Returns:
+            FactorModel
+        """
+        min_sector_size = min_sector_size or config.FACTOR_MIN_SECTOR_SIZE
+        # A regression on [1, market, sector] needs at least 3 returns; shorter histories would make it singular
+        short = returns.notna().sum(axis=0) < 3
+        if short.any():
+            logger.warning(f"Fewer than 3 returns for {list(returns.columns[short])}; left out of the factor model")
+            returns = returns.loc[:, ~short]
+        if returns.shape[1] == 0:
+            raise ValueError("No symbol has enough returns to fit the factor model")
+        symbols = returns.columns
+        r = returns.to_numpy(dtype=np.float64)
+        valid = ~np.isnan(r)
+        rz = np.where(valid, r, 0.0)
+        vf = valid.astype(np.float64)
+
+        # Equal-weighted market factor
+        counts = vf.sum(axis=1)
+        market = np.divide(rz.sum(axis=1), counts, out=np.zeros(len(r)), where=counts > 0)
+
+        labels = pd.Series(sectors).reindex(symbols)
+        sizes = labels.value_counts()
+        sector_names = sorted(sizes.index[sizes >= min_sector_size])
+        lookup = {name: j for j, name in enumerate(sector_names)}
+        group = np.array([lookup.get(label, -1) for label in labels], dtype=np.intp)
+
+        # Sector factors: equal-weighted sector return in excess of the market
+        member = np.zeros((len(symbols), len(sector_names)))
+        in_sector = group >= 0
+        member[np.flatnonzero(in_sector), group[in_sector]] = 1.0
+        sector_counts = vf @ member
+        sector_sums = rz @ member
+        sector_ret = np.divide(sector_sums, sector_counts, out=np.zeros_like(sector_sums), where=sector_counts > 0)
+        sector_ret = np.where(sector_counts > 0, sector_ret - market[:, None], 0.0)
+
+        # Per-ticker OLS of r on [1, market, own sector] from masked sums
+        x2 = sector_ret[:, np.maximum(group, 0)] * in_sector
+        n = vf.sum(axis=0)
+        s1 = market @ vf
+        s2 = (x2 * vf).sum(axis=0)
+        s11 = (market ** 2) @ vf
+        s22 = (x2 ** 2 * vf).sum(axis=0)
+        s12 = ((x2 * market[:, None]) * vf).sum(axis=0)
+        sy = rz.sum(axis=0)
+        s1y = market @ rz
+        s2y = (x2 * rz).sum(axis=0)
+        syy = (rz ** 2).sum(axis=0)
+
+        # Market-only tickers get an identity row for the sector coefficient, which solves to 0
+        s22 = np.where(in_sector, s22, 1.0)
+        xtx = np.stack([np.stack([n, s1, s2], -1), np.stack([s1, s11, s12], -1), np.stack([s2, s12, s22], -1)], 1)
+        xty = np.stack([sy, s1y, s2y], -1)
+        try:
+            coef = np.linalg.solve(xtx, xty[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            # A regressor constant over a ticker's returns; the pseudo-inverse gives the minimum-norm fit
+            logger.warning("Singular regression for some tickers; using least-squares loadings")
+            coef = (np.linalg.pinv(xtx) @ xty[..., None])[..., 0]
+        rss = syy - np.einsum('nk,nk->n', coef, xty)
+        dof = np.maximum(n - np.where(in_sector, 3, 2), 1)
+        idio_var = np.maximum(rss, 0.0) / dof
+
+        factors = np.column_stack([market, sector_ret])[counts > 0]
+        factor_cov = np.atleast_2d(np.cov(factors, rowvar=False))
+        mean = np.divide(sy, n, out=np.zeros_like(sy), where=n > 0)
+
+        logger.info(f"Fitted {len(symbols)} tickers on market + {len(sector_names)} sector factors "
+                    f"({int(in_sector.sum())} with a sector loading)")
+        return cls(symbols, sector_names, group, coef[:, 1], coef[:, 2], idio_var, factor_cov, mean)
+
+    def _weights(self, weights):
+        """Align a weight Series (symbol -> dollars) to the model; absent symbols get 0."""
+        if isinstance(weights, pd.Series):
+            missing = weights.index.difference(self.symbols)
+            if len(missing):
+                logger.warning(f"No factor loadings for {list(missing)}; excluded")
+            weights = weights.reindex(self.symbols).fillna(0.0).to_numpy(dtype=np.float64)
+        return np.asarray(weights, dtype=np.float64)
+
+    def exposures(self, weights):
+        """Factor exposures b = B'w: market first, then one entry per sector."""
+        w = self._weights(weights)
+        in_sector = self.group >= 0
+        sector = np.bincount(self.group[in_sector], weights=(w * self.beta_sector)[in_sector],
+                             minlength=len(self.sector_names))
+        return np.concatenate(([w @ self.beta_market], sector))
+
+    def decompose(self, weights):
+        """Portfolio variance split into factor and idiosyncratic parts."""
+        w = self._weights(weights)
+        b = self.exposures(w)
+        market_var = b[0] ** 2 * self.factor_cov[0, 0]
+        factor_var = b @ self.factor_cov @ b
+        idio_var = (w ** 2) @ self.idio_var
+        return {'market': float(market_var), 'sector': float(factor_var - market_var),
+                'factor': float(factor_var), 'idiosyncratic': float(idio_var),
+                'total': float(factor_var + idio_var)}
+
+    def portfolio_variance(self, weights):
+        return self.decompose(weights)['total']
+
+    def var(self, weights, confidence=None):
+        """1-day parametric VaR of a dollar-weighted portfolio."""
+        confidence = confidence or config.CONFIDENCE_LEVEL
+        w = self._weights(weights)
+        return float(-w @ self.mean + stats.norm.ppf(confidence) * np.sqrt(self.portfolio_variance(w)))
+
+    def covariance(self, symbols):
+        """Model-implied covariance for a small subset of symbols, e.g. for a heatmap."""
+        idx = self.symbols.get_indexer(symbols)
+        k = len(self.factor_names)
+        loadings = np.zeros((len(idx), k))
+        loadings[:, 0] = self.beta_market[idx]
+        has_sector = self.group[idx] >= 0
+        loadings[np.flatnonzero(has_sector), 1 + self.group[idx][has_sector]] = self.beta_sector[idx][has_sector]
+        cov = loadings @ self.factor_cov @ loadings.T + np.diag(self.idio_var[idx])
+        return pd.DataFrame(cov, index=symbols, columns=symbols)
+
+    def loadings(self):
+        """Per-ticker loadings and idiosyncratic volatility as a DataFrame."""
+        names = np.array(self.sector_names + [''], dtype=object)
+        return pd.DataFrame({
+            'Symbol': self.symbols,
+            'Sector': names[self.group],
+            'BetaMarket': self.beta_market,
+            'BetaSector': self.beta_sector,
+            'IdioVol': np.sqrt(self.idio_var),
+        })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Factor-model portfolio VaR")
+    parser.add_argument('--portfolio', default=config.PORTFOLIO_PATH_TRANSFORMED)
+    parser.add_argument('--universe', nargs='*',
+                        help="Also estimate factors from every ticker in the master list, "
+                             "or in the named TradingView lists / asset classes")
+    parser.add_argument('--start', default=config.START_DATE_FOR_VAR)
+    args = parser.parse_args(argv)
+
+    portfolio = pd.read_excel(args.portfolio)
+    weights = portfolio.groupby('Symbol')['Amount'].sum()
+    sectors = portfolio.drop_duplicates('Symbol').set_index('Symbol')['Sector']
+    symbols = weights.index.tolist()
+    if args.universe:
+        symbols += universe.select(args.universe, asset_class='equity').symbols
+    elif args.universe is not None:
+        symbols += pd.read_excel(config.ALL_TICKERS_PATH)['Symbol'].dropna().astype(str).tolist()
+
+    closes = market_data.get_provider().get_history(list(dict.fromkeys(symbols)), start=args.start,
+                                                    end=dt.date.today())
+    returns = closes.pct_change(fill_method=None).iloc[1:]
+    model = FactorModel.fit(returns, sectors)
+    parts = model.decompose(weights)
+    total = parts['total']
+    logger.info(f"\n{model.loadings().set_index('Symbol').loc[weights.index.intersection(model.symbols)]}")
+    logger.info(f"Factor-model 1-day VaR: {model.var(weights):,.0f} "
+                f"(variance share: market {parts['market'] / total:.0%}, sector {parts['sector'] / total:.0%}, "
+                f"idiosyncratic {parts['idiosyncratic'] / total:.0%})")
+    return model
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(main, 'factor_model')
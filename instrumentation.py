@@ -0,0 +1,229 @@
+"""
+Stage-level instrumentation for VarProject runs.
+Records wall time and call counts per stage, cache hits/misses and bytes fetched,
+and writes them as a JSON run report and a Prometheus text-format file. Entry
+points started through run_main() also accept --profile.
+"""
+import datetime as dt
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+import config
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_stages = defaultdict(lambda: {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+_counters = defaultdict(int)
+_cache = defaultdict(lambda: {'hits': 0, 'misses': 0})
+_bytes = defaultdict(int)
+_started = time.time()
+
+
+@contextmanager
+def stage(name):
+    """Time a block of work under a stage name; nested stages are recorded separately."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            record = _stages[name]
+            record['calls'] += 1
+            record['seconds'] += elapsed
+            record['max_seconds'] = max(record['max_seconds'], elapsed)
+
+
+def timed(name, report=None):
+    """
+    Decorator form of stage().
+
+    Args:
+        name: Stage name
+        report: Run name whose report is rewritten after every call; used by
+            long-running processes such as the bot, which never reach exit
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                with stage(name):
+                    return func(*args, **kwargs)
+            finally:
+                if report:
+                    try:
+                        write_report(report)
+                    except OSError as e:
+                        logger.warning(f"Could not write metrics report: {e}")
+        return wrapper
+    return decorator
+
+
+def count(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def cache_hit(name, amount=1):
+    with _lock:
+        _cache[name]['hits'] += amount
+
+
+def cache_miss(name, amount=1):
+    with _lock:
+        _cache[name]['misses'] += amount
+
+
+def add_bytes(source, amount):
+    """Record bytes fetched from a data source (network payload or file size)."""
+    with _lock:
+        _bytes[source] += int(amount)
+
+
+def reset():
+    global _started
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _cache.clear()
+        _bytes.clear()
+        _started = time.time()
+
+
+def snapshot():
+    """Return all metrics recorded so far as a plain dictionary."""
+    with _lock:
+        return {
+            'started': dt.datetime.fromtimestamp(_started).isoformat(timespec='seconds'),
+            'duration_seconds': time.time() - _started,
+            'stages': {name: dict(record) for name, record in _stages.items()},
+            'counters': dict(_counters),
+            'cache': {name: dict(record) for name, record in _cache.items()},
+            'bytes_fetched': dict(_bytes),
+        }
+
+
+def _prometheus_text(run_name, metrics):
+    label = f'run="{run_name}"'
+    lines = [
+        '# HELP varproject_run_duration_seconds Wall time of the run.',
+        '# TYPE varproject_run_duration_seconds gauge',
+        f'varproject_run_duration_seconds{{{label}}} {metrics["duration_seconds"]:.6f}',
+        '# HELP varproject_stage_seconds_total Wall time spent per stage.',
+        '# TYPE varproject_stage_seconds_total counter',
+    ]
+    lines += [f'varproject_stage_seconds_total{{{label},stage="{name}"}} {r["seconds"]:.6f}'
+              for name, r in metrics['stages'].items()]
+    lines += ['# HELP varproject_stage_calls_total Calls per stage.', '# TYPE varproject_stage_calls_total counter']
+    lines += [f'varproject_stage_calls_total{{{label},stage="{name}"}} {r["calls"]}'
+              for name, r in metrics['stages'].items()]
+    lines += ['# HELP varproject_cache_hits_total Cache hits.', '# TYPE varproject_cache_hits_total counter']
+    lines += [f'varproject_cache_hits_total{{{label},cache="{name}"}} {r["hits"]}'
+              for name, r in metrics['cache'].items()]
+    lines += ['# HELP varproject_cache_misses_total Cache misses.', '# TYPE varproject_cache_misses_total counter']
+    lines += [f'varproject_cache_misses_total{{{label},cache="{name}"}} {r["misses"]}'
+              for name, r in metrics['cache'].items()]
+    lines += ['# HELP varproject_bytes_fetched_total Bytes fetched per data source.',
+              '# TYPE varproject_bytes_fetched_total counter']
+    lines += [f'varproject_bytes_fetched_total{{{label},source="{name}"}} {value}'
+              for name, value in metrics['bytes_fetched'].items()]
+    lines += ['# HELP varproject_events_total Event counters.', '# TYPE varproject_events_total counter']
+    lines += [f'varproject_events_total{{{label},event="{name}"}} {value}'
+              for name, value in metrics['counters'].items()]
+    return '\n'.join(lines) + '\n'
+
+
+def write_report(run_name, metrics_dir=None):
+    """
+    Write the current metrics for a run.
+
+    Creates <metrics_dir>/<run_name>_run.json and <metrics_dir>/<run_name>.prom;
+    the .prom file is overwritten each run so a Prometheus textfile collector
+    always sees the latest values.
+    """
+    metrics_dir = Path(metrics_dir or config.METRICS_DIR)
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    metrics = snapshot()
+    metrics['run'] = run_name
+    json_path = metrics_dir / f'{run_name}_run.json'
+    prom_path = metrics_dir / f'{run_name}.prom'
+    with open(json_path, 'w') as fp:
+        json.dump(metrics, fp, indent=2)
+    with open(prom_path, 'w') as fp:
+        fp.write(_prometheus_text(run_name, metrics))
+
+    slowest = sorted(metrics['stages'].items(), key=lambda item: item[1]['seconds'], reverse=True)
+    summary = ', '.join(f"{name} {r['seconds']:.2f}s/{r['calls']}" for name, r in slowest[:6])
+    logger.info(f"Run {run_name} took {metrics['duration_seconds']:.2f}s ({summary}); "
+                f"metrics written to {json_path} and {prom_path}")
+    return json_path, prom_path
+
+
+def _profile(func, run_name, profiler):
+    profiles_dir = Path(config.METRICS_DIR) / 'profiles'
+    profiles_dir.mkdir(parents=True, exist_ok=True)
+    stamp = dt.datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    if profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        prof = Profiler()
+        prof.start()
+        try:
+            return func()
+        finally:
+            prof.stop()
+            path = profiles_dir / f'{run_name}_{stamp}.html'
+            path.write_text(prof.output_html())
+            logger.info(f"pyinstrument profile written to {path}")
+
+    import cProfile
+    import pstats
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(func)
+    finally:
+        path = profiles_dir / f'{run_name}_{stamp}.prof'
+        prof.dump_stats(str(path))
+        stats = pstats.Stats(prof).sort_stats('cumulative')
+        logger.info(f"cProfile stats written to {path} (view with: python -m pstats {path})")
+        stats.print_stats(25)
+
+
+def run_main(func, run_name):
+    """
+    Run an entry point with metrics reporting and an optional --profile switch.
+
+    --profile runs it under cProfile; --profile=pyinstrument uses pyinstrument.
+    The flag is removed from sys.argv before func runs so argument parsers in
+    the entry point do not see it.
+    """
+    profiler = None
+    for arg in list(sys.argv[1:]):
+        if arg == '--profile' or arg.startswith('--profile='):
+            profiler = arg.partition('=')[2] or 'cprofile'
+            sys.argv.remove(arg)
+
+    reset()
+    try:
+        with stage('total'):
+            if profiler:
+                return _profile(func, run_name, profiler)
+            return func()
+    finally:
+        try:
+            write_report(run_name)
+        except OSError as e:
+            logger.warning(f"Could not write metrics report: {e}")
@@ -0,0 +1,213 @@
+"""
+Intraday Value at Risk on hourly or minute bars.
+Reads bars from the local bar store, separates in-session returns from overnight
+gaps, and values the whole portfolio in one batch with horizon scaling.
+
+Usage:
+    python intraday_var.py sync                 # append new bars to the local store
+    python intraday_var.py --horizon 3          # 3-bar VaR, same session
+    python intraday_var.py --horizon 7 --overnights 1
+"""
+import argparse
+import datetime as dt
+import logging
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+import config
+import instrumentation
+import market_data
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MARKET_TZ = ZoneInfo('America/New_York')
+
+# Yahoo only serves recent intraday history
+MAX_INTRADAY_DAYS = {'1m': 7, '2m': 59, '5m': 59, '15m': 59, '30m': 59, '60m': 729, '90m': 59, '1h': 729}
+
+
+def sync_bars(symbols, interval=None, lookback_days=None, source=None, store=None):
+    """
+    Append bars newer than the local store's last bar for each symbol.
+
+    Symbols with nothing stored get lookback_days of history; the rest re-fetch
+    from their oldest last bar so a revised final bar is overwritten.
+
+    Args:
+        symbols: Tickers to sync
+        interval: Bar size (default: config.INTRADAY_VAR_INTERVAL)
+        lookback_days: History for symbols not yet stored
+        source: Provider to download from (default: a YahooProvider)
+        store: LocalFileProvider to write to (default: config.MARKET_DATA_DIR)
+
+    Returns:
+        Dict of symbol -> number of stored bars
+    """
+    interval = interval or config.INTRADAY_VAR_INTERVAL
+    lookback_days = lookback_days or config.INTRADAY_VAR_LOOKBACK_DAYS
+    source = source or market_data.YahooProvider()
+    store = store or market_data.LocalFileProvider()
+    today = dt.datetime.now(dt.timezone.utc)
+
+    earliest = today - dt.timedelta(days=min(lookback_days, MAX_INTRADAY_DAYS.get(interval, lookback_days)))
+    last = {symbol: store.last_bar_time(symbol, interval) for symbol in dict.fromkeys(symbols)}
+    known = [t for t in last.values() if t is not None]
+    start = earliest if len(known) < len(last) else max(min(known), earliest)
+
+    logger.info(f"Syncing {interval} bars for {len(last)} symbols since {start:%Y-%m-%d %H:%M}")
+    panel = source.get_bar_panel(list(last), start=start.date(), end=(today + dt.timedelta(days=1)).date(),
+                                 interval=interval)
+    stored = {}
+    for symbol in last:
+        if symbol not in panel['Close'].columns:
+            logger.warning(f"No {interval} bars returned for {symbol}")
+            continue
+        bars = pd.DataFrame({field: panel[field][symbol] for field in market_data.BAR_COLUMNS}).dropna(subset=['Close'])
+        stored[symbol] = store.append_bars(symbol, bars, interval)
+    logger.info(f"Local {interval} store updated for {len(stored)} symbols")
+    return stored
+
+
+def session_returns(opens, closes):
+    """
+    Split bar returns into in-session and overnight parts.
+
+    Args:
+        opens: DataFrame of bar opens (bar time x symbols), tz-aware index
+        closes: DataFrame of bar closes, same shape
+
+    Returns:
+        (intraday, overnight): intraday holds close-to-close returns within a
+        session, with the first bar measured from its own open; overnight holds
+        one row per session, from the prior session's last close to this
+        session's first open.
+    """
+    session = pd.Index(closes.index.tz_convert(MARKET_TZ).date)
+    first_bar = session != np.roll(session, 1)
+    first_bar[0] = True
+
+    previous = closes.shift(1).to_numpy()
+    base = np.where(first_bar[:, None], opens.to_numpy(), previous)
+    intraday = pd.DataFrame(closes.to_numpy() / base - 1, index=closes.index, columns=closes.columns)
+
+    first_open = opens.groupby(session).first()
+    last_close = closes.groupby(session).last()
+    overnight = (first_open / last_close.shift(1) - 1).iloc[1:]
+    return intraday, overnight
+
+
+def horizon_moments(intraday, overnight, horizon_bars=1, overnights=0):
+    """
+    Mean vector and covariance matrix of an h-bar return spanning k overnight gaps.
+
+    Bar returns are treated as independent, so means and covariances scale
+    linearly in the number of bars, and each overnight gap adds its own moments
+    instead of being spread across the session bars.
+    """
+    mean = horizon_bars * intraday.mean()
+    cov = horizon_bars * intraday.cov()
+    if overnights:
+        mean = mean + overnights * overnight.mean().reindex(mean.index).fillna(0.0)
+        cov = cov + overnights * overnight.cov().reindex(index=cov.index, columns=cov.columns).fillna(0.0)
+    return mean, cov
+
+
+@instrumentation.timed('intraday_var')
+def intraday_var(amounts, opens, closes, horizon_bars=None, overnights=0, confidence=None):
+    """
+    Position and portfolio VaR over an intraday horizon.
+
+    Args:
+        amounts: Series of signed dollar exposure per symbol (short = negative)
+        opens, closes: Bar panels from the local store
+        horizon_bars: Holding horizon in bars (default: config.INTRADAY_VAR_HORIZON_BARS)
+        overnights: Overnight gaps inside the horizon
+        confidence: VaR confidence level (default: config.CONFIDENCE_LEVEL)
+
+    Returns:
+        (positions, summary): per-symbol DataFrame with bar and overnight
+        volatility and standalone VaR, and a dict with the diversified
+        portfolio VaR
+    """
+    horizon_bars = horizon_bars or config.INTRADAY_VAR_HORIZON_BARS
+    confidence = confidence or config.CONFIDENCE_LEVEL
+    symbols = [s for s in amounts.index if s in closes.columns]
+    missing = sorted(set(amounts.index) - set(symbols))
+    if missing:
+        logger.warning(f"No local bars for {missing}; excluded from intraday VaR")
+
+    intraday, overnight = session_returns(opens[symbols], closes[symbols])
+    mean, cov = horizon_moments(intraday, overnight, horizon_bars, overnights)
+    a = amounts[symbols].to_numpy(dtype=np.float64)
+    mu = mean.to_numpy()
+    sigma = cov.to_numpy()
+    z = stats.norm.ppf(confidence)
+
+    standalone = -a * mu + z * np.abs(a) * np.sqrt(np.diag(sigma))
+    portfolio = -a @ mu + z * np.sqrt(a @ sigma @ a)
+
+    positions = pd.DataFrame({
+        'Symbol': symbols,
+        'Amount': a,
+        'BarVol': intraday.std().to_numpy(),
+        'OvernightVol': overnight.std().reindex(symbols).to_numpy(),
+        'Bars': intraday.notna().sum().to_numpy(),
+        'Var': standalone,
+    }).sort_values(by='Var').reset_index(drop=True)
+    summary = {
+        'horizon_bars': horizon_bars,
+        'overnights': overnights,
+        'confidence': confidence,
+        'portfolio_var': float(portfolio),
+        'standalone_var': float(standalone.sum()),
+        'diversification': float(standalone.sum() - portfolio),
+        'last_bar': str(closes.index.max()),
+    }
+    return positions, summary
+
+
+def load_portfolio_amounts(path=None):
+    """Signed dollar exposure per symbol from the transformed portfolio."""
+    df = pd.read_excel(path or config.PORTFOLIO_PATH_TRANSFORMED)
+    return df.groupby('Symbol')['Amount'].sum()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Intraday VaR from the local bar store")
+    parser.add_argument('command', nargs='?', default='var', choices=['var', 'sync'])
+    parser.add_argument('--interval', default=config.INTRADAY_VAR_INTERVAL, help="Bar size, e.g. 1h or 5m")
+    parser.add_argument('--horizon', type=int, default=config.INTRADAY_VAR_HORIZON_BARS, help="Horizon in bars")
+    parser.add_argument('--overnights', type=int, default=0, help="Overnight gaps inside the horizon")
+    parser.add_argument('--lookback', type=int, default=config.INTRADAY_VAR_LOOKBACK_DAYS, help="Days of bars used")
+    parser.add_argument('--portfolio', default=config.PORTFOLIO_PATH_TRANSFORMED)
+    args = parser.parse_args(argv)
+
+    amounts = load_portfolio_amounts(args.portfolio)
+    if args.command == 'sync':
+        sync_bars(amounts.index.tolist(), args.interval, args.lookback)
+        return
+
+    store = market_data.LocalFileProvider()
+    start = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=args.lookback)
+    panel = store.get_bar_panel(amounts.index.tolist(), start=start, interval=args.interval,
+                                fields=['Open', 'Close'])
+    positions, summary = intraday_var(amounts, panel['Open'], panel['Close'], args.horizon, args.overnights)
+    logger.info(f"\n{positions}")
+    logger.info(f"{args.horizon}-bar ({args.interval}) VaR with {args.overnights} overnight gap(s): "
+                f"portfolio {summary['portfolio_var']:,.0f}, sum of positions {summary['standalone_var']:,.0f}, "
+                f"diversification {summary['diversification']:,.0f} (bars through {summary['last_bar']})")
+    return positions, summary
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(main, 'intraday_var')
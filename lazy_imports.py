@@ -0,0 +1,61 @@
+"""
+Deferred imports for heavy dependencies.
+lazy_import() returns a module proxy that performs the real import on first
+attribute access, so a script only pays for scipy, matplotlib, seaborn or
+openpyxl when it reaches a code path that uses them.
+"""
+import importlib
+import threading
+
+
+class _LazyModule:
+    """Stand-in for a module that is imported on first attribute access."""
+
+    __slots__ = ('_name', '_on_import', '_module', '_lock')
+
+    def __init__(self, name, on_import=None):
+        self._name = name
+        self._on_import = on_import
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_import:
+                        self._on_import(module)
+                    # Publish only after the hook ran so no caller sees a half-configured module
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def load(proxy):
+    """Import a lazy module now and return the real module."""
+    return proxy._load()
+
+
+def lazy_import(name, on_import=None):
+    """
+    Return a proxy for a module that is imported on first use.
+
+    Args:
+        name: Dotted module name, e.g. 'scipy.stats' or 'matplotlib.pyplot'
+        on_import: Optional callable run once with the real module right after
+            it is imported, e.g. to select a matplotlib backend or style
+
+    Returns:
+        Proxy that forwards attribute access to the real module
+    """
+    return _LazyModule(name, on_import)
@@ -0,0 +1,321 @@
+"""
+Historical replay of the extremities limits over past portfolio states.
+Daily positions are rebuilt from the pairs trade log (pairsPositions.xlsx) and
+from dated broker exports, marked to market with cached closes, and every
+limit rule is evaluated for all dates at once. The result is a timeline of
+exposure, concentration and breaches, so thresholds such as
+SECTOR_PERCENTAGE_LIMIT can be tuned against what the book actually did.
+
+Exports are snapshots: a file named e.g. actualportfolio_2024-05-31.csv holds
+from that date until the next export.
+
+Usage:
+    python limit_replay.py                                   # pairs trade log
+    python limit_replay.py --exports --no-pairs               # dated exports in PORTFOLIO_EXPORTS_DIR
+    python limit_replay.py --limit SECTOR_PERCENTAGE_LIMIT=0.25
+    python limit_replay.py --sweep SECTOR_PERCENTAGE_LIMIT=0.15,0.2,0.25,0.3
+"""
+import argparse
+import datetime as dt
+import logging
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+import instrumentation
+import market_data
+import portfolio_state
+import universe
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Rule -> (timeline measure, config threshold); each extremities check in turn
+RULES = {
+    'Sector': ('MaxSector', 'SECTOR_PERCENTAGE_LIMIT'),
+    'Position': ('MaxPosition', 'MAX_POSITION_PERCENTAGE'),
+    'Count': ('Positions', 'MAX_PORTFOLIO_SIZE'),
+    'Exposure': ('Gross', 'MAX_PORTFOLIO_EXPOSURE'),
+    'BadQuality': ('BadPositions', 'ALLOWED_BAD_POSITIONS'),
+    'GoodRatio': ('GoodRatio', 'ALLOWED_RATIO_GOOD_TO_TOTAL'),
+}
+# Breached when the measure falls below the threshold rather than above it
+LOWER_BOUND_RULES = {'GoodRatio'}
+DATE_PATTERN = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})')
+
+
+def yahoo_ticker(entry):
+    """Yahoo ticker for a trade-log entry such as 'NYSE:YETI'."""
+    mapped = universe.normalize(entry)
+    return mapped[0] if mapped else entry.split(':')[-1].strip()
+
+
+def read_pairs_log(path=None, shares=None):
+    """
+    Leg events from the pairs trade log.
+
+    The workbook holds one block per pair side by side: the pair name, a
+    Date / Ticker / Operation / Open price header and two rows per trade. Buy
+    and Sell open a leg of shares shares, Close and Timeout flatten it.
+
+    Args:
+        path: Trade log workbook (default: config.PAIRS_POSITIONS_PATH)
+        shares: Shares per leg (default: config.POSITION_SIZE, as the live trader sizes entries)
+
+    Returns:
+        DataFrame of Date, Leg, Symbol and Target (signed shares held after the event), in log order
+    """
+    path = path or config.PAIRS_POSITIONS_PATH
+    shares = shares or config.POSITION_SIZE
+    sheet = pd.read_excel(path, header=None)
+    cells = sheet.to_numpy(dtype=object)
+    frames = []
+    for row, col in zip(*np.nonzero(cells == 'Date')):
+        if col + 2 >= cells.shape[1] or cells[row, col + 1] != 'Ticker' or cells[row, col + 2] != 'Operation':
+            continue
+        block = pd.DataFrame(cells[row + 1:, col:col + 3], columns=['Date', 'Ticker', 'Operation'])
+        ends = np.flatnonzero(block['Date'].isna().to_numpy())
+        block = block.iloc[:ends[0] if len(ends) else len(block)]
+        operation = block['Operation'].astype(str).str.strip()
+        frames.append(pd.DataFrame({
+            'Date': pd.to_datetime(block['Date']),
+            'Leg': f'{row}:{col}:' + block['Ticker'].astype(str),
+            'Symbol': block['Ticker'].astype(str).map(yahoo_ticker),
+            'Target': np.select([operation == 'Buy', operation == 'Sell'], [shares, -shares], 0.0),
+        }))
+    if not frames:
+        raise ValueError(f"No trade blocks (Date / Ticker / Operation) found in {path}")
+    events = pd.concat(frames, ignore_index=True)
+    logger.info(f"Read {len(events)} leg events for {len(frames)} pairs from {path}")
+    return events
+
+
+def read_exports(directory=None):
+    """
+    Position snapshots from dated broker exports.
+
+    Args:
+        directory: Directory of broker CSV exports with a YYYY-MM-DD or YYYYMMDD
+            date in each file name (default: config.PORTFOLIO_EXPORTS_DIR)
+
+    Returns:
+        DataFrame of snapshot dates x symbols with signed shares, 0 where not held
+    """
+    directory = Path(directory or config.PORTFOLIO_EXPORTS_DIR)
+    snapshots = {}
+    for path in sorted(directory.glob('*.csv')):
+        match = DATE_PATTERN.search(path.stem)
+        if not match:
+            logger.warning(f"Skipping {path.name}: no date in the file name")
+            continue
+        export = portfolio_state.read_export(path)
+        snapshots[pd.Timestamp(*map(int, match.groups()))] = export.groupby('Symbol')['Position'].sum()
+    if not snapshots:
+        raise ValueError(f"No dated broker exports found in {directory}")
+    logger.info(f"Read {len(snapshots)} broker exports from {directory}")
+    return pd.DataFrame(snapshots).T.sort_index().fillna(0.0)
+
+
+def _positions_on(dates, events=None, snapshots=None):
+    """Signed shares held at each close (dates x symbols) from leg events and export snapshots."""
+    books = []
+    if events is not None and len(events):
+        # An event on a non-trading day takes effect at the next close; same-day events keep log order
+        rows = dates.searchsorted(events['Date'].to_numpy())
+        events = events.assign(Row=rows)[rows < len(dates)]
+        legs = events.groupby(['Row', 'Leg'], sort=False)['Target'].last().unstack('Leg')
+        legs = legs.reindex(range(len(dates))).ffill().fillna(0.0)
+        symbols = events.drop_duplicates('Leg').set_index('Leg')['Symbol']
+        books.append(legs.T.groupby(symbols.reindex(legs.columns).to_numpy()).sum().T)
+    if snapshots is not None and len(snapshots):
+        rows = dates.searchsorted(snapshots.index.to_numpy())
+        held = snapshots.groupby(rows).last()
+        books.append(held[held.index < len(dates)].reindex(range(len(dates))).ffill().fillna(0.0))
+    if not books:
+        raise ValueError("Nothing to replay: give a pairs trade log and/or broker exports")
+    positions = pd.concat(books, axis=1).T.groupby(level=0).sum().T
+    positions.index = dates
+    return positions
+
+
+def _quality(symbols, path=None):
+    """Current Qual labels from the master list; point-in-time labels are not kept."""
+    path = path or config.ALL_TICKERS_PATH
+    if not os.path.exists(path):
+        return pd.Series('UNKNOWN', index=symbols)
+    labels = pd.read_excel(path).drop_duplicates('Symbol').set_index('Symbol')['Qual']
+    return labels.reindex(symbols).fillna('UNKNOWN')
+
+
+@instrumentation.timed('limit_replay')
+def replay(positions, closes, sectors, quality, net_liquidity=None):
+    """
+    Exposure and concentration measures behind every limit rule, for each date.
+
+    Args:
+        positions: Signed shares (dates x symbols)
+        closes: Closes on the same dates; gaps are carried forward
+        sectors: Symbol -> sector
+        quality: Symbol -> GOOD / MID / BAD
+        net_liquidity: Denominator of the percentages (default: config.NET_LIQUIDITY)
+
+    Returns:
+        (timeline DataFrame indexed by date, sector exposure DataFrame dates x sectors)
+    """
+    net_liquidity = net_liquidity or config.NET_LIQUIDITY
+    symbols = positions.columns
+    prices = closes.reindex(index=positions.index, columns=symbols).ffill().to_numpy(dtype=np.float64)
+    shares = positions.to_numpy(dtype=np.float64)
+    held = shares != 0
+    unpriced = symbols[(held & np.isnan(prices)).any(axis=0)]
+    if len(unpriced):
+        logger.warning(f"No close for {list(unpriced)} on some held days; counted at 0 exposure there")
+    pct = np.abs(np.nan_to_num(shares * prices)) / net_liquidity
+
+    sector_labels = pd.Series(sectors).reindex(symbols).fillna('Unknown')
+    sector_names = sorted(sector_labels.unique())
+    member = (sector_labels.to_numpy()[:, None] == np.array(sector_names)[None, :]).astype(np.float64)
+    sector_pct = pct @ member
+
+    labels = pd.Series(quality).reindex(symbols).to_numpy()
+    counts = held.astype(np.int64)
+    good = counts @ (labels == 'GOOD')
+    mid = counts @ (labels == 'MID')
+    total = good + mid
+
+    any_held = held.any(axis=1)
+    timeline = pd.DataFrame({
+        'Positions': held.sum(axis=1),
+        'Gross': pct.sum(axis=1),
+        'MaxPosition': pct.max(axis=1, initial=0.0),
+        'MaxPositionSymbol': np.where(any_held, np.asarray(symbols)[pct.argmax(axis=1)], ''),
+        'MaxSector': sector_pct.max(axis=1, initial=0.0),
+        'MaxSectorName': np.where(any_held, np.array(sector_names)[sector_pct.argmax(axis=1)], ''),
+        'BadPositions': counts @ (labels == 'BAD'),
+        'GoodRatio': np.divide(good, total, out=np.full(len(total), np.nan), where=total > 0),
+    }, index=positions.index)
+    return timeline, pd.DataFrame(sector_pct, index=positions.index, columns=sector_names)
+
+
+def limits(overrides=None):
+    """Threshold of each rule: config values, replaced by any overrides (config name -> value)."""
+    overrides = overrides or {}
+    return {name: float(overrides.get(name, getattr(config, name))) for _, name in RULES.values()}
+
+
+def breaches(timeline, thresholds=None):
+    """Boolean breach flags per rule and date; a GoodRatio of NaN (nothing held) never breaches."""
+    thresholds = thresholds or limits()
+    flags = {}
+    for rule, (measure, name) in RULES.items():
+        values = timeline[measure].to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore'):
+            flags[rule] = values < thresholds[name] if rule in LOWER_BOUND_RULES else values > thresholds[name]
+    return pd.DataFrame(flags, index=timeline.index)
+
+
+def episodes(timeline, flags):
+    """Runs of consecutive breached dates per rule with their length and worst measure."""
+    rows = []
+    for rule, (measure, _) in RULES.items():
+        flag = flags[rule].to_numpy()
+        edges = np.diff(np.concatenate(([0], flag.astype(np.int8), [0])))
+        starts, stops = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+        values = timeline[measure].to_numpy(dtype=np.float64)
+        worst = np.nanmin if rule in LOWER_BOUND_RULES else np.nanmax
+        rows += [{'Rule': rule, 'Start': timeline.index[i], 'End': timeline.index[j - 1], 'Days': j - i,
+                  'Worst': worst(values[i:j])} for i, j in zip(starts, stops)]
+    return pd.DataFrame(rows, columns=['Rule', 'Start', 'End', 'Days', 'Worst'])
+
+
+def sweep(timeline, name, values):
+    """Breach days and episodes of one rule for each candidate threshold."""
+    rule = next(rule for rule, (_, limit) in RULES.items() if limit == name)
+    rows = []
+    for value in values:
+        flags = breaches(timeline, limits({name: value}))
+        runs = episodes(timeline, flags)
+        rows.append({name: value, 'BreachDays': int(flags[rule].sum()), 'BreachShare': flags[rule].mean(),
+                     'Episodes': int((runs['Rule'] == rule).sum())})
+    return pd.DataFrame(rows)
+
+
+def _assignments(items, kind):
+    parsed = {}
+    for item in items:
+        name, _, value = item.partition('=')
+        if name not in limits():
+            raise ValueError(f"Unknown limit {name} in --{kind}; choose one of {list(limits())}")
+        parsed[name] = value
+    return parsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay the portfolio limits over past portfolio states")
+    parser.add_argument('--pairs', default=config.PAIRS_POSITIONS_PATH, help="Pairs trade log workbook")
+    parser.add_argument('--no-pairs', action='store_true', help="Leave the pairs trade log out")
+    parser.add_argument('--exports', nargs='?', const=config.PORTFOLIO_EXPORTS_DIR,
+                        help="Directory of dated broker CSV exports (default with no value: PORTFOLIO_EXPORTS_DIR)")
+    parser.add_argument('--start', help="First replayed date (default: first event)")
+    parser.add_argument('--end', default=dt.date.today().isoformat(), help="Last replayed date")
+    parser.add_argument('--net-liquidity', type=float, default=config.NET_LIQUIDITY)
+    parser.add_argument('--limit', action='append', default=[], metavar='NAME=VALUE',
+                        help="Override a threshold, e.g. SECTOR_PERCENTAGE_LIMIT=0.25")
+    parser.add_argument('--sweep', metavar='NAME=V1,V2,...', help="Breach counts for candidate values of one threshold")
+    parser.add_argument('--output', default=os.path.join('outputs', 'limit_replay.xlsx'))
+    args = parser.parse_args(argv)
+
+    thresholds = limits(_assignments(args.limit, 'limit'))
+    events = None if args.no_pairs else read_pairs_log(args.pairs)
+    snapshots = read_exports(args.exports) if args.exports else None
+    if events is None and snapshots is None:
+        parser.error("nothing to replay: drop --no-pairs or give --exports")
+    symbols, first = set(), []
+    if events is not None:
+        symbols |= set(events['Symbol'])
+        first.append(events['Date'].min())
+    if snapshots is not None:
+        symbols |= set(snapshots.columns)
+        first.append(snapshots.index.min())
+    start = pd.Timestamp(args.start) if args.start else min(first)
+
+    closes = market_data.get_provider().get_history(sorted(symbols), start=start.date(),
+                                                    end=pd.Timestamp(args.end).date() + dt.timedelta(days=1))
+    if closes.index.tz is not None:
+        # Trade and export dates are naive calendar dates
+        closes.index = closes.index.tz_localize(None)
+    positions = _positions_on(closes.index, events, snapshots)
+    sectors = {symbol: portfolio_state.lookup_sector(symbol) for symbol in positions.columns}
+    timeline, sector_exposure = replay(positions, closes, sectors, _quality(positions.columns), args.net_liquidity)
+
+    flags = breaches(timeline, thresholds)
+    timeline = timeline.join(flags.add_suffix('Breach'))
+    timeline['Breaches'] = flags.sum(axis=1)
+    runs = episodes(timeline, flags)
+    for rule, (_, name) in RULES.items():
+        logger.info(f"{rule:<10} {name} = {thresholds[name]:g}: breached on {flags[rule].mean():.1%} of "
+                    f"{len(flags)} days in {int((runs['Rule'] == rule).sum())} episodes")
+
+    sheets = {'Timeline': timeline, 'Sectors': sector_exposure, 'Episodes': runs}
+    if args.sweep:
+        (name, values), = _assignments([args.sweep], 'sweep').items()
+        sheets['Sweep'] = sweep(timeline, name, [float(v) for v in values.split(',')])
+        logger.info(f"\n{sheets['Sweep'].to_string(index=False)}")
+    with instrumentation.stage('excel_write'):
+        with pd.ExcelWriter(args.output) as writer:
+            for sheet, frame in sheets.items():
+                frame.to_excel(writer, sheet_name=sheet, index=sheet in ('Timeline', 'Sectors'))
+    logger.info(f"Limit replay over {len(timeline)} days saved to {args.output}")
+    return timeline, runs
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(main, 'limit_replay')
@@ -0,0 +1,463 @@
+"""
+Streaming portfolio VaR from IB market data.
+Every holding is subscribed to IB ticks and the portfolio's dollar amounts are
+kept current. Portfolio VaR is updated incrementally from a model fitted once
+on daily history: either the market + sector factor model or the full return
+covariance. A tick only changes its own ticker's amount, so an update costs
+O(changed names) under the factor model and O(n x changed names) under the
+covariance. Ticks are coalesced: the latest price per symbol wins and one
+batch is applied per LIVE_VAR_COALESCE_SECONDS at most, so bursts do not queue
+up. Crossings of LIVE_VAR_LIMIT (VaR over net liquidation) are logged and sent
+to TELEGRAM_ALERT_CHAT_ID.
+
+Usage:
+    python live_var.py                          # holdings from the broker export
+    python live_var.py --model covariance --limit 0.02
+"""
+import argparse
+import asyncio
+import datetime as dt
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import config
+import factor_model
+import instrumentation
+import market_data
+import portfolio_state
+from lazy_imports import lazy_import
+
+ib_insync = lazy_import('ib_insync')
+stats = lazy_import('scipy.stats')
+telebot = lazy_import('telebot')
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# A breach re-arms once VaR falls back below this fraction of the limit, so noise at the limit does not flap
+REARM_FRACTION = 0.9
+
+
+class IncrementalFactorVar:
+    """
+    Portfolio VaR under a FactorModel with running exposures.
+
+    Holds b = B'w, sum(w^2 d) and w'mu; changing some amounts adjusts each by
+    the changed rows only. Portfolio variance is then b'Fb + sum(w^2 d), so an
+    update costs O(changed names + factors^2).
+    """
+
+    def __init__(self, model, amounts, confidence=None):
+        """
+        Args:
+            model: Fitted factor_model.FactorModel
+            amounts: Signed dollar amount per model symbol, in model.symbols order
+        """
+        self.model = model
+        self.z = stats.norm.ppf(confidence or config.CONFIDENCE_LEVEL)
+        self.w = np.asarray(amounts, dtype=np.float64).copy()
+        self.rebuild()
+
+    def rebuild(self):
+        """Recompute the running sums from scratch, clearing floating-point drift."""
+        m = self.model
+        self.b = m.exposures(self.w)
+        self.idio = float((self.w ** 2) @ m.idio_var)
+        self.mean = float(self.w @ m.mean)
+
+    def update(self, rows, amounts):
+        """Set the amounts of rows (model positions) and adjust the running sums by the differences."""
+        m = self.model
+        delta = amounts - self.w[rows]
+        self.b[0] += delta @ m.beta_market[rows]
+        group = m.group[rows]
+        in_sector = group >= 0
+        np.add.at(self.b, 1 + group[in_sector], (delta * m.beta_sector[rows])[in_sector])
+        self.idio += float((amounts ** 2 - self.w[rows] ** 2) @ m.idio_var[rows])
+        self.mean += float(delta @ m.mean[rows])
+        self.w[rows] = amounts
+
+    @property
+    def variance(self):
+        return max(float(self.b @ self.model.factor_cov @ self.b) + self.idio, 0.0)
+
+    def var(self):
+        return -self.mean + self.z * np.sqrt(self.variance)
+
+
+class IncrementalCovarianceVar:
+    """
+    Portfolio VaR under the full return covariance, keeping Sigma w current.
+
+    Changing the amounts of rows S moves w'Sigma w by 2 d'(Sigma w)_S + d'Sigma_SS d
+    and Sigma w by Sigma[:, S] d, so an update costs O(n x |S|).
+    """
+
+    def __init__(self, cov, mean, amounts, confidence=None):
+        self.cov = np.asarray(cov, dtype=np.float64)
+        self.mu = np.asarray(mean, dtype=np.float64)
+        self.z = stats.norm.ppf(confidence or config.CONFIDENCE_LEVEL)
+        self.w = np.asarray(amounts, dtype=np.float64).copy()
+        self.rebuild()
+
+    def rebuild(self):
+        self.sw = self.cov @ self.w
+        self.quad = float(self.w @ self.sw)
+        self.mean = float(self.w @ self.mu)
+
+    def update(self, rows, amounts):
+        delta = amounts - self.w[rows]
+        self.quad += float(2 * delta @ self.sw[rows] + delta @ self.cov[np.ix_(rows, rows)] @ delta)
+        self.sw += self.cov[:, rows] @ delta
+        self.mean += float(delta @ self.mu[rows])
+        self.w[rows] = amounts
+
+    @property
+    def variance(self):
+        return max(self.quad, 0.0)
+
+    def var(self):
+        return -self.mean + self.z * np.sqrt(self.variance)
+
+
+class TelegramAlerts:
+    """Sends alert text to one Telegram chat from a background thread, off the tick path."""
+
+    def __init__(self, chat_id=None):
+        self.chat_id = chat_id or config.TELEGRAM_ALERT_CHAT_ID
+        self._queue = queue.Queue()
+        self._bot = None
+        if self.chat_id:
+            threading.Thread(target=self._send_loop, name='live-var-alerts', daemon=True).start()
+        else:
+            logger.warning("TELEGRAM_ALERT_CHAT_ID is not set; live VaR alerts are only logged")
+
+    def __call__(self, text):
+        if self.chat_id:
+            self._queue.put(text)
+
+    def _send_loop(self):
+        while True:
+            text = self._queue.get()
+            try:
+                if self._bot is None:
+                    self._bot = telebot.TeleBot(config.require_telegram_token())
+                self._bot.send_message(self.chat_id, text)
+            except Exception as e:
+                logger.error(f"Could not send Telegram alert: {e}")
+
+
+class LiveVar:
+    """
+    Live portfolio VaR fed by price ticks.
+
+    on_prices() may be called from the market-data thread; it only records the
+    latest price per symbol. A worker thread applies each coalesced batch to the
+    incremental model and checks the limit.
+    """
+
+    def __init__(self, state, model=None, limit=None, coalesce=None, alert=None, start=None):
+        """
+        Args:
+            state: PortfolioState holding the shares of each position
+            model: 'factor' or 'covariance' (default: config.LIVE_VAR_MODEL)
+            limit: Alert threshold for VaR as a fraction of net liquidation (default: config.LIVE_VAR_LIMIT)
+            coalesce: Minimum seconds between applied batches (default: config.LIVE_VAR_COALESCE_SECONDS)
+            alert: Callable taking the alert text, e.g. TelegramAlerts()
+            start: Start of the daily history the model is fitted on (default: config.START_DATE_FOR_VAR)
+        """
+        self.state = state
+        self.kind = model or config.LIVE_VAR_MODEL
+        self.limit = limit or config.LIVE_VAR_LIMIT
+        self.coalesce = config.LIVE_VAR_COALESCE_SECONDS if coalesce is None else coalesce
+        self.alert = alert
+        self.start = start or config.START_DATE_FOR_VAR
+        self.on_new_symbols = None
+        self.symbols = pd.Index([])
+        self.prices = np.array([])
+        self.shares = np.array([])
+        self.model = None
+        self.current = float('nan')
+        self.breached = False
+        self.stale = False
+        self.batches = 0
+        self.latencies = deque(maxlen=1000)
+        self._version = None
+        self._retry_at = 0.0
+        self._positions = {}
+        self._unpriced = set()
+        self._subscribed = set()
+        self._pending = {}
+        self._first_tick = None
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+
+    def _fit(self, symbols):
+        """Fit the model on daily closes of symbols; the last close seeds each price until its first tick."""
+        closes = market_data.get_provider().get_history(list(symbols), start=self.start,
+                                                        end=dt.date.today() + dt.timedelta(days=1))
+        returns = closes.pct_change(fill_method=None).iloc[1:]
+        missing = sorted(set(symbols) - set(closes.columns))
+        if missing:
+            logger.warning(f"No price history for {missing}; left out of live VaR")
+        if self.kind == 'covariance':
+            fitted = (returns.cov().fillna(0.0), returns.mean().fillna(0.0))
+            symbols = fitted[0].index
+        else:
+            fitted = factor_model.FactorModel.fit(returns, self.state.sectors)
+            symbols = fitted.symbols
+        last = closes.ffill().iloc[-1].reindex(symbols).to_numpy(dtype=np.float64)
+        return fitted, pd.Index(symbols), last
+
+    def rebuild(self):
+        """
+        Re-read the book; refit when it holds symbols the model has not seen.
+
+        Symbols without price history stay out of the model and are not
+        retried until their own position changes, so one unpriceable holding
+        does not cost a refit on every rebuild. Nothing is replaced until the
+        new model is built, so a failed refit leaves the previous one running.
+        """
+        with instrumentation.stage('live_var_rebuild'):
+            version = self.state.version
+            positions = dict(self.state.positions)
+            unpriced = self._unpriced - {s for s in positions.keys() | self._positions.keys()
+                                         if positions.get(s) != self._positions.get(s)}
+            held = [s for s, position in positions.items() if position]
+            priceable = [s for s in held if s not in unpriced]
+            new = [s for s in priceable if s not in self.symbols]
+            refit = bool(new) or self.model is None
+            symbols, prices = self.symbols, self.prices
+            if refit:
+                old = pd.Series(self.prices, index=self.symbols)
+                fitted, symbols, last = self._fit(list(dict.fromkeys(list(self.symbols) + priceable)))
+                prices = old.reindex(symbols).fillna(pd.Series(last, index=symbols)).to_numpy(copy=True)
+                unpriced.update(s for s in new if s not in symbols)
+            shares = pd.Series(positions, dtype=np.float64).reindex(symbols).fillna(0.0).to_numpy()
+            amounts = np.nan_to_num(shares * prices)
+            if self.kind == 'covariance':
+                cov, mean = fitted if refit else (self.model.cov, self.model.mu)
+                model = IncrementalCovarianceVar(cov, mean, amounts)
+            else:
+                model = IncrementalFactorVar(fitted if refit else self.model.model, amounts)
+            self.symbols, self.prices, self.shares, self.model = symbols, prices, shares, model
+            self._unpriced, self._positions, self._version = unpriced, positions, version
+            subscribe = [s for s in held if s in self.symbols and s not in self._subscribed]
+            if subscribe and self.on_new_symbols:
+                self._subscribed.update(subscribe)
+                self.on_new_symbols(subscribe)
+        self.current = self.model.var()
+        logger.info(f"Live VaR over {int((shares != 0).sum())} positions ({self.kind} model): {self.current:,.0f}")
+        self._check()
+
+    def on_prices(self, prices, received=None):
+        """Record the latest price per symbol; safe to call from any thread."""
+        received = received or time.perf_counter()
+        with self._wake:
+            self._pending.update(prices)
+            if self._first_tick is None:
+                self._first_tick = received
+            self._wake.notify()
+
+    def on_ticks(self, tickers):
+        """ib_insync pendingTickersEvent handler."""
+        prices = {}
+        for ticker in tickers:
+            price = ticker.marketPrice()
+            if price == price and price > 0:
+                prices[portfolio_state.yahoo_symbol(ticker.contract)] = price
+        if prices:
+            self.on_prices(prices)
+
+    def _take(self):
+        with self._wake:
+            while not self._pending and not self._stop.is_set():
+                self._wake.wait(timeout=1.0)
+            batch, self._pending = self._pending, {}
+            first, self._first_tick = self._first_tick, None
+        return batch, first
+
+    @instrumentation.timed('live_var_update')
+    def apply(self, batch):
+        """Move the ticked symbols' amounts to their new prices and revalue the portfolio."""
+        if self.state.version != self._version:
+            version = self.state.version
+            if dict(self.state.positions) != self._positions:
+                if time.monotonic() >= self._retry_at:
+                    self._try_rebuild()
+            else:
+                # Only net liquidation moved: VaR is unchanged and the limit check below reads the new value
+                self._version = version
+        symbols = list(batch)
+        rows = self.symbols.get_indexer(symbols)
+        known = rows >= 0
+        rows = rows[known]
+        if not len(rows):
+            return self.current
+        prices = np.fromiter((batch[s] for s, k in zip(symbols, known) if k), dtype=np.float64, count=len(rows))
+        self.prices[rows] = prices
+        self.model.update(rows, self.shares[rows] * prices)
+        self.batches += 1
+        if self.batches % config.LIVE_VAR_REBUILD_BATCHES == 0:
+            self.model.rebuild()
+        self.current = self.model.var()
+        instrumentation.count('live_var_ticks', len(rows))
+        self._check()
+        return self.current
+
+    def _check(self):
+        net_liquidity = self.state.net_liquidity
+        ratio = self.current / net_liquidity
+        if not self.breached and ratio > self.limit:
+            self.breached = True
+            self._publish(f"⚠️ Live VaR {self.current:,.0f} is {ratio:.2%} of net liquidation, "
+                          f"above the {self.limit:.2%} limit")
+        elif self.breached and ratio < self.limit * REARM_FRACTION:
+            self.breached = False
+            self._publish(f"✅ Live VaR back to {self.current:,.0f} ({ratio:.2%} of net liquidation)")
+
+    def _try_rebuild(self):
+        """rebuild(), keeping the current model and backing off for LIVE_VAR_RETRY_SECONDS if it fails."""
+        try:
+            self.rebuild()
+        except Exception as e:
+            self._retry_at = time.monotonic() + config.LIVE_VAR_RETRY_SECONDS
+            logger.error(f"Live VaR refit failed: {e}", exc_info=True)
+            self._mark_stale(f"the refit failed ({e}); still running the previous model")
+
+    def _mark_stale(self, reason):
+        if not self.stale:
+            self.stale = True
+            self._publish(f"⚠️ Live VaR stale: {reason}")
+
+    def _publish(self, text):
+        logger.warning(text)
+        instrumentation.count('live_var_alerts')
+        if self.alert:
+            self.alert(text)
+
+    def run(self):
+        """Apply coalesced batches until stop(); ticks arriving during a batch or the coalesce window merge."""
+        if self.model is None:
+            self._try_rebuild()
+        last_report = time.perf_counter()
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            batch, first = self._take()
+            if not batch:
+                continue
+            try:
+                self.apply(batch)
+            except Exception as e:
+                # One bad batch must not kill the worker; the next batch carries the latest prices anyway
+                logger.error(f"Live VaR batch failed: {e}", exc_info=True)
+                self._mark_stale(f"a batch failed ({e})")
+                self._stop.wait(self.coalesce)
+                continue
+            if self.stale and self._version == self.state.version:
+                self.stale = False
+                self._publish(f"✅ Live VaR current again: {self.current:,.0f}")
+            done = time.perf_counter()
+            self.latencies.append(done - first)
+            if done - last_report >= config.LIVE_VAR_REPORT_SECONDS:
+                last_report = done
+                logger.info(f"Live VaR {self.current:,.0f} ({self.current / self.state.net_liquidity:.2%} of net "
+                            f"liquidation); tick to VaR p50 {self.latency(0.5) * 1000:.0f} ms, "
+                            f"p95 {self.latency(0.95) * 1000:.0f} ms over {len(self.latencies)} batches")
+            wait = self.coalesce - (time.perf_counter() - started)
+            if wait > 0:
+                self._stop.wait(wait)
+
+    def latency(self, q):
+        """Quantile of the time from the first tick of a batch to its updated VaR, in seconds."""
+        return float(np.quantile(self.latencies, q)) if self.latencies else float('nan')
+
+    def start_worker(self):
+        thread = threading.Thread(target=self.run, name='live-var', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+        with self._wake:
+            self._wake.notify()
+
+
+def ib_contract(symbol):
+    """IB stock contract for a Yahoo ticker, e.g. 'BRK-B' -> 'BRK B'."""
+    return ib_insync.Stock(symbol.replace('-', ' '), 'SMART', 'USD')
+
+
+def load_book(on_disconnect=None):
+    """The book to follow: kept current from IB with PORTFOLIO_SOURCE=ib, else read from the broker export."""
+    state = portfolio_state.PortfolioState()
+    if config.PORTFOLIO_SOURCE == 'ib':
+        sync = portfolio_state.IBPortfolioSync(state, on_disconnect=on_disconnect)
+        sync.start()
+        return state, sync
+    export = portfolio_state.read_export(config.PORTFOLIO_PATH_ORIGINAL)
+    state.replace(zip(export['Symbol'], export['Position'], export['Avg Price']))
+    return state, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Streaming portfolio VaR from IB market data")
+    parser.add_argument('--model', choices=['factor', 'covariance'], default=config.LIVE_VAR_MODEL)
+    parser.add_argument('--limit', type=float, default=config.LIVE_VAR_LIMIT,
+                        help="Alert when VaR exceeds this fraction of net liquidation")
+    args = parser.parse_args(argv)
+
+    alerts = TelegramAlerts()
+    # A lost portfolio sync leaves VaR computed on a stale book, so it is alerted like a breach
+    state, sync = load_book(on_disconnect=alerts)
+    if sync:
+        # The IB sync loads the book on its own thread; wait for the first snapshot
+        deadline = time.monotonic() + 30
+        while state.version == 0 and time.monotonic() < deadline:
+            time.sleep(0.1)
+    monitor = LiveVar(state, args.model, args.limit, alert=alerts)
+    ib = ib_insync.IB()
+    try:
+        logger.info(f"Connecting to Interactive Brokers at {config.IB_IP}:{config.IB_PORT} for market data")
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        ib.connect(config.IB_IP, config.IB_PORT, clientId=config.LIVE_VAR_CLIENT_ID, readonly=True)
+        loop = asyncio.get_event_loop()
+
+        def subscribe(symbols):
+            for symbol in symbols:
+                ib.reqMktData(ib_contract(symbol), '', False, False)
+            logger.info(f"Subscribed to market data for {len(symbols)} symbols")
+
+        # Refits happen on the worker thread and subscriptions must be made on the IB loop, so both the
+        # initial book and symbols bought later are subscribed through the loop
+        monitor.on_new_symbols = lambda symbols: loop.call_soon_threadsafe(subscribe, symbols)
+        monitor.rebuild()
+        ib.pendingTickersEvent += monitor.on_ticks
+        monitor.start_worker()
+        ib.run()
+    except ConnectionRefusedError:
+        logger.error(f"Could not connect to IB at {config.IB_IP}:{config.IB_PORT}. Is TWS/Gateway running?")
+        raise
+    except KeyboardInterrupt:
+        logger.info("Live VaR stopped by user")
+    finally:
+        monitor.stop()
+        if ib.isConnected():
+            ib.disconnect()
+        if sync:
+            sync.disconnect()
+    return monitor
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(main, 'live_var')
@@ -1,14 +1,18 @@
 import numpy as np
 import pandas as pd
-import yfinance as yf
-from pandas_datareader import data as pdr
 import datetime as dt
-import openpyxl
-from openpyxl.styles import PatternFill
 import logging
+import os
 import Var
 import config
+import instrumentation
+import market_data
+import portfolio_state
 import visualization
+from lazy_imports import lazy_import
+
+openpyxl = lazy_import('openpyxl')
+openpyxl_styles = lazy_import('openpyxl.styles')
 
 # Configure logging
 logging.basicConfig(
@@ -18,6 +22,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+@instrumentation.timed('check_tickers')
 def check_tickers():
     """Check which tickers can be successfully fetched from Yahoo Finance."""
     tickers = get_list('alltickers')
@@ -25,7 +30,9 @@ def check_tickers():
     for index, ticker in enumerate(tickers):
         try:
             logger.info(f"Checking ticker {index}: {ticker}")
-            data = pdr.get_data_yahoo(ticker)
+            data = market_data.get_provider().get_history([ticker])
+            if data.empty:
+                raise ValueError("no price history returned")
         except Exception as e:
             logger.warning(f"Failed to fetch data for {ticker}: {e}")
             bad_stocks.append(ticker)
@@ -51,40 +58,36 @@ def get_list(filename):
         raise
 
 
-def transform_df(df_path, net_liquidity):
-    """Transform raw portfolio CSV into standardized format with sector information."""
+@instrumentation.timed('transform')
+def transform_df(df_path, net_liquidity, state=None):
+    """
+    Transform raw portfolio CSV into standardized format with sector information.
+
+    The export is diffed by symbol, position and average price against the
+    previous snapshot (state, or the one saved at PORTFOLIO_STATE_PATH), so
+    sector lookups, amounts and sector exposure are recomputed only for added,
+    changed or closed rows, and the sheet is not rewritten when nothing changed.
+
+    Returns:
+        The updated PortfolioState
+    """
     try:
         logger.info(f"Loading portfolio from {df_path}")
-        df = pd.read_csv(df_path)
-        df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
-        df = df.drop(['Daily P&L', 'Last', 'Change', 'Unrealized P&L', 'Market Value'], axis=1)
-        df.rename(columns={'Financial Instrument': 'Symbol'}, inplace=True)
-        df['Sector'] = ''
-        df['Amount'] = 0.0
-
-        for index, row in df.iterrows():
-            df.at[index, 'Position'] = str(df.at[index, 'Position']).replace(',', '')
-            ticker = df.at[index, 'Symbol']
-            try:
-                tick = yf.Ticker(ticker)
-                if 'sector' in tick.info:
-                    df.at[index, 'Sector'] = tick.info['sector']
-                else:
-                    df.at[index, 'Sector'] = 'ETF'
-            except Exception as e:
-                logger.warning(f"Could not fetch sector for {ticker}: {e}")
-                df.at[index, 'Sector'] = 'Unknown'
-
-        df["Position"] = pd.to_numeric(df["Position"])
-        df['Amount'] = df['Position'] * df['Avg Price']
-        df['Type'] = np.where(df['Amount'] > 0, 'LONG', 'SHORT')
-        df = df.drop(['Avg Price', 'Position'], axis=1)
-        df['Percentage'] = abs(df['Amount']) / net_liquidity
-        cols = ['Symbol', 'Type', 'Amount', 'Percentage', 'Sector']
-        df = df[cols]
-        df.rename(columns={'Type': 'Position', 'Percentage': 'Protfilio Precentage'}, inplace=True)
-        df.to_excel(config.PORTFOLIO_PATH_TRANSFORMED, index=False)
-        logger.info(f"Portfolio transformed and saved to {config.PORTFOLIO_PATH_TRANSFORMED}")
+        df = portfolio_state.read_export(df_path)
+
+        if state is None:
+            state = portfolio_state.PortfolioState.load(net_liquidity=net_liquidity)
+        before = state.version
+        state.set_net_liquidity(net_liquidity)
+        changed = state.replace(zip(df['Symbol'], df['Position'], df['Avg Price']))
+        logger.info(f"{changed} of {len(df)} positions added, changed or closed since the last snapshot")
+
+        if state.version == before and os.path.exists(config.PORTFOLIO_PATH_TRANSFORMED):
+            logger.info(f"Portfolio unchanged; keeping {config.PORTFOLIO_PATH_TRANSFORMED}")
+            return state
+        state.save(config.PORTFOLIO_PATH_TRANSFORMED)
+        state.dump()
+        return state
 
     except FileNotFoundError:
         logger.error(f"Portfolio file not found: {df_path}")
@@ -97,38 +100,89 @@ def transform_df(df_path, net_liquidity):
         raise
 
 
-def coloring_portfolio(filename):
-    """Add color-coded VaR quality ratings to portfolio Excel file."""
+def quality_tiers(count):
+    """
+    Quality label for each VaR rank (0 = lowest VaR) in a list of count tickers.
+
+    Top 33% = GOOD, middle 57% = MID, bottom 10% = BAD, using the row cut-offs
+    coloring_portfolio has always applied to the sorted sheet.
+    """
+    length = count + 2
+    rows = np.arange(2, length)
+    return np.where(rows < round(length / 3), 'GOOD', np.where(rows < round(9 * length / 10), 'MID', 'BAD'))
+
+
+def interval_tiers(values, low, high, previous):
+    """
+    Quality labels that only move when the VaR confidence interval rules out the old one.
+
+    Tiers are cut where quality_tiers cuts the point estimates. A ticker keeps
+    its previous label while its [low, high] interval still reaches that tier's
+    range of values, so a move inside the estimate's own noise cannot flip it;
+    new tickers and tickers without an interval take their point tier.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    order = np.argsort(values, kind='stable')
+    tiers = quality_tiers(len(values))
+    labels = np.empty(len(values), dtype=object)
+    labels[order] = tiers
+    ranked = values[order]
+    good_max = ranked[tiers == 'GOOD'].max(initial=-np.inf)
+    bad_min = ranked[tiers == 'BAD'].min(initial=np.inf)
+    low = np.asarray(low, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    previous = np.asarray(previous, dtype=object)
+    with np.errstate(invalid='ignore'):
+        reaches = {'GOOD': low <= good_max, 'MID': (high > good_max) & (low < bad_min), 'BAD': high >= bad_min}
+    for tier, reached in reaches.items():
+        labels[(previous == tier) & reached] = tier
+    return labels
+
+
+@instrumentation.timed('rating')
+def coloring_portfolio(filename, metric=None):
+    """
+    Add color-coded quality ratings to an Excel sheet.
+
+    Tickers are ranked on the given metric (default: config.QUALITY_METRIC);
+    the metric and Qual columns are located from the header row.
+    """
+    metric = metric or config.QUALITY_METRIC
     try:
-        wb = openpyxl.load_workbook(filename=filename)
-        ws = wb['Sheet1']
-        df = pd.read_excel(filename)
-        length = df.shape[0] + 2
+        with instrumentation.stage('excel_read'):
+            wb = openpyxl.load_workbook(filename=filename)
+            ws = wb['Sheet1']
+            df = pd.read_excel(filename)
+        if metric not in df.columns:
+            raise ValueError(f"Quality metric '{metric}' is not a column of {filename}; "
+                             f"choose one of {Var.QUALITY_METRICS}")
+        if 'Qual' not in df.columns:
+            df['Qual'] = ''
+        metric_col = openpyxl.utils.get_column_letter(df.columns.get_loc(metric) + 1)
+        qual_col = openpyxl.utils.get_column_letter(df.columns.get_loc('Qual') + 1)
 
         # Define color fills for quality ratings
-        fill_cell_bad = PatternFill(patternType='solid', fgColor='FC2C03')  # Red
-        fill_cell_mid = PatternFill(patternType='solid', fgColor='FFFF00')  # Yellow
-        fill_cell_good = PatternFill(patternType='solid', fgColor='35FC03')  # Green
+        fill_cell_bad = openpyxl_styles.PatternFill(patternType='solid', fgColor='FC2C03')  # Red
+        fill_cell_mid = openpyxl_styles.PatternFill(patternType='solid', fgColor='FFFF00')  # Yellow
+        fill_cell_good = openpyxl_styles.PatternFill(patternType='solid', fgColor='35FC03')  # Green
 
-        # Determine columns based on file type
-        if filename == config.ALL_TICKERS_PATH:
-            var_col, qual_col = 'B', 'C'
+        # Color-code rows by the metric's rank, whatever order the sheet is in
+        fills = {'GOOD': fill_cell_good, 'MID': fill_cell_mid, 'BAD': fill_cell_bad}
+        intervals = metric == 'Var' and set(Var.INTERVAL_COLUMNS) <= set(df.columns)
+        if config.QUALITY_TIERING == 'interval' and intervals:
+            labels = interval_tiers(df[metric], df['VarLow'], df['VarHigh'], df['Qual'])
+            changed = int((labels != df['Qual'].to_numpy(dtype=object)).sum())
+            logger.info(f"Interval tiering: {changed} of {df.shape[0]} labels changed")
         else:
-            var_col, qual_col = 'F', 'G'
-
-        # Color-code rows based on VaR percentiles
-        # Top 33% = GOOD (green), Middle 57% = MID (yellow), Bottom 10% = BAD (red)
-        for i in range(2, round(length / 3)):
-            ws[f'{var_col}{i}'].fill = fill_cell_good
-            ws[f'{qual_col}{i}'] = 'GOOD'
-        for i in range(round(length / 3), round(9 * length / 10)):
-            ws[f'{var_col}{i}'].fill = fill_cell_mid
-            ws[f'{qual_col}{i}'] = 'MID'
-        for i in range(round(9 * length / 10), length):
-            ws[f'{var_col}{i}'].fill = fill_cell_bad
-            ws[f'{qual_col}{i}'] = 'BAD'
-
-        wb.save(filename=filename)
+            labels = np.empty(df.shape[0], dtype=object)
+            labels[np.argsort(df[metric].to_numpy(), kind='stable')] = quality_tiers(df.shape[0])
+        ws[f'{qual_col}1'] = 'Qual'
+        for i, label in enumerate(labels, start=2):
+            ws[f'{metric_col}{i}'].fill = fills[label]
+            ws[f'{qual_col}{i}'] = str(label)
+
+        with instrumentation.stage('excel_write'):
+            wb.save(filename=filename)
         logger.info(f"Color-coded quality ratings added to {filename}")
 
     except Exception as e:
@@ -136,17 +190,22 @@ def coloring_portfolio(filename):
         raise
 
 
+@instrumentation.timed('var_lookup')
 def get_var(portfolio_path, alltickers_path):
     """Calculate VaR for portfolio tickers and add quality ratings."""
     try:
         logger.info("Starting VaR calculation")
         coloring_portfolio(alltickers_path)
-        alltickers_df = pd.read_excel(alltickers_path)
+        with instrumentation.stage('excel_read'):
+            alltickers_df = pd.read_excel(alltickers_path)
+            portfolio_df = pd.read_excel(portfolio_path)
         alltickers_df = alltickers_df.loc[:, ~alltickers_df.columns.str.contains('^Unnamed')]
         alltickers_list = alltickers_df['Symbol'].tolist()
-        portfolio_df = pd.read_excel(portfolio_path)
-        portfolio_df['Var'] = 0
-        portfolio_df['Qual'] = 0
+        rated = ['Var', 'Qual'] + [m for m in Var.TAIL_METRICS + Var.INTERVAL_COLUMNS if m in alltickers_df.columns]
+        portfolio_df['Var'] = 0.0
+        portfolio_df['Qual'] = ''
+        for column in rated[2:]:
+            portfolio_df[column] = 0.0
         portfolio_tickers = portfolio_df['Symbol'].tolist()
         alltickers_df.set_index("Symbol", drop=False, inplace=True)
         portfolio_df.set_index("Symbol", drop=False, inplace=True)
@@ -155,30 +214,43 @@ def get_var(portfolio_path, alltickers_path):
             logger.info(f"Processing VaR for {tick}")
             if tick in alltickers_list:
                 # Use cached VaR value
-                portfolio_df.at[tick, 'Var'] = alltickers_df.at[tick, 'Var']
-                portfolio_df.at[tick, 'Qual'] = alltickers_df.at[tick, 'Qual']
+                instrumentation.cache_hit('var')
+                for column in rated:
+                    portfolio_df.at[tick, column] = alltickers_df.at[tick, column]
             else:
                 # Calculate new VaR
+                instrumentation.cache_miss('var')
                 try:
-                    data = pdr.get_data_yahoo([tick], start=config.START_DATE_FOR_VAR, end=dt.date.today())['Close']
-                    cur_var = Var.calc_var(config.INITIAL_INVESTMENT, np.array(config.WEIGHTS), data)
-                    alltickers_df.loc[len(alltickers_df.index)] = [tick, cur_var, 0]
-                    alltickers_df = alltickers_df.sort_values(by='Var')
-                    alltickers_df.to_excel(alltickers_path, index=False)
+                    data = market_data.get_provider().get_history([tick], start=config.START_DATE_FOR_VAR,
+                                                                  end=dt.date.today())
+                    if data.empty:
+                        raise ValueError("no price history returned")
+                    metrics = Var.risk_metrics(config.INITIAL_INVESTMENT, np.array(config.WEIGHTS), data)
+                    if metrics['Var'].isna().all():
+                        raise ValueError("not enough price history")
+                    intervals = Var.var_intervals(config.INITIAL_INVESTMENT, np.array(config.WEIGHTS), data)
+                    if intervals is not None:
+                        metrics = metrics.join(intervals)
+                    alltickers_df.loc[tick] = pd.Series({'Symbol': tick, 'Qual': '', **metrics.iloc[0]})
+                    alltickers_df = alltickers_df.sort_values(by=config.QUALITY_METRIC)
+                    with instrumentation.stage('excel_write'):
+                        alltickers_df.to_excel(alltickers_path, index=False)
                     coloring_portfolio(alltickers_path)
-                    alltickers_df = pd.read_excel(alltickers_path)
+                    with instrumentation.stage('excel_read'):
+                        alltickers_df = pd.read_excel(alltickers_path)
                     alltickers_df.set_index("Symbol", drop=False, inplace=True)
-                    portfolio_df.at[tick, 'Var'] = alltickers_df.at[tick, 'Var']
-                    portfolio_df.at[tick, 'Qual'] = alltickers_df.at[tick, 'Qual']
+                    for column in rated:
+                        portfolio_df.at[tick, column] = alltickers_df.at[tick, column]
                 except Exception as e:
                     logger.error(f"Failed to calculate VaR for {tick}: {e}")
                     portfolio_df.at[tick, 'Var'] = 0
                     portfolio_df.at[tick, 'Qual'] = 'UNKNOWN'
 
-        portfolio_df = portfolio_df.sort_values(by='Var')
-        alltickers_df = alltickers_df.sort_values(by='Var')
-        alltickers_df.to_excel(alltickers_path, index=False)
-        portfolio_df.to_excel(portfolio_path, index=False)
+        portfolio_df = portfolio_df.sort_values(by=config.QUALITY_METRIC)
+        alltickers_df = alltickers_df.sort_values(by=config.QUALITY_METRIC)
+        with instrumentation.stage('excel_write'):
+            alltickers_df.to_excel(alltickers_path, index=False)
+            portfolio_df.to_excel(portfolio_path, index=False)
         logger.info("VaR calculation completed")
 
     except Exception as e:
@@ -186,11 +258,27 @@ def get_var(portfolio_path, alltickers_path):
         raise
 
 
-if __name__ == '__main__':
+def sync_from_ib():
+    """Write the transformed portfolio from a live IB snapshot instead of the CSV export."""
+    state = portfolio_state.PortfolioState()
+    sync = portfolio_state.IBPortfolioSync(state)
+    try:
+        sync.connect()
+        sync.wait_sectors()
+        state.save(config.PORTFOLIO_PATH_TRANSFORMED)
+    finally:
+        sync.disconnect()
+
+
+def run():
     try:
         logger.info("Starting portfolio processing")
-        # Transform raw portfolio CSV to standardized format
-        transform_df(config.PORTFOLIO_PATH_ORIGINAL, config.NET_LIQUIDITY)
+        if config.PORTFOLIO_SOURCE == 'ib':
+            # Pull positions, average costs and net liquidation straight from IB
+            sync_from_ib()
+        else:
+            # Transform raw portfolio CSV to standardized format
+            transform_df(config.PORTFOLIO_PATH_ORIGINAL, config.NET_LIQUIDITY)
         # Calculate VaR and add quality ratings
         get_var(config.PORTFOLIO_PATH_TRANSFORMED, config.ALL_TICKERS_PATH)
         logger.info("Portfolio processing completed successfully")
@@ -202,3 +290,7 @@ if __name__ == '__main__':
     except Exception as e:
         logger.error(f"Portfolio processing failed: {e}", exc_info=True)
         raise
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(run, 'main')
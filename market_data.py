@@ -0,0 +1,380 @@
+"""
+Market data provider layer.
+Every module fetches prices and ticker info through get_provider(), which returns
+either the Yahoo backend (shared pooled session, token-bucket rate limiting and
+exponential backoff), a local file backend for offline runs, or the shared
+memory-mapped panel (price_panel.py).
+"""
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+import config
+import instrumentation
+from lazy_imports import lazy_import
+
+price_panel = lazy_import('price_panel')
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class MarketDataProvider:
+    """Interface shared by all market data backends."""
+
+    name = 'base'
+
+    def get_history(self, symbols, start=None, end=None, interval='1d', field='Close'):
+        """
+        Return one price field for many symbols.
+
+        Args:
+            symbols: Iterable of ticker symbols
+            start: First date (inclusive); None for all available history
+            end: Last date (exclusive); None for up to today
+            interval: Bar size, e.g. '1d' or '1h'
+            field: One of Open, High, Low, Close, Volume
+
+        Returns:
+            DataFrame indexed by bar time with one column per symbol found
+        """
+        raise NotImplementedError
+
+    def get_bar_panel(self, symbols, start=None, end=None, interval='1d'):
+        """Return every bar field at once as a dict of field -> DataFrame (bar time x symbols)."""
+        return {field: self.get_history(symbols, start, end, interval, field) for field in BAR_COLUMNS}
+
+    def get_info(self, symbol):
+        """Return the ticker info dictionary (sector, industry, ...)."""
+        raise NotImplementedError
+
+
+def is_intraday(interval):
+    """True for minute and hour bar sizes such as '1m', '30m' or '1h'."""
+    return interval.endswith(('m', 'h')) and not interval.endswith('mo')
+
+
+def _bound(value, index):
+    """Timestamp comparable with index; naive bounds on a tz-aware index are taken as UTC."""
+    value = pd.Timestamp(value)
+    if getattr(index, 'tz', None) is not None and value.tzinfo is None:
+        value = value.tz_localize('UTC')
+    return value
+
+
+def _make_session(pool_size):
+    """Shared HTTP session for Yahoo; prefers curl_cffi, which newer yfinance requires."""
+    try:
+        from curl_cffi import requests as cffi_requests
+        return cffi_requests.Session(impersonate='chrome')
+    except ImportError:
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+
+class YahooProvider(MarketDataProvider):
+    """Yahoo Finance backend built on yfinance with a shared session and throttling."""
+
+    name = 'yahoo'
+
+    def __init__(self, requests_per_second=None, burst=None, max_retries=None, backoff_seconds=None, pool_size=None):
+        self.bucket = TokenBucket(requests_per_second or config.YAHOO_REQUESTS_PER_SECOND,
+                                  burst or config.YAHOO_BURST)
+        self.max_retries = config.YAHOO_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_seconds = config.YAHOO_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self.pool_size = pool_size or config.YAHOO_POOL_SIZE
+        self.session = _make_session(self.pool_size)
+
+    def _delay(self, attempt):
+        return self.backoff_seconds * 2 ** attempt * (1 + random.random())
+
+    def _request(self, description, func, *args, **kwargs):
+        """Run a Yahoo call under the rate limit, retrying with exponential backoff."""
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"{description} failed after {attempt + 1} attempts: {e}")
+                    raise
+                delay = self._delay(attempt)
+                logger.warning(f"{description} failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _fetch(self, symbol, start, end, interval):
+        """
+        One symbol's bars in a single HTTP request, under the rate limit.
+
+        Returns:
+            Bars DataFrame, empty when Yahoo has no data for the symbol
+            (delisted, invalid or not yet trading). Throttling (YFRateLimitError)
+            and network errors raise.
+        """
+        import yfinance as yf
+        from yfinance import exceptions as yf_errors
+        # Raised instead of returning an empty frame when yfinance is set not to hide exceptions
+        no_data = tuple(getattr(yf_errors, name) for name in ('YFPricesMissingError', 'YFTzMissingError')
+                        if hasattr(yf_errors, name))
+        self.bucket.acquire()
+        try:
+            bars = yf.Ticker(symbol, session=self.session).history(start=start, end=end, interval=interval,
+                                                                     auto_adjust=False, actions=False)
+        except no_data:
+            return pd.DataFrame()
+        if bars.empty:
+            return bars
+        # Daily bars are labelled by exchange date as yf.download did; intraday bars in UTC as the local store keeps them
+        if is_intraday(interval):
+            bars.index = bars.index.tz_convert('UTC')
+        elif bars.index.tz is not None:
+            bars.index = bars.index.tz_localize(None)
+        return bars
+
+    def _attempt(self, symbol, start, end, interval):
+        try:
+            return self._fetch(symbol, start, end, interval), None
+        except Exception as e:
+            return None, e
+
+    def _bars(self, symbols, start, end, interval):
+        """
+        Fetch symbols one request (and one rate-limit token) each, YAHOO_POOL_SIZE at a time.
+
+        Requests that raise are retried together with exponential backoff; a
+        symbol that comes back empty has no data and is not retried. Symbols
+        still failing after the last attempt are logged.
+
+        Returns:
+            Dict of symbol -> bars DataFrame for the symbols that were found
+        """
+        symbols = list(dict.fromkeys(symbols))
+        pending = symbols
+        found = {}
+        empty = []
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(self.pool_size, len(symbols)))) as pool:
+            for attempt in range(self.max_retries + 1):
+                results = list(pool.map(lambda symbol: self._attempt(symbol, start, end, interval), pending))
+                failed = []
+                for symbol, (bars, error) in zip(pending, results):
+                    if error is not None:
+                        failed.append(symbol)
+                        errors[symbol] = error
+                    elif bars.empty:
+                        empty.append(symbol)
+                    else:
+                        # yfinance does not expose the raw payload size; count the decoded frame instead
+                        instrumentation.add_bytes(self.name, bars.memory_usage(deep=True).sum())
+                        found[symbol] = bars
+                pending = failed
+                if not pending or attempt == self.max_retries:
+                    break
+                delay = self._delay(attempt)
+                instrumentation.count('yahoo_retries', len(pending))
+                logger.warning(f"Yahoo history failed for {len(pending)} symbols ({errors[pending[0]]}); "
+                               f"retrying in {delay:.1f}s")
+                time.sleep(delay)
+        if empty:
+            logger.warning(f"No Yahoo data for {empty}")
+        if pending:
+            logger.error(f"Yahoo history for {pending} failed after {self.max_retries + 1} attempts: "
+                         f"{errors[pending[0]]}")
+        return {symbol: found[symbol] for symbol in symbols if symbol in found}
+
+    @staticmethod
+    def _field(found, field):
+        return pd.DataFrame({symbol: bars[field] for symbol, bars in found.items()}).dropna(axis=1, how='all')
+
+    @instrumentation.timed('fetch')
+    def get_history(self, symbols, start=None, end=None, interval='1d', field='Close'):
+        return self._field(self._bars(symbols, start, end, interval), field)
+
+    @instrumentation.timed('fetch')
+    def get_bar_panel(self, symbols, start=None, end=None, interval='1d'):
+        found = self._bars(symbols, start, end, interval)
+        return {field: self._field(found, field) for field in BAR_COLUMNS}
+
+    @instrumentation.timed('fetch_info')
+    def get_info(self, symbol):
+        import yfinance as yf
+        return self._request(f"Yahoo info for {symbol}", lambda: yf.Ticker(symbol, session=self.session).info)
+
+
+class LocalFileProvider(MarketDataProvider):
+    """
+    Offline backend reading bars from CSV files.
+
+    Layout: <root>/<interval>/<SYMBOL>.csv with a Date column plus
+    Open/High/Low/Close/Volume, and <root>/info.json mapping symbol to info.
+    Intraday bars are stored with UTC timestamps.
+    """
+
+    name = 'local'
+
+    def __init__(self, root=None):
+        self.root = Path(root or config.MARKET_DATA_DIR)
+        self._info = None
+
+    def bars_path(self, symbol, interval='1d'):
+        return self.root / interval / f'{symbol}.csv'
+
+    def get_bars(self, symbol, start=None, end=None, interval='1d'):
+        """Return all stored bars for a symbol between start and end."""
+        path = self.bars_path(symbol, interval)
+        bars = pd.read_csv(path, index_col='Date')
+        bars.index = pd.to_datetime(bars.index, utc=is_intraday(interval))
+        instrumentation.add_bytes(self.name, path.stat().st_size)
+        if start is not None:
+            bars = bars[bars.index >= _bound(start, bars.index)]
+        if end is not None:
+            bars = bars[bars.index < _bound(end, bars.index)]
+        return bars
+
+    def last_bar_time(self, symbol, interval='1d'):
+        """Timestamp of the newest stored bar, or None if nothing is stored."""
+        try:
+            return self.get_bars(symbol, interval=interval).index.max()
+        except FileNotFoundError:
+            return None
+
+    def store_bars(self, symbol, bars, interval='1d'):
+        """Write bars for a symbol, replacing any stored file."""
+        path = self.bars_path(symbol, interval)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if getattr(bars.index, 'tz', None) is not None:
+            bars = bars.tz_convert('UTC')
+        bars.rename_axis('Date').to_csv(path)
+
+    def append_bars(self, symbol, bars, interval='1d'):
+        """Merge new bars into the stored file; a re-fetched bar replaces the stored one."""
+        try:
+            stored = self.get_bars(symbol, interval=interval)
+        except FileNotFoundError:
+            stored = None
+        if getattr(bars.index, 'tz', None) is not None:
+            bars = bars.tz_convert('UTC')
+        if stored is not None and not stored.empty:
+            bars = pd.concat([stored, bars])
+            bars = bars[~bars.index.duplicated(keep='last')].sort_index()
+        self.store_bars(symbol, bars, interval)
+        return len(bars)
+
+    def get_history(self, symbols, start=None, end=None, interval='1d', field='Close'):
+        return self.get_bar_panel(symbols, start, end, interval, fields=[field])[field]
+
+    @instrumentation.timed('fetch')
+    def get_bar_panel(self, symbols, start=None, end=None, interval='1d', fields=BAR_COLUMNS):
+        columns = {field: {} for field in fields}
+        for symbol in dict.fromkeys(symbols):
+            try:
+                bars = self.get_bars(symbol, start, end, interval)
+            except FileNotFoundError:
+                logger.warning(f"No local {interval} bars for {symbol}")
+                continue
+            for field in fields:
+                columns[field][symbol] = bars[field]
+        return {field: pd.DataFrame(series) for field, series in columns.items()}
+
+    def get_info(self, symbol):
+        if self._info is None:
+            try:
+                with open(self.root / 'info.json', 'r') as fp:
+                    self._info = json.load(fp)
+            except FileNotFoundError:
+                self._info = {}
+        return self._info.get(symbol, {})
+
+
+class FrameProvider(MarketDataProvider):
+    """In-memory backend serving prepared DataFrames; used as a fixture for offline runs."""
+
+    name = 'frames'
+
+    def __init__(self, fields, info=None):
+        """
+        Args:
+            fields: Dict of field name -> DataFrame (dates x symbols), or a
+                single DataFrame of closes
+            info: Dict of symbol -> info dictionary
+        """
+        self.fields = fields if isinstance(fields, dict) else {'Close': fields}
+        self.info = info or {}
+
+    @instrumentation.timed('fetch')
+    def get_history(self, symbols, start=None, end=None, interval='1d', field='Close'):
+        panel = self.fields[field]
+        frame = panel[[s for s in dict.fromkeys(symbols) if s in panel.columns]]
+        if start is not None:
+            frame = frame[frame.index >= _bound(start, frame.index)]
+        if end is not None:
+            frame = frame[frame.index < _bound(end, frame.index)]
+        return frame
+
+    def get_info(self, symbol):
+        return self.info.get(symbol, {})
+
+
+_provider = None
+
+
+def get_provider():
+    """Return the process-wide provider selected by config.MARKET_DATA_PROVIDER."""
+    global _provider
+    if _provider is None:
+        if config.MARKET_DATA_PROVIDER == 'local':
+            _provider = LocalFileProvider()
+        elif config.MARKET_DATA_PROVIDER == 'panel':
+            _provider = price_panel.PanelProvider()
+        elif config.MARKET_DATA_PROVIDER == 'yahoo':
+            _provider = YahooProvider()
+        else:
+            raise ValueError(f"Unknown MARKET_DATA_PROVIDER: {config.MARKET_DATA_PROVIDER}")
+        logger.info(f"Using {_provider.name} market data provider")
+    return _provider
+
+
+def set_provider(provider):
+    """Replace the process-wide provider, e.g. with a FrameProvider for offline runs."""
+    global _provider
+    _provider = provider
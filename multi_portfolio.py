@@ -0,0 +1,246 @@
+"""
+Risk runs over several accounts or sub-books sharing one data load.
+Portfolio files come from a directory of broker exports or a JSON manifest.
+Their symbols are unioned, so prices are fetched and ticker metrics computed
+once; each account's portfolio VaR and limit checks then run in parallel
+against the shared data, followed by the consolidated book.
+
+Manifest:
+    [{"name": "Main", "path": "data/accounts/main.csv", "net_liquidity": 294000}, ...]
+
+Usage:
+    python multi_portfolio.py                         # every CSV in MULTI_PORTFOLIO_SOURCE
+    python multi_portfolio.py data/accounts.json --workers 4
+"""
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+import extremities
+import instrumentation
+import main as portfolio_main
+import market_data
+import portfolio_state
+import Var
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+CONSOLIDATED = 'Consolidated'
+
+
+def load_accounts(source=None):
+    """
+    Accounts to evaluate.
+
+    Args:
+        source: Directory of broker CSV exports (one account per file, named
+            after the file) or a JSON manifest (default: config.MULTI_PORTFOLIO_SOURCE)
+
+    Returns:
+        List of dicts with name, path and net_liquidity
+    """
+    source = Path(source or config.MULTI_PORTFOLIO_SOURCE)
+    if source.is_dir():
+        accounts = [{'name': path.stem, 'path': str(path)} for path in sorted(source.glob('*.csv'))]
+    else:
+        with open(source, 'r') as fp:
+            accounts = json.load(fp)
+        for account in accounts:
+            # Manifest paths are relative to the manifest
+            account['path'] = str(source.parent / account['path'])
+    if not accounts:
+        raise ValueError(f"No portfolio files found in {source}")
+    names = [account['name'] for account in accounts]
+    if len(set(names)) != len(names) or CONSOLIDATED in names:
+        raise ValueError(f"Account names must be unique and not '{CONSOLIDATED}': {names}")
+    for account in accounts:
+        account['net_liquidity'] = float(account.get('net_liquidity') or config.NET_LIQUIDITY)
+    return accounts
+
+
+def read_books(accounts):
+    """One PortfolioState per account; sectors are looked up once per symbol across all books."""
+    sectors = {}
+    books = {}
+    for account in accounts:
+        export = portfolio_state.read_export(account['path'])
+        book = portfolio_state.PortfolioState(account['net_liquidity'], sectors=sectors)
+        book.replace(zip(export['Symbol'], export['Position'], export['Avg Price']))
+        books[account['name']] = book
+    logger.info(f"Read {len(books)} accounts holding {len(sectors)} distinct symbols")
+    return books
+
+
+class SharedRiskData:
+    """Closes, ticker metrics, quality and return moments for the union of all books, loaded once."""
+
+    @instrumentation.timed('multi_data')
+    def __init__(self, symbols, start=None):
+        symbols = list(dict.fromkeys(symbols))
+        start = start or config.START_DATE_FOR_VAR
+        logger.info(f"Loading {len(symbols)} symbols once for every account")
+        closes = market_data.get_provider().get_history(symbols, start=start, end=dt.date.today())
+        missing = sorted(set(symbols) - set(closes.columns))
+        if missing:
+            logger.warning(f"No price history for {missing}; their VaR is reported as 0")
+
+        self.metrics = Var.risk_metrics(config.INITIAL_INVESTMENT, np.array(config.WEIGHTS), closes)
+        self.quality = self._rate(self.metrics)
+        returns = closes.pct_change(fill_method=None).iloc[1:]
+        self.mean = returns.mean().fillna(0.0)
+        self.cov = returns.cov().fillna(0.0)
+
+    @staticmethod
+    def _rate(metrics):
+        """
+        GOOD/MID/BAD per ticker, ranked against the master list when it has been scored.
+
+        Mirrors get_var, which ranks new tickers together with alltickers.xlsx.
+        """
+        metric = config.QUALITY_METRIC
+        values = metrics[metric].dropna()
+        if os.path.exists(config.ALL_TICKERS_PATH):
+            master = pd.read_excel(config.ALL_TICKERS_PATH)
+            if metric in master.columns:
+                master = master.dropna(subset=[metric]).set_index('Symbol')[metric]
+                values = pd.concat([master[~master.index.isin(values.index)], values])
+        ranked = values.sort_values(kind='stable')
+        quality = pd.Series(portfolio_main.quality_tiers(len(ranked)), index=ranked.index)
+        return quality.reindex(metrics.index)
+
+    def portfolio_var(self, amounts, confidence=None):
+        """1-day parametric VaR of signed dollar amounts from the shared return moments."""
+        confidence = confidence or config.CONFIDENCE_LEVEL
+        a = amounts.groupby(level=0).sum().reindex(self.cov.index).fillna(0.0).to_numpy()
+        sigma = self.cov.to_numpy()
+        return float(-a @ self.mean.to_numpy() + stats.norm.ppf(confidence) * np.sqrt(max(a @ sigma @ a, 0.0)))
+
+
+def evaluate(name, frame, net_liquidity, data):
+    """
+    Ticker metrics, limit checks and portfolio VaR for one book.
+
+    Returns:
+        (positions, summary, violations)
+    """
+    positions = frame.copy()
+    for column in data.metrics.columns:
+        positions[column] = positions['Symbol'].map(data.metrics[column]).fillna(0.0)
+    positions['Qual'] = positions['Symbol'].map(data.quality).fillna('UNKNOWN')
+    positions = positions.sort_values(by=config.QUALITY_METRIC).reset_index(drop=True)
+
+    violations = (extremities.check_sectors(positions[['Sector', 'Protfilio Precentage']])
+                  + extremities.check_percentage(positions) + extremities.check_amount(positions)
+                  + extremities.check_pos_size(positions) + extremities.check_var_quality(positions))
+    amounts = positions.set_index('Symbol')['Amount']
+    var = data.portfolio_var(amounts)
+    summary = {
+        'Account': name,
+        'Positions': len(positions),
+        'NetLiquidity': net_liquidity,
+        'Gross': float(amounts.abs().sum()),
+        'Exposure': float(positions['Protfilio Precentage'].sum()),
+        'PortfolioVar': var,
+        'VarPctNetLiq': var / net_liquidity,
+        'Violations': len(violations),
+    }
+    return positions, summary, [{'Account': name, 'Violation': v} for v in violations]
+
+
+def consolidated_frame(books):
+    """All books summed by symbol, as one portfolio against their combined net liquidation."""
+    frames = [book.frame() for book in books.values()]
+    combined = pd.concat(frames).groupby('Symbol', sort=False).agg(Amount=('Amount', 'sum'), Sector=('Sector', 'first'))
+    combined = combined[combined['Amount'] != 0].reset_index()
+    net_liquidity = sum(book.net_liquidity for book in books.values())
+    combined['Position'] = np.where(combined['Amount'] > 0, 'LONG', 'SHORT')
+    combined['Protfilio Precentage'] = combined['Amount'].abs() / net_liquidity
+    return combined[portfolio_state.COLUMNS], net_liquidity
+
+
+@instrumentation.timed('multi_portfolio')
+def run_accounts(accounts, workers=None, start=None):
+    """
+    Evaluate every account against one shared data load.
+
+    Returns:
+        (summary DataFrame with one row per account plus the consolidated
+        book, dict of name -> positions DataFrame, violations DataFrame)
+    """
+    books = read_books(accounts)
+    data = SharedRiskData([s for book in books.values() for s in book.positions], start)
+
+    jobs = [(name, book.frame(), book.net_liquidity) for name, book in books.items()]
+    jobs.append((CONSOLIDATED, *consolidated_frame(books)))
+    workers = workers or config.MULTI_PORTFOLIO_WORKERS or min(len(jobs), os.cpu_count() or 1)
+    # Threads share the loaded data without copying; numpy releases the GIL in the heavy parts
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda job: evaluate(*job, data), jobs))
+
+    summary = pd.DataFrame([r[1] for r in results])
+    accounts_var = summary.loc[summary['Account'] != CONSOLIDATED, 'PortfolioVar'].sum()
+    summary['Diversification'] = np.where(summary['Account'] == CONSOLIDATED,
+                                          accounts_var - summary['PortfolioVar'], np.nan)
+    positions = {name: r[0] for (name, _, _), r in zip(jobs, results)}
+    violations = pd.DataFrame([v for r in results for v in r[2]], columns=['Account', 'Violation'])
+    return summary, positions, violations
+
+
+def _sheet_name(name, used):
+    """Excel sheet names are at most 31 characters and cannot contain []:*?/\\."""
+    base = re.sub(r'[\[\]:*?/\\]', '_', name)[:31]
+    sheet, i = base, 1
+    while sheet in used:
+        suffix = f'_{i}'
+        sheet, i = base[:31 - len(suffix)] + suffix, i + 1
+    used.add(sheet)
+    return sheet
+
+
+def write_report(summary, positions, violations, path):
+    """Consolidated workbook: Summary, Violations, then one sheet per account."""
+    used = {'Summary', 'Violations'}
+    with instrumentation.stage('excel_write'):
+        with pd.ExcelWriter(path) as writer:
+            summary.to_excel(writer, sheet_name='Summary', index=False)
+            violations.to_excel(writer, sheet_name='Violations', index=False)
+            for name, frame in positions.items():
+                frame.to_excel(writer, sheet_name=_sheet_name(name, used), index=False)
+    logger.info(f"Multi-account report saved to {path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Risk checks for several accounts sharing one data load")
+    parser.add_argument('source', nargs='?', default=config.MULTI_PORTFOLIO_SOURCE,
+                        help="Directory of broker CSV exports or a JSON manifest")
+    parser.add_argument('--workers', type=int, default=None, help="Accounts evaluated in parallel")
+    parser.add_argument('--start', default=config.START_DATE_FOR_VAR)
+    parser.add_argument('--output', default=os.path.join('outputs', 'multi_portfolio.xlsx'))
+    args = parser.parse_args(argv)
+
+    summary, positions, violations = run_accounts(load_accounts(args.source), args.workers, args.start)
+    columns = ['Account', 'Positions', 'Exposure', 'PortfolioVar', 'VarPctNetLiq', 'Violations']
+    logger.info(f"\n{summary[columns].to_string(index=False)}")
+    write_report(summary, positions, violations, args.output)
+    return summary, positions, violations
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(main, 'multi_portfolio')
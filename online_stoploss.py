@@ -1,8 +1,12 @@
 import pandas as pd
-from ib_insync import IB, Stock, MarketOrder, StopOrder
+from ib_insync import IB, Stock, StopOrder
 import logging
+import math
 import time
 import config
+import instrumentation
+import pair_execution
+import spread_engine
 
 # Configure logging
 logging.basicConfig(
@@ -31,10 +35,152 @@ def read_stock_symbols(file_name):
         raise
 
 
+def get_hourly_closes(ib, contract, bars):
+    """Request enough recent hourly bars from IB to seed the spread window."""
+    days = math.ceil(bars / 6.5) + 2
+    history = ib.reqHistoricalData(
+        contract, endDateTime='', durationStr=f'{days} D', barSizeSetting='1 hour',
+        whatToShow='TRADES', useRTH=True
+    )
+    return {bar.date: bar.close for bar in history}
+
+
+def run_ratio_strategy(ib, stock_x, stock_y, ticker_x, ticker_y):
+    """Enter at market immediately and exit once the price ratio falls to the target."""
+    stock_x_price = ticker_x.last
+    stock_y_price = ticker_y.last
+
+    if not stock_x_price or not stock_y_price:
+        raise ValueError("Failed to get market prices for stocks")
+
+    # Calculate entry and exit ratios
+    initial_ratio = stock_x_price / stock_y_price
+    target_ratio = spread_engine.ratio_target(initial_ratio)
+    logger.info(f"Initial ratio: {initial_ratio:.4f}, Target ratio: {target_ratio:.4f}")
+    logger.info(f"Entry prices: {stock_x.symbol}=${stock_x_price:.2f}, {stock_y.symbol}=${stock_y_price:.2f}")
+
+    # Enter pairs trade
+    logger.info(f"Placing entry orders: BUY {config.POSITION_SIZE} {stock_x.symbol}, SELL {config.POSITION_SIZE} {stock_y.symbol}")
+    executor = pair_execution.PairExecutor(ib)
+    entry = executor.execute([pair_execution.Leg(stock_x, 'BUY', config.POSITION_SIZE, stock_x_price),
+                              pair_execution.Leg(stock_y, 'SELL', config.POSITION_SIZE, stock_y_price)], 'entry')
+    if not any(leg.held for leg in entry):
+        raise RuntimeError("Entry orders were not filled")
+
+    logger.info("Position entered. Monitoring for exit signal...")
+
+    # Monitor position for exit signal
+    closing = None  # exit legs still to trade once the exit has started
+    iteration = 0
+    max_iterations = 1000  # Safety limit to prevent infinite loop
+    while iteration < max_iterations:
+        # Get current prices
+        stock_x_price = ticker_x.last
+        stock_y_price = ticker_y.last
+
+        if stock_x_price and stock_y_price:
+            current_ratio = stock_x_price / stock_y_price
+            logger.info(f"Current ratio: {current_ratio:.4f} (target: {target_ratio:.4f})")
+
+            # Check exit condition
+            if closing is None and spread_engine.ratio_exit_triggered(current_ratio, target_ratio):
+                logger.info("Exit signal triggered! Closing position...")
+                closing = [leg.closing() for leg in entry]
+            if closing is not None:
+                closing = executor.flatten(closing, {stock_x.symbol: stock_x_price, stock_y.symbol: stock_y_price})
+                if not closing:
+                    logger.info("Position closed successfully")
+                    break
+                logger.error("Pair is not flat after the exit; retrying on the next check")
+        else:
+            logger.warning("Failed to get current prices, retrying...")
+
+        ib.sleep(config.SLEEP_TIME)
+        iteration += 1
+
+    if iteration >= max_iterations:
+        if closing:
+            logger.error(f"Maximum iterations reached with the pair still open: "
+                         f"{', '.join(f'{leg.action} {leg.quantity:g} {leg.symbol}' for leg in closing)} to flatten")
+        else:
+            logger.warning("Maximum iterations reached. Consider manual intervention.")
+
+
+def run_zscore_strategy(ib, stock_x, stock_y, ticker_x, ticker_y):
+    """
+    Wait for the spread z-score to cross the entry threshold, then exit on
+    reversion or stop. The rolling window is seeded from IB hourly bars.
+    """
+    pair = (stock_x.symbol, stock_y.symbol)
+    engine = spread_engine.SpreadEngine()
+    closes_x = get_hourly_closes(ib, stock_x, engine.window)
+    closes_y = get_hourly_closes(ib, stock_y, engine.window)
+    common = sorted(set(closes_x) & set(closes_y))[-engine.window:]
+    engine.add_pair(pair, [closes_x[d] for d in common], [closes_y[d] for d in common])
+
+    executor = pair_execution.PairExecutor(ib)
+    entry = None
+    closing = None  # exit legs still to trade once the exit has started
+    side = 0
+    iteration = 0
+    max_iterations = 1000  # Safety limit to prevent infinite loop
+    while iteration < max_iterations:
+        stock_x_price = ticker_x.last
+        stock_y_price = ticker_y.last
+
+        if stock_x_price and stock_y_price:
+            signal, zscore = engine.on_tick(pair, stock_x_price, stock_y_price)
+            logger.info(f"Spread z-score: {zscore:.2f} (side: {side})")
+
+            if closing is None and signal in (spread_engine.ENTER_LONG, spread_engine.ENTER_SHORT):
+                beta = engine.hedge_ratio(pair)
+                if not beta > 0:
+                    logger.warning(f"Hedge ratio {beta:.3f} is not positive, skipping entry")
+                else:
+                    side = 1 if signal == spread_engine.ENTER_LONG else -1
+                    qty_x = config.POSITION_SIZE
+                    qty_y = max(1, round(config.POSITION_SIZE * beta * stock_x_price / stock_y_price))
+                    action_x, action_y = ('BUY', 'SELL') if side == 1 else ('SELL', 'BUY')
+                    logger.info(f"{signal} at z={zscore:.2f}: {action_x} {qty_x} {stock_x.symbol}, "
+                                f"{action_y} {qty_y} {stock_y.symbol} (hedge ratio {beta:.3f})")
+                    entry = executor.execute([pair_execution.Leg(stock_x, action_x, qty_x, stock_x_price),
+                                              pair_execution.Leg(stock_y, action_y, qty_y, stock_y_price)], 'entry')
+                    if any(leg.held for leg in entry):
+                        engine.set_side(pair, side)
+                    else:
+                        logger.error("Entry orders were not filled; staying flat")
+                        side = 0
+
+            elif closing is None and signal in (spread_engine.EXIT, spread_engine.STOP):
+                logger.info(f"{signal} at z={zscore:.2f}! Closing position...")
+                closing = [leg.closing() for leg in entry]
+
+            if closing is not None:
+                closing = executor.flatten(closing, {stock_x.symbol: stock_x_price, stock_y.symbol: stock_y_price})
+                if not closing:
+                    engine.set_side(pair, 0)
+                    logger.info("Position closed successfully")
+                    break
+                logger.error("Pair is not flat after the exit; retrying on the next check")
+        else:
+            logger.warning("Failed to get current prices, retrying...")
+
+        ib.sleep(config.SLEEP_TIME)
+        iteration += 1
+
+    if iteration >= max_iterations:
+        if closing:
+            logger.error(f"Maximum iterations reached with the pair still open: "
+                         f"{', '.join(f'{leg.action} {leg.quantity:g} {leg.symbol}' for leg in closing)} to flatten")
+        else:
+            logger.warning("Maximum iterations reached. Consider manual intervention.")
+
+
 def main():
     """
     Execute pairs trading strategy with automatic stop-loss.
-    Enters long/short pair and exits when ratio converges by 8%.
+    In 'ratio' mode enters immediately and exits when the ratio converges by 8%;
+    in 'zscore' mode trades on rolling spread z-score signals.
     """
     ib = None
     try:
@@ -60,53 +206,10 @@ def main():
         ticker_y = ib.reqMktData(stock_y, '')
         ib.sleep(2)  # Wait for market data to populate
 
-        stock_x_price = ticker_x.last
-        stock_y_price = ticker_y.last
-
-        if not stock_x_price or not stock_y_price:
-            raise ValueError("Failed to get market prices for stocks")
-
-        # Calculate entry and exit ratios
-        initial_ratio = stock_x_price / stock_y_price
-        target_ratio = initial_ratio * config.TARGET_RATIO_MULTIPLIER
-        logger.info(f"Initial ratio: {initial_ratio:.4f}, Target ratio: {target_ratio:.4f}")
-        logger.info(f"Entry prices: {stock_x_symbol}=${stock_x_price:.2f}, {stock_y_symbol}=${stock_y_price:.2f}")
-
-        # Enter pairs trade
-        logger.info(f"Placing entry orders: BUY {config.POSITION_SIZE} {stock_x_symbol}, SELL {config.POSITION_SIZE} {stock_y_symbol}")
-        order_x = ib.placeOrder(stock_x, MarketOrder('BUY', config.POSITION_SIZE))
-        order_y = ib.placeOrder(stock_y, MarketOrder('SELL', config.POSITION_SIZE))
-        ib.sleep(2)  # Wait for orders to fill
-
-        logger.info("Position entered. Monitoring for exit signal...")
-
-        # Monitor position for exit signal
-        iteration = 0
-        max_iterations = 1000  # Safety limit to prevent infinite loop
-        while iteration < max_iterations:
-            # Get current prices
-            stock_x_price = ticker_x.last
-            stock_y_price = ticker_y.last
-
-            if stock_x_price and stock_y_price:
-                current_ratio = stock_x_price / stock_y_price
-                logger.info(f"Current ratio: {current_ratio:.4f} (target: {target_ratio:.4f})")
-
-                # Check exit condition
-                if current_ratio <= target_ratio:
-                    logger.info("Exit signal triggered! Closing position...")
-                    ib.placeOrder(stock_x, MarketOrder('SELL', config.POSITION_SIZE))
-                    ib.placeOrder(stock_y, MarketOrder('BUY', config.POSITION_SIZE))
-                    logger.info("Position closed successfully")
-                    break
-            else:
-                logger.warning("Failed to get current prices, retrying...")
-
-            ib.sleep(config.SLEEP_TIME)
-            iteration += 1
-
-        if iteration >= max_iterations:
-            logger.warning("Maximum iterations reached. Consider manual intervention.")
+        if config.PAIRS_SIGNAL_MODE == 'zscore':
+            run_zscore_strategy(ib, stock_x, stock_y, ticker_x, ticker_y)
+        else:
+            run_ratio_strategy(ib, stock_x, stock_y, ticker_x, ticker_y)
 
     except ConnectionRefusedError:
         logger.error(f"Could not connect to IB at {config.IB_IP}:{config.IB_PORT}. Is TWS/Gateway running?")
@@ -121,4 +224,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    instrumentation.run_main(main, 'online_stoploss')
@@ -0,0 +1,277 @@
+"""
+Pair-leg execution against IB with fill confirmation.
+Both legs are submitted before waiting on either, then IB events are processed
+until the fills arrive, so entry and exit take as long as the market does
+rather than a fixed sleep. A leg still short after EXECUTION_FILL_TIMEOUT has
+its remainder cancelled and resubmitted; if it stays short, the other leg is
+trimmed to the same fraction so the pair is never left one-sided. Every leg's
+fill latency and slippage against its decision price are logged and appended
+to EXECUTION_LOG_PATH.
+"""
+import datetime as dt
+import logging
+import os
+import time
+
+import pandas as pd
+
+import config
+import instrumentation
+from lazy_imports import lazy_import
+
+ib_insync = lazy_import('ib_insync')
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Order states after which no more fills arrive; Inactive is how IB reports a rejected order
+TERMINAL_STATES = {'Filled', 'Cancelled', 'ApiCancelled', 'Inactive'}
+
+
+def opposite(action):
+    return 'SELL' if action == 'BUY' else 'BUY'
+
+
+class Leg:
+    """One side of a pair: contract, action and share quantity, with the orders and fills that worked it."""
+
+    def __init__(self, contract, action, quantity, reference=None):
+        """
+        Args:
+            contract: IB contract
+            action: 'BUY' or 'SELL'
+            quantity: Shares to trade
+            reference: Price the decision was made at, for slippage (e.g. ticker.last)
+        """
+        self.contract = contract
+        self.action = action
+        self.quantity = quantity
+        self.reference = reference
+        self.trades = []
+        self.unwinds = []
+        self.submitted = None
+        self.last_fill = None
+
+    @property
+    def symbol(self):
+        return self.contract.symbol
+
+    def _on_fill(self, trade, fill):
+        self.last_fill = time.perf_counter()
+
+    @staticmethod
+    def _shares(trades):
+        return sum(fill.execution.shares for trade in trades for fill in trade.fills)
+
+    @property
+    def filled(self):
+        return self._shares(self.trades)
+
+    @property
+    def remaining(self):
+        return self.quantity - self.filled
+
+    @property
+    def held(self):
+        """Shares still held from this leg after any trim."""
+        return self.filled - self._shares(self.unwinds)
+
+    @property
+    def working(self):
+        return any(trade.orderStatus.status not in TERMINAL_STATES for trade in self.trades + self.unwinds)
+
+    @property
+    def avg_price(self):
+        fills = [fill.execution for trade in self.trades for fill in trade.fills]
+        shares = sum(e.shares for e in fills)
+        return sum(e.shares * e.price for e in fills) / shares if shares else float('nan')
+
+    @property
+    def latency(self):
+        """Seconds from submission to the last fill."""
+        if self.submitted is None or self.last_fill is None:
+            return float('nan')
+        return self.last_fill - self.submitted
+
+    @property
+    def slippage_bps(self):
+        """Cost against the reference price in basis points; positive when the fill was worse."""
+        if not self.reference or not self.filled:
+            return float('nan')
+        sign = 1 if self.action == 'BUY' else -1
+        return sign * (self.avg_price - self.reference) / self.reference * 1e4
+
+    @property
+    def undone(self):
+        """Shares of the order not filled or given back by a trim."""
+        return self.quantity - self.held
+
+    def closing(self, reference=None):
+        """The leg that flattens what this one holds."""
+        return Leg(self.contract, opposite(self.action), self.held, reference)
+
+    def rest(self, reference=None):
+        """The leg that trades what this one left undone."""
+        return Leg(self.contract, self.action, self.undone, reference)
+
+    def report(self, label):
+        status = 'filled' if self.remaining <= 0 else 'partial'
+        if self.unwinds:
+            status = 'trimmed'
+        return {
+            'Time': dt.datetime.now().isoformat(timespec='seconds'),
+            'Label': label,
+            'Symbol': self.symbol,
+            'Action': self.action,
+            'Quantity': self.quantity,
+            'Filled': self.filled,
+            'Held': self.held,
+            'AvgPrice': self.avg_price,
+            'Reference': self.reference,
+            'SlippageBps': self.slippage_bps,
+            'LatencyMs': self.latency * 1000,
+            'Orders': len(self.trades) + len(self.unwinds),
+            'Status': status,
+        }
+
+
+class PairExecutor:
+    """Submits pair legs together and waits on IB's fill events, with retries and a trim for leg risk."""
+
+    def __init__(self, ib, timeout=None, attempts=None, log_path=config.EXECUTION_LOG_PATH):
+        """
+        Args:
+            ib: Connected ib_insync.IB
+            timeout: Seconds to wait for fills before acting on a short leg
+                (default: config.EXECUTION_FILL_TIMEOUT)
+            attempts: Times a short leg's remainder is resubmitted (default: config.EXECUTION_RETRY_ATTEMPTS)
+            log_path: CSV the per-leg reports are appended to (default: config.EXECUTION_LOG_PATH);
+                None or empty turns the CSV off
+        """
+        self.ib = ib
+        self.timeout = timeout or config.EXECUTION_FILL_TIMEOUT
+        self.attempts = config.EXECUTION_RETRY_ATTEMPTS if attempts is None else attempts
+        self.log_path = log_path
+
+    def _submit(self, leg, action, quantity, orders):
+        trade = self.ib.placeOrder(leg.contract, ib_insync.MarketOrder(action, quantity))
+        if orders is leg.trades:
+            # Latency is measured to the leg's own last fill, not to a trim
+            trade.fillEvent += leg._on_fill
+        orders.append(trade)
+        instrumentation.count('pair_orders')
+
+    def _wait(self, legs):
+        """
+        Process IB events until no leg has a working order or the timeout passes.
+
+        Returns as soon as the last order finishes; waitOnUpdate wakes on every
+        message from IB, so there is no polling interval.
+        """
+        deadline = time.perf_counter() + self.timeout
+        while any(leg.working for leg in legs):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return False
+            self.ib.waitOnUpdate(timeout=remaining)
+        return True
+
+    def _cancel(self, leg):
+        for trade in leg.trades:
+            if trade.orderStatus.status not in TERMINAL_STATES:
+                self.ib.cancelOrder(trade.order)
+        # Fills can still land before the cancel is confirmed; they count towards the leg
+        self._wait([leg])
+
+    def _trim(self, legs):
+        """Unwind the excess of the fuller legs down to the fill fraction of the emptiest one."""
+        fraction = min(leg.filled / leg.quantity for leg in legs)
+        for leg in legs:
+            excess = leg.held - round(leg.quantity * fraction)
+            if excess > 0:
+                logger.error(f"{leg.symbol}: unwinding {excess:g} of {leg.held:g} shares to match the other leg "
+                             f"({fraction:.0%} filled)")
+                self._submit(leg, opposite(leg.action), excess, leg.unwinds)
+        if not self._wait(legs):
+            logger.error("Trim orders not confirmed within the timeout; check the positions manually")
+
+    @instrumentation.timed('pair_execution')
+    def execute(self, legs, label='entry'):
+        """
+        Trade all legs at market and return once they are filled, retried or trimmed.
+
+        Args:
+            legs: Leg objects, submitted back to back before any wait
+            label: Name for the report, e.g. 'entry' or 'exit'
+
+        Returns:
+            The legs, with fills, held shares and reports filled in
+        """
+        legs = [leg for leg in legs if leg.quantity > 0]
+        start = time.perf_counter()
+        for leg in legs:
+            leg.submitted = start
+            self._submit(leg, leg.action, leg.quantity, leg.trades)
+        self._wait(legs)
+
+        for attempt in range(1, self.attempts + 1):
+            lagging = [leg for leg in legs if leg.remaining > 0]
+            if not lagging:
+                break
+            for leg in lagging:
+                self._cancel(leg)
+                if leg.remaining > 0:
+                    logger.warning(f"{leg.symbol}: {leg.filled:g}/{leg.quantity:g} filled, resubmitting "
+                                   f"{leg.remaining:g} (attempt {attempt}/{self.attempts})")
+                    self._submit(leg, leg.action, leg.remaining, leg.trades)
+            self._wait(legs)
+
+        if any(leg.remaining > 0 for leg in legs):
+            for leg in legs:
+                self._cancel(leg)
+            self._trim(legs)
+
+        self._report(legs, label, time.perf_counter() - start)
+        return legs
+
+    def flatten(self, legs, prices=None, label='exit'):
+        """
+        Trade closing legs and return what is still open.
+
+        Args:
+            legs: Legs that flatten the pair, from Leg.closing() or a previous flatten()
+            prices: Dict of symbol -> current price, the reference for slippage
+
+        Returns:
+            The rest of every leg left short by partial fills or a trim; empty
+            once the pair is flat. Pass it back on the next attempt.
+        """
+        prices = prices or {}
+        done = self.execute([Leg(leg.contract, leg.action, leg.quantity, prices.get(leg.symbol)) for leg in legs],
+                            label)
+        rest = [leg.rest() for leg in done if leg.undone > 0]
+        for leg in rest:
+            logger.error(f"{leg.symbol}: {leg.quantity:g} shares still to {leg.action.lower()} to flatten the pair")
+        return rest
+
+    def close(self, legs, prices=None, label='exit'):
+        """Flatten what a previous execute() left held, e.g. on an exit signal; returns what is still open."""
+        return self.flatten([leg.closing() for leg in legs], prices, label)
+
+    def _report(self, legs, label, seconds):
+        rows = [leg.report(label) for leg in legs]
+        for row in rows:
+            logger.info(f"{label} {row['Action']} {row['Symbol']}: {row['Filled']:g}/{row['Quantity']:g} "
+                        f"@ {row['AvgPrice']:.2f}, slippage {row['SlippageBps']:.1f} bps, "
+                        f"latency {row['LatencyMs']:.0f} ms ({row['Status']})")
+        logger.info(f"Pair {label} completed in {seconds:.2f}s")
+        if self.log_path:
+            try:
+                pd.DataFrame(rows).to_csv(self.log_path, mode='a', index=False,
+                                          header=not os.path.exists(self.log_path))
+            except OSError as e:
+                logger.warning(f"Could not append execution report to {self.log_path}: {e}")
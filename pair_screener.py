@@ -0,0 +1,224 @@
+"""
+Cointegration screener for pairs trading candidates.
+Builds every pair from TradingView lists via the universe index, fits Engle-Granger
+regressions in batches across pairs and ranks the results.
+"""
+import argparse
+import datetime as dt
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import config
+import instrumentation
+import market_data
+import universe
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# MacKinnon (2010) response surface for the Engle-Granger tau statistic with
+# two variables and a constant: crit = b0 + b1 / T + b2 / T^2
+EG_CRITICAL_VALUES = {
+    0.01: (-3.89644, -10.9519, -22.527),
+    0.05: (-3.33613, -6.1101, -6.823),
+    0.10: (-3.04445, -4.2412, -2.720),
+}
+
+# Price panel shared with worker processes, set once per worker by _init_worker
+_LOG_PRICES = None
+
+
+def load_price_panel(symbols, start_date, min_coverage=0.95):
+    """
+    Download closes for all symbols and align them on common dates.
+
+    Symbols with less than min_coverage of the sample are dropped; short gaps in
+    the rest are forward-filled so every column has the same dates.
+    """
+    logger.info(f"Fetching closes for {len(symbols)} symbols since {start_date}")
+    data = market_data.get_provider().get_history(symbols, start=start_date, end=dt.date.today())
+    coverage = data.notna().mean()
+    dropped = coverage.index[coverage < min_coverage].tolist()
+    if dropped:
+        logger.warning(f"Dropping symbols with insufficient history: {dropped}")
+    data = data.loc[:, coverage >= min_coverage].ffill().dropna()
+    data = data.loc[:, (data > 0).all()]
+    logger.info(f"Aligned price panel: {data.shape[0]} dates x {data.shape[1]} symbols")
+    return data
+
+
+def eg_critical_value(significance, nobs):
+    """Engle-Granger critical value for the given significance and sample size."""
+    b0, b1, b2 = EG_CRITICAL_VALUES[significance]
+    return b0 + b1 / nobs + b2 / nobs ** 2
+
+
+def _adf_tstat(resid, lags):
+    """
+    Augmented Dickey-Fuller t-statistics for many residual series at once.
+
+    Args:
+        resid: Array of shape (T, K), one residual series per column
+        lags: Number of lagged differences in the test regression
+
+    Returns:
+        Array of K t-statistics on the lagged level coefficient
+    """
+    diff = np.diff(resid, axis=0)
+    level = resid[lags:-1]
+    target = diff[lags:]
+    nobs = target.shape[0]
+
+    if lags == 0:
+        sxx = np.einsum('tk,tk->k', level, level)
+        gamma = np.einsum('tk,tk->k', level, target) / sxx
+        err = target - gamma * level
+        s2 = np.einsum('tk,tk->k', err, err) / (nobs - 1)
+        return gamma / np.sqrt(s2 / sxx)
+
+    regressors = [level] + [diff[lags - i:-i] for i in range(1, lags + 1)]
+    design = np.stack(regressors, axis=2)
+    xtx = np.einsum('tki,tkj->kij', design, design)
+    xty = np.einsum('tki,tk->ki', design, target)
+    coef = np.linalg.solve(xtx, xty[..., None])[..., 0]
+    err = target - np.einsum('tki,ki->tk', design, coef)
+    s2 = np.einsum('tk,tk->k', err, err) / (nobs - design.shape[2])
+    var_gamma = np.linalg.inv(xtx)[:, 0, 0] * s2
+    return coef[:, 0] / np.sqrt(var_gamma)
+
+
+def screen_pairs(log_prices, left, right, lags=1):
+    """
+    Engle-Granger statistics for a batch of pairs.
+
+    Args:
+        log_prices: Array of shape (T, N) with log closes
+        left: Column indices of the dependent leg
+        right: Column indices of the hedge leg
+        lags: ADF lag order
+
+    Returns:
+        Dict of arrays: hedge ratio, intercept, ADF statistic, half-life and
+        current z-score, one entry per pair
+    """
+    y = log_prices[:, left]
+    x = log_prices[:, right]
+    x_mean = x.mean(axis=0)
+    y_mean = y.mean(axis=0)
+    xc = x - x_mean
+    yc = y - y_mean
+    beta = np.einsum('tk,tk->k', xc, yc) / np.einsum('tk,tk->k', xc, xc)
+    alpha = y_mean - beta * x_mean
+    resid = yc - beta * xc
+
+    adf = _adf_tstat(resid, lags)
+
+    # Half-life from the AR(1) fit dS_t = c + lambda * S_{t-1}
+    level = resid[:-1] - resid[:-1].mean(axis=0)
+    diff = np.diff(resid, axis=0)
+    lam = np.einsum('tk,tk->k', level, diff) / np.einsum('tk,tk->k', level, level)
+    with np.errstate(divide='ignore'):
+        half_life = np.where(lam < 0, -math.log(2) / lam, np.inf)
+
+    zscore = resid[-1] / resid.std(axis=0)
+    return {'HedgeRatio': beta, 'Intercept': alpha, 'AdfStat': adf, 'HalfLife': half_life, 'ZScore': zscore}
+
+
+def _init_worker(log_prices):
+    global _LOG_PRICES
+    _LOG_PRICES = log_prices
+
+
+def _screen_chunk(left, right, lags):
+    return left, right, screen_pairs(_LOG_PRICES, left, right, lags)
+
+
+@instrumentation.timed('screen')
+def run_screen(prices, lags=None, significance=None, chunk_size=None, workers=None):
+    """
+    Screen every pair of columns in a price panel for cointegration.
+
+    Args:
+        prices: DataFrame of aligned closes, one column per symbol
+        lags: ADF lag order (default: config.PAIR_SCREEN_ADF_LAGS)
+        significance: Test size used for the Cointegrated flag
+        chunk_size: Pairs evaluated per vectorized batch
+        workers: Worker processes; 1 runs in-process
+
+    Returns:
+        DataFrame with one row per pair, ranked by ADF statistic
+    """
+    lags = config.PAIR_SCREEN_ADF_LAGS if lags is None else lags
+    significance = significance or config.PAIR_SCREEN_SIGNIFICANCE
+    chunk_size = chunk_size or config.PAIR_SCREEN_CHUNK_SIZE
+    workers = workers or config.PAIR_SCREEN_WORKERS or os.cpu_count()
+
+    symbols = np.asarray(prices.columns)
+    log_prices = np.log(prices.to_numpy(dtype=np.float64))
+    left, right = np.triu_indices(len(symbols), k=1)
+    chunks = [(left[i:i + chunk_size], right[i:i + chunk_size], lags) for i in range(0, len(left), chunk_size)]
+    logger.info(f"Screening {len(left)} pairs in {len(chunks)} batches on {workers} worker(s)")
+
+    results = []
+    if workers == 1:
+        _init_worker(log_prices)
+        results = [_screen_chunk(*chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(log_prices,)) as pool:
+            futures = [pool.submit(_screen_chunk, *chunk) for chunk in chunks]
+            for done, future in enumerate(futures, start=1):
+                results.append(future.result())
+                if done % 10 == 0 or done == len(futures):
+                    logger.info(f"Finished batch {done}/{len(futures)}")
+
+    frames = []
+    for chunk_left, chunk_right, stats in results:
+        frame = pd.DataFrame(stats)
+        frame.insert(0, 'StockX', symbols[chunk_left])
+        frame.insert(1, 'StockY', symbols[chunk_right])
+        frames.append(frame)
+    table = pd.concat(frames, ignore_index=True)
+
+    critical = eg_critical_value(significance, log_prices.shape[0])
+    table['Cointegrated'] = table['AdfStat'] < critical
+    table = table.sort_values(by='AdfStat').reset_index(drop=True)
+    table.index.name = 'Rank'
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Screen TradingView lists for cointegrated pairs")
+    parser.add_argument('lists', nargs='*', default=config.PAIR_SCREEN_LISTS,
+                        help="TradingView list names, e.g. 'Semiconductor' 'Oil and Gas'")
+    parser.add_argument('--exclude', action='append', default=[], help="List whose symbols are left out")
+    parser.add_argument('--start', default=config.PAIR_SCREEN_START_DATE, help="First date of the price sample")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--output', default=config.PAIR_SCREEN_OUTPUT_PATH, help="CSV file for the ranked table")
+    args = parser.parse_args(argv)
+
+    try:
+        # US-listed equities only, as pairs need a common trading calendar
+        symbols = universe.select(args.lists, exclude=args.exclude, asset_class='equity').symbols
+        logger.info(f"Loaded {len(symbols)} symbols from {args.lists}")
+
+        prices = load_price_panel(symbols, args.start)
+        table = run_screen(prices, workers=args.workers)
+        table.to_csv(args.output)
+        logger.info(f"Ranked {len(table)} pairs, {int(table['Cointegrated'].sum())} cointegrated; saved to {args.output}")
+        logger.info(f"\n{table.head(20)}")
+    except Exception as e:
+        logger.error(f"Pair screening failed: {e}", exc_info=True)
+        raise
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(main, 'pair_screener')
@@ -0,0 +1,288 @@
+"""
+Event-driven backtester for pairs trading on hourly or tick bars.
+Replays many pairs at once, vectorized across pairs on every bar, using the same
+entry/exit rules as online_stoploss with simulated slippage and commissions.
+"""
+import argparse
+import datetime as dt
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+import config
+import instrumentation
+import market_data
+import spread_engine
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def load_hourly_pairs(pairs, start, end=None, interval='1h'):
+    """
+    Download bars for every leg and return aligned X and Y close panels.
+
+    Args:
+        pairs: DataFrame with StockX and StockY columns
+        start: First date to load
+        end: Last date to load (default: today)
+        interval: Yahoo bar interval, e.g. '1h'
+
+    Returns:
+        (prices_x, prices_y): DataFrames indexed by bar time, one column per pair.
+        Gaps are forward-filled; a pair is NaN until both of its legs have
+        traded, so a leg listed after start only delays its own pair.
+    """
+    end = end or dt.date.today()
+    symbols = sorted(set(pairs['StockX']) | set(pairs['StockY']))
+    logger.info(f"Fetching {interval} bars for {len(symbols)} symbols from {start} to {end}")
+    closes = market_data.get_provider().get_history(symbols, start=start, end=end, interval=interval)
+    closes = closes.ffill().dropna(how='all', axis=1)
+    found = pairs['StockX'].isin(closes.columns) & pairs['StockY'].isin(closes.columns)
+    if not found.all():
+        missing = pairs.loc[~found, ['StockX', 'StockY']].astype(str).agg('/'.join, axis=1).tolist()
+        logger.warning(f"No {interval} bars for a leg of {missing}; pairs skipped")
+    pairs = pairs[found]
+    names = [f"{x}/{y}" for x, y in zip(pairs['StockX'], pairs['StockY'])]
+    prices_x = pd.DataFrame(closes[pairs['StockX']].to_numpy(), index=closes.index, columns=names)
+    prices_y = pd.DataFrame(closes[pairs['StockY']].to_numpy(), index=closes.index, columns=names)
+    # Drop the leading bars where no pair has both legs yet
+    both = (prices_x.notna() & prices_y.notna()).any(axis=1)
+    first = both.to_numpy().argmax() if both.any() else len(both)
+    return prices_x.iloc[first:], prices_y.iloc[first:]
+
+
+def rolling_zscores(prices_x, prices_y, window):
+    """
+    Rolling hedge ratio and spread z-score for every pair and bar.
+
+    Uses cumulative sums so each window costs O(1), matching the statistics
+    RollingSpread keeps live (the window includes the current bar). Bars where
+    either leg is NaN are left out of the sums, and a window only produces a
+    value when all of its bars are valid, so a gap does not poison later bars.
+
+    Returns:
+        (beta, zscore): arrays of shape (T, P), NaN until the window is full
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lx = np.log(prices_x)
+        ly = np.log(prices_y)
+    valid = np.isfinite(lx) & np.isfinite(ly)
+    lx = np.where(valid, lx, 0.0)
+    ly = np.where(valid, ly, 0.0)
+
+    def window_sum(values):
+        csum = np.cumsum(values, axis=0)
+        out = np.full(csum.shape, np.nan)
+        out[window - 1] = csum[window - 1]
+        out[window:] = csum[window:] - csum[:-window]
+        return out
+
+    full = window_sum(valid.astype(np.float64)) == window
+    n = float(window)
+    mean_x = window_sum(lx) / n
+    mean_y = window_sum(ly) / n
+    var_x = window_sum(lx * lx) / n - mean_x ** 2
+    var_y = window_sum(ly * ly) / n - mean_y ** 2
+    cov = window_sum(lx * ly) / n - mean_x * mean_y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = cov / var_y
+        alpha = mean_x - beta * mean_y
+        resid_std = np.sqrt(np.maximum(var_x - beta * cov, 0.0) * n / (n - 2))
+        zscore = (lx - alpha - beta * ly) / resid_std
+    return np.where(full, beta, np.nan), np.where(full, zscore, np.nan)
+
+
+def _commission(shares, per_share, minimum):
+    return np.where(shares > 0, np.maximum(shares * per_share, minimum), 0.0)
+
+
+@instrumentation.timed('backtest')
+def run_backtest(prices_x, prices_y, mode=None, position_size=None, slippage_bps=None,
+                 commission_per_share=None, min_commission=None, window=None,
+                 entry_z=None, exit_z=None, stop_z=None, target_multiplier=None):
+    """
+    Replay bars for many pairs and simulate the live trading rules.
+
+    In 'ratio' mode each pair enters long X / short Y whenever flat and exits
+    when the price ratio falls to initial_ratio * target_multiplier. In
+    'zscore' mode entries and exits follow the spread engine thresholds, with
+    the Y leg sized by the rolling hedge ratio. Fills happen at the bar close
+    moved against the trade by slippage_bps.
+
+    Args:
+        prices_x: DataFrame (bars x pairs) of X leg closes
+        prices_y: DataFrame (bars x pairs) of Y leg closes, same shape
+        mode: 'ratio' or 'zscore' (default: config.PAIRS_SIGNAL_MODE)
+
+    Returns:
+        Dict with 'equity' (cumulative P&L per pair plus 'Total'),
+        'trades' (one row per fill pair) and 'summary' (per-pair statistics)
+    """
+    mode = mode or config.PAIRS_SIGNAL_MODE
+    position_size = position_size or config.POSITION_SIZE
+    slippage = (config.BACKTEST_SLIPPAGE_BPS if slippage_bps is None else slippage_bps) / 10_000
+    per_share = config.BACKTEST_COMMISSION_PER_SHARE if commission_per_share is None else commission_per_share
+    minimum = config.BACKTEST_MIN_COMMISSION if min_commission is None else min_commission
+    window = window or config.ZSCORE_WINDOW
+    entry_z = config.ZSCORE_ENTRY if entry_z is None else entry_z
+    exit_z = config.ZSCORE_EXIT if exit_z is None else exit_z
+    stop_z = config.ZSCORE_STOP if stop_z is None else stop_z
+
+    px = prices_x.to_numpy(dtype=np.float64)
+    py = prices_y.to_numpy(dtype=np.float64)
+    n_bars, n_pairs = px.shape
+    pair_index = np.arange(n_pairs)
+
+    if mode == 'zscore':
+        beta, zscores = rolling_zscores(px, py, window)
+    elif mode != 'ratio':
+        raise ValueError(f"Unknown backtest mode: {mode}")
+
+    side = np.zeros(n_pairs, dtype=np.int8)      # 1 long spread, -1 short spread
+    qty_x = np.zeros(n_pairs)                    # signed share positions
+    qty_y = np.zeros(n_pairs)
+    cash = np.zeros(n_pairs)
+    target_ratio = np.full(n_pairs, np.nan)
+    entry_bar = np.full(n_pairs, -1)
+    entry_cost = np.zeros(n_pairs)
+    entry_fees = np.zeros(n_pairs)
+    equity = np.empty((n_bars, n_pairs))
+    commissions_paid = np.zeros(n_pairs)
+    trades = []
+
+    for t in range(n_bars):
+        bar_x = px[t]
+        bar_y = py[t]
+        valid = np.isfinite(bar_x) & np.isfinite(bar_y)
+
+        # Exits first, so a pair can re-enter on a later bar only
+        if mode == 'ratio':
+            exiting = (side != 0) & valid & spread_engine.ratio_exit_triggered(bar_x / bar_y, target_ratio)
+            stopped = np.zeros(n_pairs, dtype=bool)
+        else:
+            z = zscores[t]
+            exit_now, stopped = spread_engine.zscore_exit_triggered(np.nan_to_num(z), side, exit_z, stop_z)
+            exiting = (exit_now | stopped) & valid & np.isfinite(z)
+        if exiting.any():
+            idx = pair_index[exiting]
+            fill_x = bar_x[idx] * (1 - np.sign(qty_x[idx]) * slippage)
+            fill_y = bar_y[idx] * (1 - np.sign(qty_y[idx]) * slippage)
+            fees = (_commission(np.abs(qty_x[idx]), per_share, minimum)
+                    + _commission(np.abs(qty_y[idx]), per_share, minimum))
+            proceeds = qty_x[idx] * fill_x + qty_y[idx] * fill_y - fees
+            cash[idx] += proceeds
+            commissions_paid[idx] += fees
+            for k, pair in enumerate(idx):
+                trades.append({
+                    'Pair': prices_x.columns[pair],
+                    'Side': 'LONG' if side[pair] == 1 else 'SHORT',
+                    'Entry': prices_x.index[entry_bar[pair]],
+                    'Exit': prices_x.index[t],
+                    'SharesX': qty_x[pair],
+                    'SharesY': qty_y[pair],
+                    'Commissions': fees[k] + entry_fees[pair],
+                    'P/L': proceeds[k] - entry_cost[pair],
+                    'Reason': 'STOP' if stopped[pair] else 'EXIT',
+                })
+            qty_x[idx] = 0
+            qty_y[idx] = 0
+            side[idx] = 0
+
+        # Entries for flat pairs
+        flat = (side == 0) & valid & ~exiting
+        if mode == 'ratio':
+            new_side = np.where(flat, 1, 0)
+            size_y = np.full(n_pairs, float(position_size))
+        else:
+            z = zscores[t]
+            new_side = np.where(flat & np.isfinite(z) & (beta[t] > 0),
+                                spread_engine.zscore_entry_side(np.nan_to_num(z), entry_z), 0)
+            with np.errstate(invalid='ignore'):
+                size_y = np.maximum(1, np.round(position_size * beta[t] * bar_x / bar_y))
+        entering = new_side != 0
+        if entering.any():
+            idx = pair_index[entering]
+            s = new_side[idx]
+            qty_x[idx] = s * position_size
+            qty_y[idx] = -s * size_y[idx]
+            fill_x = bar_x[idx] * (1 + np.sign(qty_x[idx]) * slippage)
+            fill_y = bar_y[idx] * (1 + np.sign(qty_y[idx]) * slippage)
+            fees = (_commission(np.abs(qty_x[idx]), per_share, minimum)
+                    + _commission(np.abs(qty_y[idx]), per_share, minimum))
+            cost = qty_x[idx] * fill_x + qty_y[idx] * fill_y + fees
+            cash[idx] -= cost
+            commissions_paid[idx] += fees
+            entry_cost[idx] = cost
+            entry_fees[idx] = fees
+            side[idx] = s
+            entry_bar[idx] = t
+            target_ratio[idx] = spread_engine.ratio_target(bar_x[idx] / bar_y[idx], target_multiplier)
+
+        # Mark to market; pairs with a missing bar keep their previous equity
+        mark_x = np.where(np.isfinite(bar_x), bar_x, 0.0)
+        mark_y = np.where(np.isfinite(bar_y), bar_y, 0.0)
+        equity[t] = cash + qty_x * mark_x + qty_y * mark_y
+        if t > 0:
+            gaps = ~valid
+            equity[t, gaps] = equity[t - 1, gaps]
+
+    equity_df = pd.DataFrame(equity, index=prices_x.index, columns=prices_x.columns)
+    equity_df['Total'] = equity_df.sum(axis=1)
+    trades_df = pd.DataFrame(trades, columns=['Pair', 'Side', 'Entry', 'Exit', 'SharesX', 'SharesY',
+                                              'Commissions', 'P/L', 'Reason'])
+
+    pair_equity = equity_df[prices_x.columns]
+    drawdown = (pair_equity.cummax() - pair_equity).max()
+    grouped = trades_df.groupby('Pair')
+    summary = pd.DataFrame({
+        'Trades': grouped.size(),
+        'WinRate': grouped['P/L'].apply(lambda pnl: (pnl > 0).mean()),
+        'Commissions': pd.Series(commissions_paid, index=prices_x.columns),
+        'P/L': pair_equity.iloc[-1],
+        'MaxDrawdown': drawdown,
+        'OpenAtEnd': pd.Series(side != 0, index=prices_x.columns),
+    }).fillna({'Trades': 0}).rename_axis('Pair')
+    return {'equity': equity_df, 'trades': trades_df, 'summary': summary}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest pairs trading rules on intraday bars")
+    parser.add_argument('pairs', help="CSV with StockX and StockY columns, e.g. stock_symbols.csv or pair_screen.csv")
+    parser.add_argument('--start', default=(dt.date.today() - dt.timedelta(days=365)).isoformat())
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--interval', default='1h')
+    parser.add_argument('--mode', choices=['ratio', 'zscore'], default=config.PAIRS_SIGNAL_MODE)
+    parser.add_argument('--top', type=int, default=None, help="Only use the first N pairs of the file")
+    parser.add_argument('--output-dir', default='outputs')
+    args = parser.parse_args(argv)
+
+    try:
+        pairs = pd.read_csv(args.pairs)
+        if args.top:
+            pairs = pairs.head(args.top)
+        prices_x, prices_y = load_hourly_pairs(pairs, args.start, args.end, args.interval)
+        logger.info(f"Backtesting {prices_x.shape[1]} pairs over {prices_x.shape[0]} bars in {args.mode} mode")
+        result = run_backtest(prices_x, prices_y, mode=args.mode)
+
+        os.makedirs(args.output_dir, exist_ok=True)
+        result['equity'].to_csv(os.path.join(args.output_dir, 'backtest_equity.csv'))
+        result['trades'].to_csv(os.path.join(args.output_dir, 'backtest_trades.csv'), index=False)
+        result['summary'].to_csv(os.path.join(args.output_dir, 'backtest_summary.csv'))
+        total = result['equity']['Total']
+        logger.info(f"Total P/L: ${total.iloc[-1]:,.2f} over {len(result['trades'])} trades; "
+                    f"max drawdown ${(total.cummax() - total).max():,.2f}")
+        logger.info(f"\n{result['summary'].sort_values('P/L', ascending=False).head(20)}")
+    except Exception as e:
+        logger.error(f"Backtest failed: {e}", exc_info=True)
+        raise
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(main, 'pairs_backtester')
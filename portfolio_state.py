@@ -0,0 +1,417 @@
+"""
+Portfolio state updated by deltas, from IB or from successive broker exports.
+PortfolioState holds positions, average costs and net liquidation keyed by
+symbol, with sector exposure maintained incrementally, so a change to one
+position costs one row's worth of work. IBPortfolioSync loads it from IB and
+keeps it current from the position and account-value streams; transform_df
+diffs each CSV export against the state saved by the previous run.
+
+Usage:
+    python portfolio_state.py            # one snapshot from IB, written like transform_df
+    python portfolio_state.py --follow   # keep the transformed portfolio in sync
+"""
+import argparse
+import asyncio
+import datetime as dt
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import config
+import instrumentation
+import market_data
+from lazy_imports import lazy_import
+
+ib_insync = lazy_import('ib_insync')
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+COLUMNS = ['Symbol', 'Position', 'Amount', 'Protfilio Precentage', 'Sector']
+
+# Sector a symbol carries until its lookup returns
+UNRESOLVED_SECTOR = 'Unknown'
+
+# Longest wait between IB reconnect attempts
+MAX_RECONNECT_SECONDS = 300
+
+
+def lookup_sector(symbol):
+    """Sector for a ticker as transform_df has always labelled it: ETF without a sector, Unknown on failure."""
+    try:
+        return market_data.get_provider().get_info(symbol).get('sector', 'ETF')
+    except Exception as e:
+        logger.warning(f"Could not fetch sector for {symbol}: {e}")
+        return 'Unknown'
+
+
+def read_export(path):
+    """Broker CSV export as (Symbol, Position, Avg Price) rows with numeric positions."""
+    df = pd.read_csv(path, usecols=['Financial Instrument', 'Position', 'Avg Price'])
+    df.rename(columns={'Financial Instrument': 'Symbol'}, inplace=True)
+    df['Position'] = pd.to_numeric(df['Position'].astype(str).str.replace(',', '')).astype(float)
+    df['Avg Price'] = df['Avg Price'].astype(float)
+    return df
+
+
+class PortfolioState:
+    """
+    Positions keyed by symbol, updated one delta at a time.
+
+    Amounts are computed when a position changes and sector exposure is
+    adjusted by the difference, so unchanged rows are never revisited.
+    Writers (the IB event handlers) and readers (the daemon, the CLI) may be on
+    different threads; every access goes through one lock, and version
+    increases with each change so readers can skip an unchanged book.
+    """
+
+    def __init__(self, net_liquidity=None, sectors=None):
+        """
+        Args:
+            net_liquidity: Denominator of the position percentages (default: config.NET_LIQUIDITY)
+            sectors: Symbol -> sector cache, shared between books so each symbol is looked up once
+        """
+        self.net_liquidity = net_liquidity or config.NET_LIQUIDITY
+        self.positions = {}
+        self.avg_cost = {}
+        self.amounts = {}
+        self.sectors = sectors if sectors is not None else {}
+        self.sector_exposure = {}
+        self.sector_count = {}
+        self.version = 0
+        self.updated = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=None, net_liquidity=None):
+        """State saved by dump(); empty if nothing was saved yet."""
+        state = cls(net_liquidity)
+        path = path or config.PORTFOLIO_STATE_PATH
+        if os.path.exists(path):
+            saved = pd.read_csv(path, keep_default_na=False)
+            # Failed lookups are retried, as transform_df always has
+            state.sectors.update((s, sector) for s, sector in zip(saved['Symbol'], saved['Sector']) if sector != 'Unknown')
+            for symbol, position, avg_cost in zip(saved['Symbol'], saved['Position'], saved['AvgCost']):
+                state.apply(symbol, float(position), float(avg_cost))
+        return state
+
+    def dump(self, path=None):
+        """Save positions and looked-up sectors for the next run's diff."""
+        path = path or config.PORTFOLIO_STATE_PATH
+        with self._lock:
+            symbols = list(self.positions)
+            pd.DataFrame({
+                'Symbol': symbols,
+                'Position': [self.positions[s] for s in symbols],
+                'AvgCost': [self.avg_cost[s] for s in symbols],
+                'Sector': [self.sectors[s] for s in symbols],
+            }).to_csv(path, index=False)
+
+    def _expose(self, symbol, amount):
+        """Move a symbol's amount to a new value, adjusting its sector's exposure by the difference."""
+        sector = self.sectors[symbol]
+        old = self.amounts.pop(symbol, None)
+        if old is not None:
+            self.sector_count[sector] -= 1
+            self.sector_exposure[sector] -= abs(old)
+        if amount is not None:
+            self.amounts[symbol] = amount
+            self.sector_count[sector] = self.sector_count.get(sector, 0) + 1
+            self.sector_exposure[sector] = self.sector_exposure.get(sector, 0.0) + abs(amount)
+        if not self.sector_count.get(sector):
+            # Drop emptied sectors rather than keep a rounding residue
+            self.sector_count.pop(sector, None)
+            self.sector_exposure.pop(sector, None)
+
+    def _touch(self):
+        self.version += 1
+        self.updated = dt.datetime.now()
+
+    def apply(self, symbol, position, avg_cost):
+        """
+        Set one symbol's position; a zero position closes it.
+
+        Returns:
+            True if the book changed
+        """
+        if position and symbol not in self.sectors:
+            # Looked up outside the lock; only new symbols pay for it
+            self.sectors[symbol] = lookup_sector(symbol)
+        with self._lock:
+            if not position:
+                if symbol not in self.positions:
+                    return False
+                del self.positions[symbol]
+                del self.avg_cost[symbol]
+                self._expose(symbol, None)
+            elif self.positions.get(symbol) == position and self.avg_cost.get(symbol) == avg_cost:
+                return False
+            else:
+                self.positions[symbol] = position
+                self.avg_cost[symbol] = avg_cost
+                self._expose(symbol, position * avg_cost)
+            self._touch()
+        instrumentation.count('portfolio_deltas')
+        return True
+
+    def replace(self, rows):
+        """Load a full snapshot of (symbol, position, avg_cost); symbols not in it are closed."""
+        rows = list(rows)
+        held = {symbol for symbol, position, _ in rows if position}
+        changed = sum(self.apply(symbol, 0, 0.0) for symbol in list(self.positions) if symbol not in held)
+        changed += sum(self.apply(symbol, position, avg_cost) for symbol, position, avg_cost in rows)
+        return changed
+
+    def set_sector(self, symbol, sector):
+        """
+        Relabel a symbol's sector, moving its exposure; e.g. once a deferred lookup returns.
+
+        Returns:
+            True if the book changed
+        """
+        with self._lock:
+            if self.sectors.get(symbol) == sector:
+                return False
+            amount = self.amounts.get(symbol)
+            if amount is not None:
+                self._expose(symbol, None)
+            self.sectors[symbol] = sector
+            if amount is not None:
+                self._expose(symbol, amount)
+                self._touch()
+        return amount is not None
+
+    def set_net_liquidity(self, value):
+        with self._lock:
+            if value > 0 and value != self.net_liquidity:
+                self.net_liquidity = value
+                self._touch()
+
+    def exposure(self):
+        """Sector and gross exposure as fractions of net liquidation, from the running sums."""
+        with self._lock:
+            sectors = {sector: value / self.net_liquidity for sector, value in sorted(self.sector_exposure.items())}
+        return {'gross': sum(sectors.values()), 'sectors': sectors}
+
+    def sector_frame(self):
+        """One row per sector in the transformed layout, e.g. for extremities.check_sectors."""
+        sectors = self.exposure()['sectors']
+        return pd.DataFrame({'Sector': list(sectors), 'Protfilio Precentage': list(sectors.values())})
+
+    def frame(self):
+        """Positions in the layout transform_df writes to PORTFOLIO_PATH_TRANSFORMED."""
+        with self._lock:
+            symbols = list(self.positions)
+            amounts = np.fromiter((self.amounts[s] for s in symbols), dtype=np.float64, count=len(symbols))
+            net_liquidity = self.net_liquidity
+        return pd.DataFrame({
+            'Symbol': symbols,
+            'Position': np.where(amounts > 0, 'LONG', 'SHORT'),
+            'Amount': amounts,
+            'Protfilio Precentage': np.abs(amounts) / net_liquidity,
+            'Sector': [self.sectors[s] for s in symbols],
+        }, columns=COLUMNS)
+
+    def save(self, path=None):
+        path = path or config.PORTFOLIO_PATH_TRANSFORMED
+        with instrumentation.stage('excel_write'):
+            self.frame().to_excel(path, index=False)
+        logger.info(f"Portfolio ({len(self.positions)} positions, v{self.version}) saved to {path}")
+
+
+def yahoo_symbol(contract):
+    """Yahoo ticker for an IB stock contract, e.g. 'BRK B' -> 'BRK-B'."""
+    return contract.symbol.replace(' ', '-')
+
+
+class IBPortfolioSync:
+    """
+    Feeds a PortfolioState from IB's position and account-value streams.
+
+    Sectors of new symbols are looked up on a worker thread so the IB event
+    loop never waits on the network; the position is booked under
+    UNRESOLVED_SECTOR and moved once the lookup returns. run() reconnects with
+    exponential backoff when the connection fails or drops, and reloads the
+    whole book on every reconnect.
+    """
+
+    def __init__(self, state, on_change=None, account=None, on_disconnect=None):
+        """
+        Args:
+            state: PortfolioState to update
+            on_change: Called after every change, e.g. to wake the daemon's portfolio job
+            account: IB account code (default: config.IB_ACCOUNT, or the only account)
+            on_disconnect: Called with a message when the connection is lost or cannot be made, e.g. an alert sender
+        """
+        self.state = state
+        self.on_change = on_change
+        self.on_disconnect = on_disconnect
+        self.account = account if account is not None else config.IB_ACCOUNT
+        self.ib = None
+        self.connected = False
+        self._skipped = set()
+        self._lookups = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sector-lookup')
+        self._stop = threading.Event()
+        self._down = False
+
+    def _row(self, position):
+        contract = position.contract
+        if contract.secType != 'STK':
+            if contract.localSymbol not in self._skipped:
+                self._skipped.add(contract.localSymbol)
+                logger.warning(f"Skipping {contract.secType} position {contract.localSymbol}; only stocks are tracked")
+            return None
+        symbol = yahoo_symbol(contract)
+        if position.position and symbol not in self.state.sectors:
+            self.state.sectors[symbol] = UNRESOLVED_SECTOR
+            self._lookups.submit(self._resolve_sector, symbol)
+        return symbol, float(position.position), float(position.avgCost)
+
+    def _resolve_sector(self, symbol):
+        sector = lookup_sector(symbol)
+        if self.state.set_sector(symbol, sector):
+            logger.info(f"Sector of {symbol} resolved to {sector}")
+            self._changed()
+
+    def wait_sectors(self):
+        """Block until every sector lookup queued so far has returned; for one-shot snapshots."""
+        self._lookups.submit(lambda: None).result()
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def connect(self):
+        """Connect read-only, load the current book and subscribe to updates."""
+        logger.info(f"Connecting to Interactive Brokers at {config.IB_IP}:{config.IB_PORT} for portfolio sync")
+        self.ib = ib_insync.IB()
+        self.ib.connect(config.IB_IP, config.IB_PORT, clientId=config.IB_PORTFOLIO_CLIENT_ID,
+                        account=self.account, readonly=True)
+        self.load()
+        self.ib.positionEvent += self._on_position
+        self.ib.accountValueEvent += self._on_account_value
+        self.connected = True
+        return self
+
+    @instrumentation.timed('ib_portfolio_load')
+    def load(self):
+        """Replace the state with IB's current positions and net liquidation."""
+        rows = [row for row in map(self._row, self.ib.positions(self.account)) if row]
+        changed = self.state.replace(rows)
+        for value in self.ib.accountSummary(self.account):
+            self._on_account_value(value, notify=False)
+        logger.info(f"Loaded {len(rows)} positions from IB ({changed} changes), "
+                    f"net liquidation {self.state.net_liquidity:,.0f}")
+        self._changed()
+
+    def _on_position(self, position):
+        if self.account and position.account != self.account:
+            return
+        row = self._row(position)
+        if row and self.state.apply(*row):
+            logger.info(f"Position update: {row[0]} {row[1]:g} @ {row[2]:,.2f}")
+            self._changed()
+
+    def _on_account_value(self, value, notify=True):
+        if value.tag != 'NetLiquidation' or value.currency not in ('USD', 'BASE'):
+            return
+        if self.account and value.account != self.account:
+            return
+        before = self.state.version
+        self.state.set_net_liquidity(float(value.value))
+        if notify and self.state.version != before:
+            self._changed()
+
+    def _lost(self, message):
+        """Log every failed attempt, but hand only the first of an outage to on_disconnect."""
+        self.connected = False
+        logger.error(message)
+        if self._down:
+            return
+        self._down = True
+        if self.on_disconnect:
+            try:
+                self.on_disconnect(message)
+            except Exception as e:
+                logger.error(f"Disconnect handler failed: {e}")
+
+    def run(self):
+        """
+        Connect and process IB events until disconnect(); safe to run on a background thread.
+
+        A failed connect or a dropped connection (e.g. a TWS restart) is
+        retried after IB_RECONNECT_SECONDS, doubling up to MAX_RECONNECT_SECONDS.
+        """
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        delay = config.IB_RECONNECT_SECONDS
+        while not self._stop.is_set():
+            try:
+                self.connect()
+                if self._down:
+                    logger.info("Portfolio sync reconnected to IB")
+                    self._down = False
+                delay = config.IB_RECONNECT_SECONDS
+                while self.ib.isConnected() and not self._stop.is_set():
+                    self.ib.sleep(1)
+                if self._stop.is_set():
+                    break
+                self._lost(f"Portfolio sync lost its IB connection; the book is stale until it reconnects "
+                           f"(retrying in {delay:g}s)")
+            except Exception as e:
+                self._lost(f"Portfolio sync could not connect to IB at {config.IB_IP}:{config.IB_PORT}: {e} "
+                           f"(retrying in {delay:g}s)")
+            if self.ib is not None and self.ib.isConnected():
+                self.ib.disconnect()
+            self._stop.wait(delay)
+            delay = min(delay * 2, MAX_RECONNECT_SECONDS)
+
+    def start(self):
+        """Run the sync on a daemon thread."""
+        thread = threading.Thread(target=self.run, name='ib-portfolio-sync', daemon=True)
+        thread.start()
+        return thread
+
+    def disconnect(self):
+        self._stop.set()
+        if self.ib and self.ib.isConnected():
+            logger.info("Disconnecting portfolio sync from Interactive Brokers")
+            self.ib.disconnect()
+        self.connected = False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync the transformed portfolio from Interactive Brokers")
+    parser.add_argument('--follow', action='store_true', help="Keep running and rewrite the portfolio on every change")
+    parser.add_argument('--output', default=config.PORTFOLIO_PATH_TRANSFORMED)
+    args = parser.parse_args(argv)
+
+    state = PortfolioState()
+    sync = IBPortfolioSync(state)
+    try:
+        if args.follow:
+            sync.on_change = lambda: state.save(args.output)
+            sync.run()
+        else:
+            sync.connect()
+            sync.wait_sectors()
+            state.save(args.output)
+    except ConnectionRefusedError:
+        logger.error(f"Could not connect to IB at {config.IB_IP}:{config.IB_PORT}. Is TWS/Gateway running?")
+        raise
+    except KeyboardInterrupt:
+        logger.info("Portfolio sync stopped by user")
+    finally:
+        sync.disconnect()
+    return state
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(main, 'portfolio_state')
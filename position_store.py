@@ -0,0 +1,172 @@
+"""
+Columnar storage for pairs-trading positions.
+Holds every position field in one NumPy record array and hands out lightweight
+views for per-position access, so memory scales with columns rather than trades.
+"""
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+POSITION_DTYPE = np.dtype([
+    ('tickerLong', 'U16'),
+    ('tickerShort', 'U16'),
+    ('startDate', 'datetime64[s]'),
+    ('endDate', 'datetime64[s]'),
+    ('operationLong', 'U8'),
+    ('operationShort', 'U8'),
+    ('openPriceLong', 'f8'),
+    ('openPriceShort', 'f8'),
+    ('ClosePriceLong', 'f8'),
+    ('ClosePriceShort', 'f8'),
+    ('terminatedOrClosed', 'U16'),
+])
+FIELDS = POSITION_DTYPE.names
+
+
+class Position:
+    """Read-only view of a single row in a PositionStore."""
+    __slots__ = ('_records', '_row')
+
+    def __init__(self, records, row):
+        self._records = records
+        self._row = row
+
+    def __str__(self):
+        return f"position pair is :{self.tickerLong} - {self.operationLong} and {self.tickerShort} - {self.operationShort}"
+
+    def __repr__(self):
+        return f"Position({self.tickerLong}/{self.tickerShort}, {self.startDate:%m/%d/%Y}-{self.endDate:%m/%d/%Y})"
+
+    def as_dict(self):
+        """Return the position fields as a plain dictionary."""
+        return {name: getattr(self, name) for name in FIELDS}
+
+    def create_ratio(self, item):
+        """Fetch hourly bars for both legs and return the long/short price ratio series."""
+        import market_data
+        start_date = self.startDate
+        end_date = self.endDate + dt.timedelta(days=1)
+        bars = market_data.get_provider().get_history([self.tickerLong, self.tickerShort], start=start_date,
+                                                      end=end_date, interval='1h', field=item)
+        long_position = bars[self.tickerLong].tolist()
+        short_position = bars[self.tickerShort].tolist()
+        long_position = [round(item, 2) for item in long_position]
+        short_position = [round(item, 2) for item in short_position]
+        return [i / j for i, j in zip(long_position, short_position)]
+
+
+def _make_field_property(name, kind):
+    if kind == 'M':
+        def getter(self):
+            return self._records[name][self._row].astype(dt.datetime)
+    elif kind == 'f':
+        def getter(self):
+            return float(self._records[name][self._row])
+    else:
+        def getter(self):
+            return str(self._records[name][self._row])
+    return property(getter)
+
+
+for _name in FIELDS:
+    setattr(Position, _name, _make_field_property(_name, POSITION_DTYPE[_name].kind))
+
+
+class PositionStore:
+    """
+    Struct-of-arrays container of pairs positions.
+
+    Slices share the underlying record array; filters keep a row index into it,
+    so neither copies position data. Columns are read with ``store['field']``
+    and rows with ``store[i]``, which returns a Position view.
+    """
+
+    def __init__(self, records, rows=None):
+        self._records = records
+        self._rows = slice(None) if rows is None else rows
+
+    @classmethod
+    def empty(cls, size=0):
+        return cls(np.zeros(size, dtype=POSITION_DTYPE))
+
+    @classmethod
+    def from_columns(cls, **columns):
+        """Build a store from equally sized column sequences keyed by field name."""
+        missing = [name for name in FIELDS if name not in columns]
+        if missing:
+            raise KeyError(f"Missing position fields: {missing}")
+        size = len(columns[FIELDS[0]])
+        records = np.zeros(size, dtype=POSITION_DTYPE)
+        for name in FIELDS:
+            values = columns[name]
+            if POSITION_DTYPE[name].kind == 'M':
+                values = pd.to_datetime(pd.Series(values)).to_numpy(dtype='datetime64[s]')
+            records[name] = values
+        return cls(records)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build a store from a DataFrame with one column per position field."""
+        return cls.from_columns(**{name: df[name].to_numpy() for name in FIELDS})
+
+    @property
+    def records(self):
+        """The record array for the rows selected by this store."""
+        return self._records[self._rows]
+
+    def _row_indices(self):
+        if isinstance(self._rows, slice):
+            return np.arange(len(self._records))[self._rows]
+        return self._rows
+
+    def __len__(self):
+        if isinstance(self._rows, slice):
+            return len(range(*self._rows.indices(len(self._records))))
+        return len(self._rows)
+
+    def __iter__(self):
+        for row in self._row_indices():
+            yield Position(self._records, int(row))
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._records[key][self._rows]
+        if isinstance(key, (int, np.integer)):
+            rows = self._row_indices()
+            return Position(self._records, int(rows[key]))
+        if isinstance(key, slice) and isinstance(self._rows, slice):
+            base = range(len(self._records))[self._rows][key]
+            stop = None if base.stop < 0 else base.stop
+            return PositionStore(self._records, slice(base.start, stop, base.step))
+        return PositionStore(self._records, self._row_indices()[key])
+
+    def where(self, mask):
+        """Return the positions where a boolean mask over this store is true."""
+        return PositionStore(self._records, self._row_indices()[np.asarray(mask, dtype=bool)])
+
+    def by_ticker(self, ticker):
+        """Return positions with the ticker on either leg."""
+        return self.where((self['tickerLong'] == ticker) | (self['tickerShort'] == ticker))
+
+    def with_status(self, status):
+        """Return positions whose terminatedOrClosed field matches status."""
+        return self.where(self['terminatedOrClosed'] == status)
+
+    def closed(self):
+        """Return positions that were closed rather than terminated."""
+        return self.with_status('Close')
+
+    def open_ratio(self):
+        """Long/short price ratio at entry for every position."""
+        return self['openPriceLong'] / self['openPriceShort']
+
+    def close_ratio(self):
+        """Long/short price ratio at exit for every position."""
+        return self['ClosePriceLong'] / self['ClosePriceShort']
+
+    def to_frame(self):
+        """Return the positions as a DataFrame, one column per field."""
+        return pd.DataFrame(self.records)
+
+    def __repr__(self):
+        return f"PositionStore({len(self)} positions)"
@@ -0,0 +1,318 @@
+"""
+Memory-mapped float32 price panel shared by every process.
+A panel is a directory holding a date index, a ticker index and one raw
+float32 array per field, stored ticker-major so each ticker's history is
+contiguous on disk. Readers map the arrays read-only: slicing a few tickers
+pages in only their rows, so resident memory follows what is touched rather
+than the size of the universe.
+
+Layout: <PRICE_PANEL_DIR>/<interval>/meta.json, dates.<version>.npy and
+<field>.<version>.f32. A rewrite saves new versioned files and swaps
+meta.json last, so processes that already mapped an older version keep
+reading it undisturbed.
+
+Usage:
+    python price_panel.py build                       # master list, daily bars from Yahoo
+    python price_panel.py build --universe all --start 2017-01-01
+    python price_panel.py build --interval 1h --source local
+    python price_panel.py update                      # append new bars
+    python price_panel.py info
+"""
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+import instrumentation
+import market_data
+import universe
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+PANEL_DTYPE = np.float32
+
+
+def _bound(value, index):
+    """Timestamp comparable with the panel's dates; naive bounds on tz-aware dates are taken as UTC."""
+    value = pd.Timestamp(value)
+    if index.tz is not None and value.tzinfo is None:
+        value = value.tz_localize('UTC')
+    return value
+
+
+def panel_path(interval='1d', root=None):
+    """Directory of the panel for one bar size."""
+    return Path(root or config.PRICE_PANEL_DIR) / interval
+
+
+@instrumentation.timed('panel_write')
+def write_panel(fields, path):
+    """
+    Write a panel from DataFrames, replacing any panel stored at path.
+
+    Args:
+        fields: Dict of field name -> DataFrame (bar time x symbols); frames
+            are aligned on the union of their dates and symbols
+        path: Panel directory
+
+    Returns:
+        Number of (symbols, dates) written
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    frames = {field: frame for field, frame in fields.items() if frame is not None}
+    indexes = [pd.DatetimeIndex(frame.index) for frame in frames.values()]
+    dates = indexes[0]
+    for index in indexes[1:]:
+        dates = dates.union(index)
+    dates = dates.unique().sort_values()
+    symbols = list(dict.fromkeys(s for f in frames.values() for s in f.columns))
+
+    old = _read_meta(path)
+    version = old['version'] + 1 if old else 1
+    for field, frame in frames.items():
+        values = frame.reindex(index=dates, columns=symbols).to_numpy(dtype=PANEL_DTYPE).T
+        np.ascontiguousarray(values).tofile(path / f'{field}.{version}.f32')
+    tz = str(dates.tz) if dates.tz is not None else None
+    np.save(path / f'dates.{version}.npy', (dates.tz_convert('UTC').tz_localize(None) if tz else dates).to_numpy())
+
+    meta = {'version': version, 'dtype': np.dtype(PANEL_DTYPE).name, 'tz': tz,
+            'fields': list(frames), 'symbols': symbols, 'shape': [len(symbols), len(dates)]}
+    tmp = path / 'meta.json.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(meta, fp)
+    os.replace(tmp, path / 'meta.json')
+
+    # Keep the previous version for readers that read meta.json but have not mapped yet;
+    # readers still holding older mappings keep them, the files just lose their names
+    for stale in [*path.glob('*.f32'), *path.glob('dates.*.npy')]:
+        if int(stale.name.split('.')[-2]) < version - 1:
+            stale.unlink(missing_ok=True)
+    logger.info(f"Panel {path}: {len(symbols)} symbols x {len(dates)} bars, fields {list(frames)} (v{version})")
+    return len(symbols), len(dates)
+
+
+def _read_meta(path):
+    try:
+        with open(Path(path) / 'meta.json', 'r') as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return None
+
+
+class PricePanel:
+    """
+    Read-only view of a stored panel.
+
+    Every field is mapped on open: write_panel deletes files two versions
+    back, and a mapping made before that keeps working after the unlink.
+    Pages are still only read when sliced.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        meta = _read_meta(self.path)
+        if meta is None:
+            raise FileNotFoundError(f"No price panel at {self.path}; run 'python price_panel.py build'")
+        self.version = meta['version']
+        self.fields = meta['fields']
+        self.dtype = np.dtype(meta['dtype'])
+        self.symbols = pd.Index(meta['symbols'])
+        dates = pd.DatetimeIndex(np.load(self.path / f'dates.{self.version}.npy'))
+        self.dates = dates.tz_localize('UTC').tz_convert(meta['tz']) if meta['tz'] else dates
+        self._arrays = {field: self._map(field) for field in self.fields}
+
+    @property
+    def shape(self):
+        return len(self.symbols), len(self.dates)
+
+    def is_current(self):
+        """False once another process has rewritten the panel."""
+        meta = _read_meta(self.path)
+        return meta is not None and meta['version'] == self.version
+
+    def _map(self, field):
+        if 0 in self.shape:
+            # mmap cannot map an empty file
+            return np.empty(self.shape, dtype=self.dtype)
+        return np.memmap(self.path / f'{field}.{self.version}.f32', dtype=self.dtype, mode='r', shape=self.shape)
+
+    def array(self, field='Close'):
+        """The whole field as a read-only memmap (symbols x dates); nothing is read until sliced."""
+        if field not in self._arrays:
+            raise KeyError(f"Field {field} not in panel {self.path} (has {self.fields})")
+        return self._arrays[field]
+
+    def window(self, start=None, end=None):
+        """Slice of date positions for start (inclusive) to end (exclusive)."""
+        i = 0 if start is None else self.dates.searchsorted(_bound(start, self.dates))
+        j = len(self.dates) if end is None else self.dates.searchsorted(_bound(end, self.dates))
+        return slice(i, j)
+
+    def values(self, field='Close', symbols=None, start=None, end=None):
+        """
+        Raw float32 rows (symbols x dates) for the requested tickers and dates.
+
+        With symbols=None the result is a zero-copy view of the mapping;
+        otherwise only the selected tickers' rows are read and copied.
+
+        Returns:
+            (array, symbols found, dates)
+        """
+        window = self.window(start, end)
+        if symbols is None:
+            return self.array(field)[:, window], self.symbols, self.dates[window]
+        found = [s for s in dict.fromkeys(symbols) if s in self.symbols]
+        rows = self.symbols.get_indexer(found)
+        return self.array(field)[rows, window], pd.Index(found), self.dates[window]
+
+    def frame(self, field='Close', symbols=None, start=None, end=None, dtype=np.float64):
+        """Panel slice as a DataFrame (dates x symbols) in the usual provider layout."""
+        values, found, dates = self.values(field, symbols, start, end)
+        return pd.DataFrame(values.T.astype(dtype), index=dates, columns=found)
+
+
+class PanelProvider(market_data.MarketDataProvider):
+    """
+    Backend serving history from the mapped panels.
+
+    A panel is reopened when another process rewrites it, so long-running
+    services pick up a daily update on their next read. Ticker info comes
+    from info.json in the panel root.
+    """
+
+    name = 'panel'
+
+    def __init__(self, root=None):
+        self.root = Path(root or config.PRICE_PANEL_DIR)
+        self._panels = {}
+        self._info = market_data.LocalFileProvider(self.root)
+
+    def panel(self, interval='1d'):
+        panel = self._panels.get(interval)
+        if panel is None or not panel.is_current():
+            instrumentation.cache_miss('price_panel')
+            panel = self._panels[interval] = PricePanel(panel_path(interval, self.root))
+        else:
+            instrumentation.cache_hit('price_panel')
+        return panel
+
+    @instrumentation.timed('fetch')
+    def get_history(self, symbols, start=None, end=None, interval='1d', field='Close'):
+        frame = self.panel(interval).frame(field, symbols, start, end)
+        return frame.dropna(axis=1, how='all')
+
+    @instrumentation.timed('fetch')
+    def get_bar_panel(self, symbols, start=None, end=None, interval='1d', fields=market_data.BAR_COLUMNS):
+        panel = self.panel(interval)
+        return {field: panel.frame(field, symbols, start, end).dropna(axis=1, how='all')
+                for field in fields if field in panel.fields}
+
+    def get_info(self, symbol):
+        return self._info.get_info(symbol)
+
+
+def _source(name):
+    if name == 'local':
+        return market_data.LocalFileProvider()
+    if name == 'yahoo':
+        return market_data.YahooProvider()
+    raise ValueError(f"Unknown panel source: {name}")
+
+
+def build_panel(symbols, start, interval='1d', source=None, root=None, info=False):
+    """
+    Download full history for symbols and write it as a new panel.
+
+    With info=True the source's ticker info is saved to info.json in the
+    panel root, which PanelProvider.get_info serves.
+    """
+    source = source or market_data.YahooProvider()
+    symbols = list(dict.fromkeys(symbols))
+    end = dt.date.today() + dt.timedelta(days=1)
+    fields = source.get_bar_panel(symbols, start=start, end=end, interval=interval)
+    shape = write_panel(fields, panel_path(interval, root))
+    if info:
+        path = Path(root or config.PRICE_PANEL_DIR) / 'info.json'
+        with open(path, 'w') as fp:
+            json.dump({symbol: source.get_info(symbol) for symbol in symbols}, fp, default=str)
+        logger.info(f"Ticker info for {len(symbols)} symbols saved to {path}")
+    return shape
+
+
+def update_panel(interval='1d', source=None, root=None, symbols=()):
+    """
+    Append bars newer than the panel's last bar and add any new symbols.
+
+    The last stored bar is fetched again so a revised close replaces it;
+    symbols the fetch did not return keep their stored bars. New symbols get
+    the panel's full date range.
+    """
+    source = source or market_data.YahooProvider()
+    panel = PricePanel(panel_path(interval, root))
+    end = dt.date.today() + dt.timedelta(days=1)
+    last = panel.dates[-1]
+    new_symbols = [s for s in dict.fromkeys(symbols) if s not in panel.symbols]
+
+    recent = source.get_bar_panel(list(panel.symbols), start=last.date(), end=end, interval=interval)
+    added = source.get_bar_panel(new_symbols, start=panel.dates[0].date(), end=end, interval=interval) \
+        if new_symbols else {}
+
+    fields = {}
+    for field in panel.fields:
+        stored = panel.frame(field, dtype=PANEL_DTYPE)
+        fresh = recent.get(field, pd.DataFrame())
+        # Re-fetched bars replace stored ones per symbol; symbols missing from the fetch keep what is stored
+        merged = stored
+        if not fresh.empty:
+            merged = fresh.combine_first(stored)[stored.columns.append(fresh.columns.difference(stored.columns))]
+        if field in added and not added[field].empty:
+            merged = merged.join(added[field], how='outer')
+        fields[field] = merged
+    logger.info(f"Updating panel from {last}: {len(new_symbols)} new symbols")
+    return write_panel(fields, panel.path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and maintain the shared memory-mapped price panel")
+    parser.add_argument('command', choices=['build', 'update', 'info'])
+    parser.add_argument('--interval', default='1d', help="Bar size, e.g. 1d or 1h")
+    parser.add_argument('--start', default=config.PRICE_PANEL_START_DATE)
+    parser.add_argument('--universe', nargs='+',
+                        help="TradingView list names, asset classes or 'all'; default: master list and holdings")
+    parser.add_argument('--source', default='yahoo', choices=['yahoo', 'local'], help="Where bars are downloaded from")
+    parser.add_argument('--info', action='store_true', help="Also save ticker info (sector, ...) for the panel provider")
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        panel = PricePanel(panel_path(args.interval))
+        size = sum((panel.path / f'{f}.{panel.version}.f32').stat().st_size for f in panel.fields)
+        logger.info(f"{panel.path}: {panel.shape[0]} symbols x {panel.shape[1]} bars "
+                    f"({panel.dates[0]} to {panel.dates[-1]}), fields {panel.fields}, "
+                    f"{size / 2 ** 20:,.1f} MB on disk (v{panel.version})")
+        return panel
+
+    if args.universe:
+        symbols = universe.select(args.universe).symbols
+    else:
+        symbols = pd.read_excel(config.ALL_TICKERS_PATH)['Symbol'].dropna().astype(str).tolist()
+        symbols += pd.read_excel(config.PORTFOLIO_PATH_TRANSFORMED)['Symbol'].dropna().astype(str).tolist()
+
+    if args.command == 'build':
+        return build_panel(symbols, args.start, args.interval, _source(args.source), info=args.info)
+    return update_panel(args.interval, _source(args.source), symbols=symbols)
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(main, 'price_panel')
@@ -0,0 +1,569 @@
+"""
+Resident risk service.
+Keeps closes, running return moments and the portfolio in memory, refreshes them
+on market-hours and overnight cadences, and serves the latest VaR, portfolio and
+risk-check results over a local HTTP endpoint.
+
+Usage:
+    python risk_daemon.py serve
+    python risk_daemon.py query status
+    python risk_daemon.py query var AAPL
+"""
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+import config
+import extremities
+import instrumentation
+import main as portfolio_main
+import market_data
+import portfolio_state
+import Var
+import volatility_models
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MARKET_TZ = ZoneInfo('America/New_York')
+MARKET_OPEN = dt.time(9, 30)
+MARKET_CLOSE = dt.time(16, 0)
+
+
+def market_is_open(now=None):
+    """True during regular US equity hours on weekdays (exchange holidays are not modelled)."""
+    now = (now or dt.datetime.now(MARKET_TZ)).astimezone(MARKET_TZ)
+    return now.weekday() < 5 and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+
+def last_completed_session(now=None):
+    """Date of the latest daily bar that can no longer change."""
+    now = (now or dt.datetime.now(MARKET_TZ)).astimezone(MARKET_TZ)
+    day = now.date()
+    if now.weekday() >= 5 or now.time() < MARKET_CLOSE:
+        day -= dt.timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= dt.timedelta(days=1)
+    return day
+
+
+class ReturnMoments:
+    """
+    Running daily-return sums per ticker.
+
+    VaR only needs the count, sum and sum of squares of each ticker's returns,
+    so appending new closes costs O(new bars) and revaluing a ticker is O(1).
+    The sum of squared losses and the running peak and drawdown give the
+    downside deviation and max drawdown the same way.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.count = np.zeros(0)
+        self.total = np.zeros(0)
+        self.total_sq = np.zeros(0)
+        self.total_down_sq = np.zeros(0)
+        self.peak = np.zeros(0)
+        self.max_drawdown = np.zeros(0)
+        self.last_close = np.zeros(0)
+        self.last_date = np.zeros(0, dtype='datetime64[D]')
+
+    def __contains__(self, symbol):
+        return symbol in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def has_bars(self, symbol):
+        """True once at least one close of symbol has been folded in."""
+        return symbol in self.index and not np.isnat(self.last_date[self.index[symbol]])
+
+    def _slot(self, symbol):
+        if symbol not in self.index:
+            self.index[symbol] = len(self.index)
+            self.count = np.append(self.count, 0.0)
+            self.total = np.append(self.total, 0.0)
+            self.total_sq = np.append(self.total_sq, 0.0)
+            self.total_down_sq = np.append(self.total_down_sq, 0.0)
+            self.peak = np.append(self.peak, np.nan)
+            self.max_drawdown = np.append(self.max_drawdown, 0.0)
+            self.last_close = np.append(self.last_close, np.nan)
+            self.last_date = np.append(self.last_date, np.datetime64('NaT', 'D'))
+        return self.index[symbol]
+
+    def append(self, symbol, closes):
+        """
+        Fold closes newer than the last stored bar into the sums.
+
+        Args:
+            symbol: Ticker symbol
+            closes: Series of closes indexed by date, NaNs already dropped
+
+        Returns:
+            True if any new bar was added
+        """
+        i = self._slot(symbol)
+        dates = closes.index.values.astype('datetime64[D]')
+        if not np.isnat(self.last_date[i]):
+            closes = closes[dates > self.last_date[i]]
+            dates = dates[dates > self.last_date[i]]
+        if closes.empty:
+            return False
+
+        values = closes.to_numpy(dtype=np.float64)
+        previous = np.concatenate(([self.last_close[i]], values[:-1]))
+        returns = values / previous - 1
+        returns = returns[~np.isnan(returns)]
+        self.count[i] += len(returns)
+        self.total[i] += returns.sum()
+        self.total_sq[i] += (returns ** 2).sum()
+        self.total_down_sq[i] += (np.minimum(returns, 0.0) ** 2).sum()
+        peaks = np.fmax.accumulate(np.concatenate(([self.peak[i]], values)))[1:]
+        self.max_drawdown[i] = max(self.max_drawdown[i], -np.nanmin(values / peaks - 1))
+        self.peak[i] = peaks[-1]
+        self.last_close[i] = values[-1]
+        self.last_date[i] = dates[-1]
+        return True
+
+    def moments(self, symbols):
+        """Mean and sample standard deviation of returns, as pandas computes them in Var.calc_var."""
+        idx = np.array([self.index[s] for s in symbols], dtype=np.intp)
+        n = self.count[idx]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.total[idx] / n
+            var = (self.total_sq[idx] - n * mean ** 2) / (n - 1)
+        return mean, np.sqrt(np.maximum(var, 0.0))
+
+    def metrics(self, symbols, initial_investment):
+        """
+        Var and the tail metrics running sums support, as Var.risk_metrics computes them.
+
+        ES needs the whole return distribution, so it is left to the batch run.
+        """
+        mean, stdev = self.moments(symbols)
+        idx = np.array([self.index[s] for s in symbols], dtype=np.intp)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            downside = np.sqrt(self.total_down_sq[idx] / self.count[idx])
+        return pd.DataFrame({
+            'Var': Var.var_from_moments(initial_investment, mean, stdev),
+            'MaxDrawdown': self.max_drawdown[idx],
+            'Volatility': stdev * np.sqrt(Var.TRADING_DAYS),
+            'DownsideDev': downside * np.sqrt(Var.TRADING_DAYS),
+        }, index=symbols)
+
+
+class RiskState:
+    """Hot in-memory data shared by the scheduled jobs and the HTTP endpoint."""
+
+    def __init__(self, provider=None):
+        self.provider = provider or market_data.get_provider()
+        self.moments = ReturnMoments()
+        self.var = pd.Series(dtype=np.float64)
+        self.metrics = pd.DataFrame()
+        self.vol = (volatility_models.VolatilityModel.load(config.VAR_VOL_MODEL)
+                    if config.VAR_VOL_MODEL != 'sample' else None)
+        self.quality = pd.Series(dtype=object)
+        self.portfolio = pd.DataFrame()
+        self.book = portfolio_state.PortfolioState.load()
+        self.violations = []
+        self.jobs = {}
+        self._missing = {}  # symbol -> time a full-history fetch last returned no bars
+        self._portfolio_mtime = None
+        self._portfolio_version = None
+        self._universe = ([], None)
+        self._lock = threading.Lock()
+        self._snapshot = {}
+        self._tickers = pd.DataFrame()
+
+    def universe(self):
+        """Master ticker list plus current holdings; the list is re-read only when its file changes."""
+        symbols = []
+        if os.path.exists(config.ALL_TICKERS_PATH):
+            mtime = os.path.getmtime(config.ALL_TICKERS_PATH)
+            if self._universe[1] != mtime:
+                tickers = pd.read_excel(config.ALL_TICKERS_PATH)['Symbol'].dropna().astype(str).tolist()
+                self._universe = (tickers, mtime)
+            symbols = list(self._universe[0])
+        if not self.portfolio.empty:
+            symbols += self.portfolio['Symbol'].tolist()
+        return list(dict.fromkeys(symbols))
+
+    @staticmethod
+    def _completed(closes):
+        """Drop today's bar while its session is still trading."""
+        if closes.empty:
+            return closes
+        cutoff = pd.Timestamp(last_completed_session())
+        return closes[closes.index.normalize() <= cutoff]
+
+    def _fold(self, closes):
+        """Add bars from a completed-bar frame; returns the tickers that changed."""
+        changed = []
+        for symbol in closes.columns:
+            if self.moments.append(symbol, closes[symbol].dropna()):
+                changed.append(symbol)
+        return changed
+
+    def _untracked(self, symbols):
+        """Symbols without return sums, except those that had no data within RISK_DAEMON_MISSING_RETRY_SECONDS."""
+        retry = time.time() - config.RISK_DAEMON_MISSING_RETRY_SECONDS
+        return [s for s in symbols if not self.moments.has_bars(s) and self._missing.get(s, 0.0) < retry]
+
+    @instrumentation.timed('daemon_prices', report='risk_daemon')
+    def refresh_prices(self):
+        """
+        Fetch only the bars missing since the last cycle and revalue changed tickers.
+
+        Tickers seen for the first time get their full history once; after that a
+        cycle fetches a few days per ticker and recomputes VaR only where a bar was added.
+        With an EWMA or GARCH volatility model, the same bars advance each ticker's
+        variance by one step per bar; tickers whose GARCH parameters expired get
+        their full history again and are refitted. Tickers that return no bars
+        are only tried again after RISK_DAEMON_MISSING_RETRY_SECONDS.
+        """
+        symbols = self.universe()
+        known = [s for s in symbols if self.moments.has_bars(s)]
+        refit = set(self.vol.stale(known)) if self.vol else set()
+        full = self._untracked(symbols) + [s for s in known if s in refit]
+        known = [s for s in known if s not in refit]
+        changed = []
+        if full:
+            logger.info(f"Loading full history for {len(full)} new tickers ({len(refit)} for a refit)")
+            closes = self._completed(self.provider.get_history(full, start=config.START_DATE_FOR_VAR,
+                                                               end=dt.date.today() + dt.timedelta(days=1)))
+            changed += self._fold(closes)
+            now = time.time()
+            for symbol in full:
+                if self.moments.has_bars(symbol):
+                    self._missing.pop(symbol, None)
+                else:
+                    self._missing[symbol] = now
+            missing = [s for s in full if s in self._missing]
+            if missing:
+                logger.warning(f"No price history for {missing}; retrying in "
+                               f"{config.RISK_DAEMON_MISSING_RETRY_SECONDS / 3600:g}h")
+            if self.vol:
+                self.vol.fit(closes)
+                changed += [s for s in refit if s not in changed]
+        if known:
+            latest = self.moments.last_date[[self.moments.index[s] for s in known]].max()
+            start = pd.Timestamp(latest) - pd.Timedelta(days=config.RISK_DAEMON_OVERLAP_DAYS)
+            closes = self._completed(self.provider.get_history(known, start=start.date(),
+                                                               end=dt.date.today() + dt.timedelta(days=1)))
+            changed += self._fold(closes)
+            if self.vol:
+                self.vol.update(closes)
+
+        if changed:
+            fresh = self.moments.metrics(changed, config.INITIAL_INVESTMENT)
+            if self.vol:
+                fresh['Var'] = self.vol.var(config.INITIAL_INVESTMENT, config.WEIGHTS, changed)
+                self.vol.save()
+            self.metrics = fresh.combine_first(self.metrics).dropna(subset=['Var'])
+            self.var = self.metrics['Var']
+            self._rate()
+        logger.info(f"Price refresh: {len(changed)} of {len(symbols)} tickers changed")
+        instrumentation.count('daemon_tickers_changed', len(changed))
+        return changed
+
+    def _rate(self):
+        """Assign GOOD/MID/BAD from each ticker's rank on the quality metric across the universe."""
+        metric = config.QUALITY_METRIC
+        if metric not in self.metrics.columns:
+            logger.warning(f"{metric} is only computed by the batch run (python Var.py); ranking on Var")
+            metric = 'Var'
+        ranked = self.metrics[metric].sort_values(kind='stable')
+        self.quality = pd.Series(portfolio_main.quality_tiers(len(ranked)), index=ranked.index)
+
+    def _load_portfolio(self):
+        """
+        The current book, or None if unchanged.
+
+        The book is a PortfolioState fed by the IB sync or by diffing each new
+        broker export, so only changed positions were re-evaluated.
+        """
+        if config.PORTFOLIO_SOURCE != 'ib':
+            mtime = os.path.getmtime(config.PORTFOLIO_PATH_ORIGINAL)
+            if mtime != self._portfolio_mtime:
+                logger.info("Broker export changed, diffing against the current book")
+                portfolio_main.transform_df(config.PORTFOLIO_PATH_ORIGINAL, config.NET_LIQUIDITY, state=self.book)
+                self._portfolio_mtime = mtime
+        if self.book.version == self._portfolio_version:
+            return None
+        if config.PORTFOLIO_SOURCE == 'ib':
+            logger.info(f"Live portfolio changed (v{self.book.version}), rebuilding")
+            self.book.save()
+        self._portfolio_version = self.book.version
+        return self.book.frame()
+
+    @instrumentation.timed('daemon_portfolio', report='risk_daemon')
+    def refresh_portfolio(self):
+        """Rebuild the book if it changed, join the latest VaR and run the risk checks."""
+        portfolio = self._load_portfolio()
+        if portfolio is not None:
+            self.portfolio = portfolio
+            if self._untracked(self.portfolio['Symbol']):
+                self.refresh_prices()
+
+        portfolio = self.portfolio.copy()
+        for column in self.metrics.columns:
+            portfolio[column] = portfolio['Symbol'].map(self.metrics[column]).fillna(0.0)
+        portfolio['Qual'] = portfolio['Symbol'].map(self.quality).fillna('UNKNOWN')
+        self.portfolio = portfolio.sort_values(by='Var').reset_index(drop=True)
+
+        frame = self.portfolio
+        self.violations = (extremities.check_sectors(self.book.sector_frame())
+                           + extremities.check_percentage(frame) + extremities.check_amount(frame)
+                           + extremities.check_pos_size(frame) + extremities.check_var_quality(frame))
+
+    def publish(self):
+        """Build the JSON snapshot served by the endpoint."""
+        last_dates = self.moments.last_date[~np.isnat(self.moments.last_date)]
+        snapshot = {
+            'updated': dt.datetime.now().isoformat(timespec='seconds'),
+            'market_open': market_is_open(),
+            'universe': len(self.moments),
+            'last_bar': str(last_dates.max()) if len(last_dates) else None,
+            'portfolio': json.loads(self.portfolio.to_json(orient='records')) if not self.portfolio.empty else [],
+            'exposure': self.book.exposure(),
+            'violations': self.violations,
+        }
+        tickers = self._ticker_table()
+        with self._lock:
+            # The scheduler keeps writing self.jobs; handlers serialize the snapshot, so it gets its own copy
+            snapshot['jobs'] = {name: dict(job) for name, job in self.jobs.items()}
+            self._snapshot = snapshot
+            self._tickers = tickers
+
+    def _ticker_table(self):
+        """Per-ticker values served by /var/<SYMBOL>, copied out of the live state."""
+        if self.metrics.empty:
+            return pd.DataFrame()
+        rows = np.array([self.moments.index[s] for s in self.metrics.index], dtype=np.intp)
+        return pd.DataFrame({
+            'Var': self.var.reindex(self.metrics.index),
+            'Qual': self.quality.reindex(self.metrics.index),
+            'MaxDrawdown': self.metrics['MaxDrawdown'],
+            'Volatility': self.metrics['Volatility'],
+            'DownsideDev': self.metrics['DownsideDev'],
+            'Observations': self.moments.count[rows],
+            'LastBar': self.moments.last_date[rows],
+        }, index=self.metrics.index)
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot
+
+    def ticker(self, symbol):
+        """One ticker's values from the last published snapshot; safe from handler threads."""
+        symbol = symbol.upper()
+        with self._lock:
+            tickers = self._tickers
+        if symbol not in tickers.index:
+            return None
+        row = tickers.loc[symbol]
+        return {
+            'symbol': symbol,
+            'var': float(row['Var']),
+            'qual': row['Qual'] if isinstance(row['Qual'], str) else None,
+            'max_drawdown': float(row['MaxDrawdown']),
+            'volatility': float(row['Volatility']),
+            'downside_dev': float(row['DownsideDev']),
+            'observations': int(row['Observations']),
+            'last_bar': str(np.datetime64(row['LastBar'], 'D')),
+        }
+
+
+class Scheduler:
+    """
+    Runs jobs on their own cadence, with one interval for market hours and one overnight.
+
+    Jobs run one at a time on the scheduler thread, so the hot data in
+    RiskState is never modified concurrently; the endpoint only reads snapshots.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.jobs = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def add_job(self, name, func, market_seconds, overnight_seconds):
+        self.jobs.append({'name': name, 'func': func, 'market': market_seconds,
+                          'overnight': overnight_seconds, 'next': 0.0})
+
+    def trigger(self, name=None):
+        """Run the named job, or every job, on the next loop iteration; safe from any thread."""
+        for job in self.jobs:
+            if name is None or job['name'] == name:
+                job['next'] = 0.0
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._stop.is_set():
+            now = time.time()
+            for job in self.jobs:
+                if job['next'] > now:
+                    continue
+                start = time.perf_counter()
+                try:
+                    job['func']()
+                    status = 'ok'
+                except Exception as e:
+                    logger.error(f"Job {job['name']} failed: {e}", exc_info=True)
+                    status = f'error: {e}'
+                interval = job['market'] if market_is_open() else job['overnight']
+                job['next'] = time.time() + interval
+                self.state.jobs[job['name']] = {
+                    'last_run': dt.datetime.now().isoformat(timespec='seconds'),
+                    'seconds': round(time.perf_counter() - start, 3),
+                    'status': status,
+                    'next_run': dt.datetime.fromtimestamp(job['next']).isoformat(timespec='seconds'),
+                }
+                self.state.publish()
+            self._wake.clear()
+            self._wake.wait(max(0.0, min(job['next'] for job in self.jobs) - time.time()))
+
+
+def _make_handler(state, scheduler):
+    class RiskRequestHandler(BaseHTTPRequestHandler):
+        """GET /status, /portfolio, /violations, /var/<SYMBOL>; POST /refresh."""
+
+        def _send(self, code, payload):
+            body = json.dumps(payload, default=str).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            snapshot = state.snapshot()
+            parts = [p for p in self.path.split('?')[0].split('/') if p]
+            if parts == ['status']:
+                summary = {k: v for k, v in snapshot.items() if k != 'portfolio'}
+                summary['positions'] = len(snapshot.get('portfolio', []))
+                self._send(200, summary)
+            elif parts == ['portfolio']:
+                self._send(200, snapshot.get('portfolio', []))
+            elif parts == ['violations']:
+                self._send(200, snapshot.get('violations', []))
+            elif len(parts) == 2 and parts[0] == 'var':
+                ticker = state.ticker(parts[1])
+                self._send(200 if ticker else 404, ticker or {'error': f'{parts[1]} is not tracked'})
+            else:
+                self._send(404, {'error': f'unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.path.rstrip('/') == '/refresh':
+                scheduler.trigger()
+                self._send(202, {'status': 'refresh scheduled'})
+            else:
+                self._send(404, {'error': f'unknown path {self.path}'})
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return RiskRequestHandler
+
+
+def serve(host=None, port=None):
+    """Start the endpoint on a background thread and run the scheduler until interrupted."""
+    host = host or config.RISK_DAEMON_HOST
+    port = port or config.RISK_DAEMON_PORT
+    state = RiskState()
+    scheduler = Scheduler(state)
+    scheduler.add_job('prices', state.refresh_prices,
+                      config.RISK_DAEMON_PRICE_INTERVAL_MARKET, config.RISK_DAEMON_PRICE_INTERVAL_OVERNIGHT)
+    scheduler.add_job('portfolio', state.refresh_portfolio,
+                      config.RISK_DAEMON_PORTFOLIO_INTERVAL_MARKET, config.RISK_DAEMON_PORTFOLIO_INTERVAL_OVERNIGHT)
+
+    sync = None
+    if config.PORTFOLIO_SOURCE == 'ib':
+        # Position deltas from IB wake the portfolio job instead of waiting for its interval
+        sync = portfolio_state.IBPortfolioSync(state.book, on_change=lambda: scheduler.trigger('portfolio'))
+        sync.start()
+
+    server = ThreadingHTTPServer((host, port), _make_handler(state, scheduler))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Risk daemon listening on http://{host}:{port}")
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        logger.info("Risk daemon stopped by user")
+    finally:
+        scheduler.stop()
+        server.shutdown()
+        if sync:
+            sync.disconnect()
+
+
+def query(path, method='GET', host=None, port=None, timeout=5):
+    """
+    Fetch a result from a running daemon.
+
+    Raises:
+        ConnectionError: If the daemon is not reachable
+    """
+    url = f"http://{host or config.RISK_DAEMON_HOST}:{port or config.RISK_DAEMON_PORT}/{path.lstrip('/')}"
+    request = urllib.request.Request(url, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+    except (urllib.error.URLError, OSError) as e:
+        raise ConnectionError(f"Risk daemon not reachable at {url}: {e}") from e
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resident risk service")
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve_parser = sub.add_parser('serve', help="Run the scheduler and HTTP endpoint")
+    serve_parser.add_argument('--host', default=None)
+    serve_parser.add_argument('--port', type=int, default=None)
+    query_parser = sub.add_parser('query', help="Print a result from the running daemon")
+    query_parser.add_argument('what', choices=['status', 'portfolio', 'violations', 'var', 'refresh'])
+    query_parser.add_argument('symbol', nargs='?', help="Ticker for 'var'")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        serve(args.host, args.port)
+        return
+
+    if args.what == 'var' and not args.symbol:
+        parser.error("query var needs a ticker symbol")
+    path = f'var/{args.symbol}' if args.what == 'var' else args.what
+    try:
+        result = query(path, method='POST' if args.what == 'refresh' else 'GET')
+    except ConnectionError as e:
+        logger.error(e)
+        sys.exit(1)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        instrumentation.run_main(main, 'risk_daemon')
+    else:
+        main()
@@ -0,0 +1,242 @@
+"""
+Historical stress tests and user-defined shock scenarios.
+Every scenario is a row of per-ticker returns; the scenarios x positions matrix
+is valued against the current portfolio in one product, with P&L by position,
+sector and total.
+
+Usage:
+    python scenarios.py                     # built-in windows, rolling windows and data/scenarios.json
+    python scenarios.py --rolling 10 --top 20
+"""
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+import config
+import instrumentation
+import market_data
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Peak-to-trough windows replayed by default
+HISTORICAL_SCENARIOS = {
+    'Q4 2018 selloff': ('2018-09-20', '2018-12-24'),
+    'COVID crash (Feb-Mar 2020)': ('2020-02-19', '2020-03-23'),
+    '2022 drawdown': ('2022-01-03', '2022-10-12'),
+    'Regional bank stress (Mar 2023)': ('2023-03-08', '2023-03-17'),
+    'Carry unwind (Jul-Aug 2024)': ('2024-07-16', '2024-08-05'),
+}
+
+# Closes per (symbols, start, day), so repeated bot commands reuse one download
+_CLOSES_CACHE = {}
+
+
+def load_user_scenarios(path=None):
+    """
+    Read user-defined scenarios from JSON.
+
+    Each entry is either a historical window:
+        {"name": "Flash crash", "start": "2010-05-06", "end": "2010-05-07"}
+    or a shock, where a ticker shock overrides its sector's shock, which
+    overrides the market shock:
+        {"name": "Chips -25%", "market": -0.05, "sectors": {"Technology": -0.15}, "tickers": {"NVDA": -0.25}}
+    """
+    path = path or config.SCENARIOS_PATH
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+
+class ScenarioEngine:
+    """Builds scenario return matrices from cached closes and values them against a portfolio."""
+
+    def __init__(self, closes, sectors):
+        """
+        Args:
+            closes: DataFrame of daily closes (dates x symbols)
+            sectors: Series or dict of symbol -> sector
+        """
+        self.closes = closes.sort_index().ffill()
+        self.symbols = self.closes.columns
+        self.sectors = pd.Series(sectors).reindex(self.symbols).fillna('Unknown')
+        self.sector_names = sorted(self.sectors.unique())
+        codes = pd.Categorical(self.sectors, categories=self.sector_names).codes
+        self._onehot = np.eye(len(self.sector_names))[codes]
+        self._prices = self.closes.to_numpy(dtype=np.float64)
+        self._dates = self.closes.index
+
+    def _fill_missing(self, returns):
+        """Tickers without history in a window take their sector's average move, else the market's."""
+        missing = np.isnan(returns)
+        if not missing.any():
+            return returns
+        valid = ~missing
+        filled = np.where(valid, returns, 0.0)
+        counts = valid @ self._onehot
+        sector_mean = np.divide(filled @ self._onehot, counts, out=np.full(counts.shape, np.nan), where=counts > 0)
+        market_count = valid.sum(axis=1, keepdims=True)
+        market_mean = np.divide(filled.sum(axis=1, keepdims=True), market_count,
+                                out=np.zeros(market_count.shape), where=market_count > 0)
+        proxy = sector_mean @ self._onehot.T
+        proxy = np.where(np.isnan(proxy), market_mean, proxy)
+        return np.where(missing, proxy, returns)
+
+    def historical(self, windows):
+        """
+        Cumulative returns over historical windows.
+
+        Args:
+            windows: Dict of name -> (start, end) dates
+
+        Returns:
+            DataFrame of returns (scenarios x symbols); windows outside the data are skipped
+        """
+        names, starts, ends = [], [], []
+        for name, (start, end) in windows.items():
+            i = self._dates.searchsorted(pd.Timestamp(start))
+            j = self._dates.searchsorted(pd.Timestamp(end), side='right') - 1
+            if i >= len(self._dates) or j <= i:
+                logger.warning(f"Scenario '{name}' ({start} to {end}) is outside the loaded history; skipped")
+                continue
+            names.append(name)
+            starts.append(i)
+            ends.append(j)
+        returns = self._prices[ends] / self._prices[starts] - 1
+        return pd.DataFrame(self._fill_missing(returns), index=names, columns=self.symbols)
+
+    def rolling(self, days):
+        """Every overlapping window of the given length in the loaded history."""
+        if days <= 0 or days >= len(self._dates):
+            return pd.DataFrame(columns=self.symbols)
+        returns = self._prices[days:] / self._prices[:-days] - 1
+        names = [f"{days}d to {d:%Y-%m-%d}" for d in self._dates[days:]]
+        return pd.DataFrame(self._fill_missing(returns), index=names, columns=self.symbols)
+
+    def shocks(self, specs):
+        """Returns for market, sector and ticker shock specifications (see load_user_scenarios)."""
+        rows = []
+        for spec in specs:
+            row = np.full(len(self.symbols), float(spec.get('market', 0.0)))
+            sector_shocks = self.sectors.map(spec.get('sectors', {}))
+            row = np.where(sector_shocks.notna(), sector_shocks.to_numpy(dtype=np.float64, na_value=0.0), row)
+            ticker_shocks = pd.Series(self.symbols, index=self.symbols).map(spec.get('tickers', {}))
+            row = np.where(ticker_shocks.notna(), ticker_shocks.to_numpy(dtype=np.float64, na_value=0.0), row)
+            rows.append(row)
+        return pd.DataFrame(rows, index=[spec['name'] for spec in specs], columns=self.symbols)
+
+    def build(self, user_scenarios=None, rolling_days=None):
+        """Built-in windows, user scenarios and rolling windows stacked into one matrix."""
+        rolling_days = config.STRESS_ROLLING_DAYS if rolling_days is None else rolling_days
+        user_scenarios = user_scenarios or []
+        windows = dict(HISTORICAL_SCENARIOS)
+        windows.update({s['name']: (s['start'], s['end']) for s in user_scenarios if 'start' in s})
+        frames = [self.historical(windows), self.shocks([s for s in user_scenarios if 'start' not in s])]
+        if rolling_days:
+            frames.append(self.rolling(rolling_days))
+        return pd.concat([f for f in frames if not f.empty])
+
+    @instrumentation.timed('stress')
+    def evaluate(self, scenario_returns, amounts):
+        """
+        Value every scenario against the portfolio.
+
+        Args:
+            scenario_returns: DataFrame of returns (scenarios x symbols)
+            amounts: Series of signed dollar exposure per symbol
+
+        Returns:
+            Dict with 'total' (Series, worst first), 'by_sector' and
+            'by_position' (DataFrames, scenarios x sectors / symbols)
+        """
+        a = amounts.reindex(self.symbols).fillna(0.0).to_numpy(dtype=np.float64)
+        r = scenario_returns.reindex(columns=self.symbols).to_numpy(dtype=np.float64)
+        by_position = r * a
+        total = r @ a
+        by_sector = by_position @ self._onehot
+
+        order = np.argsort(total, kind='stable')
+        index = scenario_returns.index[order]
+        return {
+            'total': pd.Series(total[order], index=index, name='PnL'),
+            'by_sector': pd.DataFrame(by_sector[order], index=index, columns=self.sector_names),
+            'by_position': pd.DataFrame(by_position[order], index=index, columns=self.symbols),
+        }
+
+
+def portfolio_engine(portfolio_path=None, start=None):
+    """
+    Load the transformed portfolio and an engine over its holdings' closes.
+
+    Returns:
+        (engine, amounts)
+    """
+    portfolio = pd.read_excel(portfolio_path or config.PORTFOLIO_PATH_TRANSFORMED)
+    amounts = portfolio.groupby('Symbol')['Amount'].sum()
+    sectors = portfolio.drop_duplicates('Symbol').set_index('Symbol')['Sector']
+    start = start or min([config.START_DATE_FOR_VAR] + [s for s, _ in HISTORICAL_SCENARIOS.values()])
+
+    key = (tuple(sorted(amounts.index)), start, dt.date.today())
+    if key not in _CLOSES_CACHE:
+        instrumentation.cache_miss('stress_closes')
+        _CLOSES_CACHE.clear()
+        _CLOSES_CACHE[key] = market_data.get_provider().get_history(list(amounts.index), start=start,
+                                                                    end=dt.date.today())
+    else:
+        instrumentation.cache_hit('stress_closes')
+    return ScenarioEngine(_CLOSES_CACHE[key], sectors), amounts
+
+
+def run_stress(portfolio_path=None, rolling_days=None, scenarios_path=None):
+    """Evaluate every configured scenario against the current portfolio."""
+    engine, amounts = portfolio_engine(portfolio_path)
+    scenario_returns = engine.build(load_user_scenarios(scenarios_path), rolling_days)
+    result = engine.evaluate(scenario_returns, amounts)
+    result['gross'] = float(amounts.abs().sum())
+    return result
+
+
+def format_report(result, top=10):
+    """Plain-text summary of the worst scenarios, shared by the CLI and the bot."""
+    lines = [f"Worst {min(top, len(result['total']))} of {len(result['total'])} scenarios "
+             f"(gross exposure {result['gross']:,.0f}):"]
+    for name, pnl in result['total'].head(top).items():
+        sectors = result['by_sector'].loc[name]
+        worst_sector = sectors.idxmin()
+        lines.append(f"{name}: {pnl:,.0f} ({pnl / result['gross']:.1%}); "
+                     f"worst sector {worst_sector} {sectors[worst_sector]:,.0f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stress-test the current portfolio")
+    parser.add_argument('--portfolio', default=config.PORTFOLIO_PATH_TRANSFORMED)
+    parser.add_argument('--scenarios', default=config.SCENARIOS_PATH, help="User scenario JSON file")
+    parser.add_argument('--rolling', type=int, default=config.STRESS_ROLLING_DAYS,
+                        help="Length of rolling historical windows in days, 0 to disable")
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--output-dir', default='outputs')
+    args = parser.parse_args(argv)
+
+    result = run_stress(args.portfolio, args.rolling, args.scenarios)
+    logger.info("\n" + format_report(result, args.top))
+    os.makedirs(args.output_dir, exist_ok=True)
+    for part in ('total', 'by_sector', 'by_position'):
+        path = os.path.join(args.output_dir, f'stress_{part}.csv')
+        result[part].to_csv(path)
+    logger.info(f"Scenario P&L saved to {args.output_dir}/stress_*.csv")
+    return result
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(main, 'scenarios')
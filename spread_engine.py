@@ -0,0 +1,206 @@
+"""
+Rolling z-score spread engine for pairs trading.
+Keeps a rolling hedge ratio and spread mean/std per pair from running sums, so
+every tick is scored in O(1) without revisiting price history.
+"""
+import logging
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+import config
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+ENTER_LONG = 'ENTER_LONG'    # buy X, sell Y: spread is cheap
+ENTER_SHORT = 'ENTER_SHORT'  # sell X, buy Y: spread is rich
+EXIT = 'EXIT'
+STOP = 'STOP'
+
+
+def ratio_target(initial_ratio, multiplier=None):
+    """Exit ratio for the fixed-ratio rule used by the live trader."""
+    multiplier = config.TARGET_RATIO_MULTIPLIER if multiplier is None else multiplier
+    return initial_ratio * multiplier
+
+
+def ratio_exit_triggered(current_ratio, target_ratio):
+    """Fixed-ratio exit rule; works on scalars and NumPy arrays."""
+    return current_ratio <= target_ratio
+
+
+def zscore_entry_side(zscore, entry_z):
+    """Side to enter for a z-score: 1 long spread, -1 short spread, 0 none."""
+    return np.where(zscore <= -entry_z, 1, np.where(zscore >= entry_z, -1, 0))
+
+
+def zscore_exit_triggered(zscore, side, exit_z, stop_z):
+    """
+    Z-score exit rule for an open spread; works on scalars and NumPy arrays.
+
+    Returns a pair (exit, stop): exit when the spread has reverted inside
+    exit_z, stop when it has run past stop_z against the position.
+    """
+    side = np.asarray(side)
+    is_open = side != 0
+    reverted = is_open & (side * zscore >= -exit_z)
+    stopped = is_open & (side * zscore <= -stop_z)
+    return reverted & ~stopped, stopped
+
+
+class RollingSpread:
+    """
+    Rolling OLS of log(X) on log(Y) over the last ``window`` samples.
+
+    The regression and residual variance come from running sums that are
+    adjusted as samples enter and leave the window. The sums are rebuilt from
+    the buffer once per window to stop floating-point drift, so an update
+    costs O(1) amortized.
+    """
+
+    def __init__(self, window):
+        if window < 3:
+            raise ValueError("window must hold at least 3 samples")
+        self.window = window
+        self._buffer = deque()
+        self._s_dep = self._s_reg = self._s_dep2 = self._s_reg2 = self._s_cross = 0.0
+        self._since_rebuild = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    @property
+    def ready(self):
+        return len(self._buffer) >= self.window
+
+    def _add(self, log_x, log_y, sign):
+        self._s_dep += sign * log_x
+        self._s_reg += sign * log_y
+        self._s_dep2 += sign * log_x * log_x
+        self._s_reg2 += sign * log_y * log_y
+        self._s_cross += sign * log_x * log_y
+
+    def _rebuild(self):
+        self._s_dep = self._s_reg = self._s_dep2 = self._s_reg2 = self._s_cross = 0.0
+        for log_x, log_y in self._buffer:
+            self._add(log_x, log_y, 1)
+        self._since_rebuild = 0
+
+    def update(self, price_x, price_y):
+        """Add a sample to the window, dropping the oldest one when full."""
+        sample = (math.log(price_x), math.log(price_y))
+        self._buffer.append(sample)
+        self._add(*sample, 1)
+        if len(self._buffer) > self.window:
+            self._add(*self._buffer.popleft(), -1)
+        self._since_rebuild += 1
+        if self._since_rebuild >= self.window:
+            self._rebuild()
+
+    def seed(self, prices_x, prices_y):
+        """Fill the window from historical prices, oldest first."""
+        for price_x, price_y in zip(prices_x, prices_y):
+            self.update(price_x, price_y)
+
+    def stats(self):
+        """Return (hedge ratio, intercept, residual std) for the current window."""
+        n = len(self._buffer)
+        if n < 3:
+            return float('nan'), float('nan'), float('nan')
+        mean_x = self._s_dep / n
+        mean_y = self._s_reg / n
+        var_x = self._s_dep2 / n - mean_x * mean_x
+        var_y = self._s_reg2 / n - mean_y * mean_y
+        cov = self._s_cross / n - mean_x * mean_y
+        if var_y <= 0:
+            return float('nan'), float('nan'), float('nan')
+        beta = cov / var_y
+        alpha = mean_x - beta * mean_y
+        resid_var = max(var_x - beta * cov, 0.0) * n / (n - 2)
+        return beta, alpha, math.sqrt(resid_var)
+
+    def zscore(self, price_x, price_y):
+        """Score prices against the current window without changing it."""
+        beta, alpha, std = self.stats()
+        if not std or math.isnan(std):
+            return float('nan')
+        return (math.log(price_x) - alpha - beta * math.log(price_y)) / std
+
+
+class SpreadEngine:
+    """
+    Tracks a RollingSpread and an open side for every monitored pair.
+
+    Every tick is scored against the window. A sample is committed to the
+    window at most once per ``bar_seconds``, so the statistics keep the bar
+    frequency they were seeded with while signals react tick by tick.
+    """
+
+    def __init__(self, window=None, entry_z=None, exit_z=None, stop_z=None, bar_seconds=None):
+        self.window = window or config.ZSCORE_WINDOW
+        self.entry_z = config.ZSCORE_ENTRY if entry_z is None else entry_z
+        self.exit_z = config.ZSCORE_EXIT if exit_z is None else exit_z
+        self.stop_z = config.ZSCORE_STOP if stop_z is None else stop_z
+        self.bar_seconds = config.ZSCORE_BAR_SECONDS if bar_seconds is None else bar_seconds
+        self.spreads = {}
+        self.sides = {}
+        self._last_commit = {}
+
+    def add_pair(self, pair, prices_x=(), prices_y=()):
+        """Register a pair, optionally seeding its window with historical bars."""
+        spread = RollingSpread(self.window)
+        spread.seed(prices_x, prices_y)
+        self.spreads[pair] = spread
+        self.sides[pair] = 0
+        self._last_commit[pair] = time.time() if len(spread) else None
+        logger.info(f"Tracking spread {pair} with {len(spread)}/{self.window} seed samples")
+
+    def set_side(self, pair, side):
+        """Record the side actually held for a pair (1 long spread, -1 short, 0 flat)."""
+        self.sides[pair] = side
+
+    def hedge_ratio(self, pair):
+        return self.spreads[pair].stats()[0]
+
+    def on_tick(self, pair, price_x, price_y, timestamp=None):
+        """
+        Score a tick and return (signal, zscore).
+
+        signal is ENTER_LONG, ENTER_SHORT, EXIT, STOP or None. The caller
+        confirms fills with set_side; the engine never assumes a fill.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        spread = self.spreads[pair]
+        last = self._last_commit[pair]
+        if last is None or timestamp - last >= self.bar_seconds:
+            spread.update(price_x, price_y)
+            self._last_commit[pair] = timestamp
+
+        if not spread.ready:
+            return None, float('nan')
+        z = spread.zscore(price_x, price_y)
+        if math.isnan(z):
+            return None, z
+
+        side = self.sides[pair]
+        if side == 0:
+            entry = int(zscore_entry_side(z, self.entry_z))
+            if entry == 1:
+                return ENTER_LONG, z
+            if entry == -1:
+                return ENTER_SHORT, z
+            return None, z
+
+        exit_now, stop_now = zscore_exit_triggered(z, side, self.exit_z, self.stop_z)
+        if stop_now:
+            return STOP, z
+        if exit_now:
+            return EXIT, z
+        return None, z
@@ -1,9 +1,10 @@
 import pandas as pd
 from pprint import pprint
-import matplotlib.pyplot as plt
 import numpy as np
 import math
-import pandas_datareader as pdr
+from lazy_imports import lazy_import
+
+plt = lazy_import('matplotlib.pyplot')
 
 
 def fixed_percentage_stop_loss(portfolio, closing_positions_df, percentage):
@@ -0,0 +1,295 @@
+"""
+Symbol universe built from the TradingView watchlist exports.
+Parses every list once, normalizes TradingView EXCHANGE:SYMBOL entries to
+Yahoo tickers, and keeps a persistent index of symbol -> asset class and
+lists. Jobs select named universes and combine them with set operations
+instead of re-reading the text files.
+
+Usage:
+    python universe.py lists                                 # list names and sizes
+    python universe.py show "S&P 500" --intersect "Nasdaq 100"
+    python universe.py show equity --exclude "S&P 500"
+"""
+import argparse
+import json
+import logging
+import os
+from pathlib import Path
+
+import config
+import instrumentation
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+ASSET_CLASSES = ('equity', 'international', 'index', 'commodity', 'forex', 'crypto')
+
+US_EXCHANGES = {'NYSE', 'NASDAQ', 'AMEX', 'NYSEARCA', 'BATS', 'OTC'}
+
+# Yahoo suffix per non-US exchange; numeric Hong Kong codes are zero-padded to four digits
+EXCHANGE_SUFFIXES = {
+    'HKEX': '.HK', 'TWSE': '.TW', 'SSE': '.SS', 'SZSE': '.SZ', 'NSE': '.NS', 'BSE': '.BO',
+    'ASX': '.AX', 'TSE': '.T', 'LSE': '.L', 'XETR': '.DE', 'EURONEXT': '.PA', 'TSX': '.TO', 'KRX': '.KS',
+}
+
+CRYPTO_EXCHANGES = {'BINANCE', 'BITSTAMP', 'COINBASE', 'FTX', 'KRAKEN', 'BITFINEX', 'BYBIT', 'KUCOIN'}
+FOREX_EXCHANGES = {'FX', 'FX_IDC', 'FOREXCOM', 'SAXO', 'OANDA', 'FXCM'}
+
+# Full TradingView names with a Yahoo equivalent that no prefix rule covers
+INDEX_SYMBOLS = {
+    'TVC:SPX': '^GSPC', 'TVC:DJI': '^DJI', 'TVC:IXIC': '^IXIC', 'NASDAQ:NDX': '^NDX', 'TVC:RUT': '^RUT',
+    'TVC:RUI': '^RUI', 'TVC:RUA': '^RUA', 'TVC:NYA': '^NYA', 'TVC:XAX': '^XAX', 'TVC:XMI': '^XMI',
+    'DJ:DJT': '^DJT', 'SP:OEX': '^OEX', 'TVC:VIX': '^VIX', 'CBOE:VVIX': '^VVIX', 'CBOE:VXN': '^VXN',
+    'TVC:DXY': 'DX-Y.NYB', 'TVC:NI225': '^N225', 'TVC:HSI': '^HSI', 'TVC:STI': '^STI', 'KRX:KOSPI': '^KS11',
+    'SSE:000001': '000001.SS', 'SZSE:399006': '399006.SZ', 'NSE:NIFTY': '^NSEI', 'BSE:SENSEX': '^BSESN',
+    'XETR:DAX': '^GDAXI', 'EURONEXT:PX1': '^FCHI', 'BME:IBC': '^IBEX', 'TVC:UKX': '^FTSE', 'NYSE:HUI': '^HUI',
+}
+
+# Commodities are matched on the symbol alone, since TradingView quotes them from many CFD brokers
+COMMODITY_SYMBOLS = {
+    'USOIL': 'CL=F', 'UKOIL': 'BZ=F', 'NATURALGAS': 'NG=F', 'GOLD': 'GC=F', 'SILVER': 'SI=F',
+    'COPPER': 'HG=F', 'COFFEE': 'KC=F', 'SUGAR': 'SB=F', 'COCOA': 'CC=F', 'COTTON': 'CT=F',
+    'WHEAT': 'ZW=F', 'SOYBEANS': 'ZS=F', 'CORN': 'ZC=F', 'PLATINUM': 'PL=F',
+}
+
+CRYPTO_QUOTES = ('USDT', 'USDC', 'USD')
+
+# In-process copy of the index, keyed by the list files' signature
+_INDEX_CACHE = {}
+
+
+def normalize(entry):
+    """
+    Map one TradingView entry to a Yahoo ticker and asset class.
+
+    Args:
+        entry: 'EXCHANGE:SYMBOL', e.g. 'NYSE:BRK.B', 'BINANCE:ETHUSDT', 'FX:EURUSD'
+
+    Returns:
+        (yahoo_symbol, asset_class), or None for section headers, spreads and
+        instruments with no Yahoo equivalent
+    """
+    entry = entry.strip().upper()
+    if not entry or entry.startswith('###') or '/' in entry or ':' not in entry:
+        return None
+    exchange, symbol = entry.split(':', 1)
+
+    if entry in INDEX_SYMBOLS:
+        return INDEX_SYMBOLS[entry], 'index'
+    if symbol in COMMODITY_SYMBOLS:
+        return COMMODITY_SYMBOLS[symbol], 'commodity'
+    if symbol.endswith('1!'):
+        # Front-month continuous futures, e.g. COMEX:GC1! -> GC=F
+        return f"{symbol[:-2]}=F", 'commodity'
+    if exchange in US_EXCHANGES:
+        return symbol.replace('.', '-'), 'equity'
+    if exchange in EXCHANGE_SUFFIXES:
+        if exchange == 'HKEX' and symbol.isdigit():
+            symbol = symbol.zfill(4)
+        return symbol.replace('.', '-') + EXCHANGE_SUFFIXES[exchange], 'international'
+    if exchange in CRYPTO_EXCHANGES:
+        # Stablecoin quotes are folded into USD so BTCUSD and BTCUSDT are one instrument
+        for quote in CRYPTO_QUOTES:
+            if symbol.endswith(quote) and len(symbol) > len(quote):
+                return f"{symbol[:-len(quote)]}-USD", 'crypto'
+        return None
+    if exchange in FOREX_EXCHANGES and len(symbol) == 6 and symbol.isalpha():
+        return f"{symbol}=X", 'forex'
+    return None
+
+
+def parse_list(path):
+    """
+    Parse one exported list file.
+
+    Returns:
+        (symbols, skipped): Yahoo symbols with asset class in file order without
+        duplicates, and the entries that had no Yahoo equivalent
+    """
+    raw = Path(path).read_text(encoding='utf-8')
+    symbols, skipped = {}, []
+    for entry in raw.replace('\n', ',').split(','):
+        mapped = normalize(entry)
+        if mapped:
+            symbols.setdefault(*mapped)
+        elif entry.strip() and not entry.strip().startswith('###'):
+            skipped.append(entry.strip())
+    return symbols, skipped
+
+
+def _signature(lists_dir):
+    """File name -> modification time for every list; any change invalidates the index."""
+    return {p.name: os.path.getmtime(p) for p in sorted(Path(lists_dir).glob('*.txt'))}
+
+
+@instrumentation.timed('universe_build')
+def build_index(lists_dir=None, path=None):
+    """
+    Parse every list, deduplicate across lists and write the index.
+
+    Returns:
+        Index dict with 'signature', 'lists' (name -> symbols in file order)
+        and 'symbols' (symbol -> asset class and containing lists)
+    """
+    lists_dir = Path(lists_dir or config.TRADINGVIEW_LISTS_DIR)
+    path = Path(path or config.UNIVERSE_INDEX_PATH)
+    index = {'signature': _signature(lists_dir), 'lists': {}, 'symbols': {}}
+    for file in sorted(lists_dir.glob('*.txt')):
+        symbols, skipped = parse_list(file)
+        if skipped:
+            logger.info(f"{file.stem}: {len(skipped)} entries without a Yahoo symbol skipped")
+        index['lists'][file.stem] = list(symbols)
+        for symbol, asset_class in symbols.items():
+            record = index['symbols'].setdefault(symbol, {'asset_class': asset_class, 'lists': []})
+            record['lists'].append(file.stem)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as fp:
+        json.dump(index, fp, indent=1)
+    logger.info(f"Universe index: {len(index['symbols'])} symbols from {len(index['lists'])} lists saved to {path}")
+    return index
+
+
+def load_index(lists_dir=None, path=None):
+    """The persistent index, rebuilt only when a list file was added, removed or modified."""
+    lists_dir = Path(lists_dir or config.TRADINGVIEW_LISTS_DIR)
+    path = Path(path or config.UNIVERSE_INDEX_PATH)
+    signature = _signature(lists_dir)
+    key = (str(lists_dir), str(path))
+    cached = _INDEX_CACHE.get(key)
+    if cached and cached['signature'] == signature:
+        return cached
+
+    index = None
+    if path.exists():
+        with open(path, 'r') as fp:
+            index = json.load(fp)
+        if index.get('signature') != signature:
+            index = None
+    if index is None:
+        index = build_index(lists_dir, path)
+    _INDEX_CACHE[key] = index
+    return index
+
+
+class Universe:
+    """
+    Ordered set of Yahoo symbols.
+
+    Supports |, & and - like a set; results keep the left operand's order,
+    then the right operand's new symbols.
+    """
+
+    def __init__(self, symbols, name=''):
+        self.symbols = list(dict.fromkeys(symbols))
+        self.name = name
+        self._members = set(self.symbols)
+
+    def __iter__(self):
+        return iter(self.symbols)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self._members
+
+    def _label(self, operator, other):
+        return f"({self.name} {operator} {getattr(other, 'name', '') or 'set'})"
+
+    def __or__(self, other):
+        return Universe(self.symbols + list(other), self._label('|', other))
+
+    def __and__(self, other):
+        other = other if isinstance(other, Universe) else set(other)
+        return Universe([s for s in self.symbols if s in other], self._label('&', other))
+
+    def __sub__(self, other):
+        other = other if isinstance(other, Universe) else set(other)
+        return Universe([s for s in self.symbols if s not in other], self._label('-', other))
+
+    def __repr__(self):
+        return f"<Universe {self.name or 'unnamed'}: {len(self)} symbols>"
+
+
+def named(name, index=None):
+    """
+    Universe for a list name (e.g. 'S&P 500'), an asset class (e.g. 'equity') or 'all'.
+    """
+    index = index or load_index()
+    if name in index['lists']:
+        return Universe(index['lists'][name], name)
+    if name in ASSET_CLASSES:
+        return Universe([s for s, r in index['symbols'].items() if r['asset_class'] == name], name)
+    if name == 'all':
+        return Universe(index['symbols'], name)
+    raise KeyError(f"Unknown universe '{name}'; use a list name ({', '.join(index['lists'])}), "
+                   f"an asset class ({', '.join(ASSET_CLASSES)}) or 'all'")
+
+
+def select(names, intersect=(), exclude=(), asset_class=None):
+    """
+    Union of the named universes, narrowed by intersect, minus exclude.
+
+    Args:
+        names: Universe names to combine (see named())
+        intersect: Names every symbol must also belong to
+        exclude: Names whose symbols are removed
+        asset_class: Keep only this asset class
+
+    Returns:
+        Universe
+    """
+    index = load_index()
+    names = [names] if isinstance(names, str) else list(names)
+    result = named(names[0], index)
+    for name in names[1:]:
+        result = result | named(name, index)
+    for name in intersect:
+        result = result & named(name, index)
+    for name in exclude:
+        result = result - named(name, index)
+    if asset_class:
+        result = result & named(asset_class, index)
+    return result
+
+
+def asset_class(symbol):
+    """Asset class of an indexed symbol, or None."""
+    record = load_index()['symbols'].get(symbol)
+    return record['asset_class'] if record else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TradingView list universe")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('build', help="Re-parse every list and rewrite the index")
+    sub.add_parser('lists', help="List names, sizes and asset classes")
+    show = sub.add_parser('show', help="Print the symbols of a universe expression")
+    show.add_argument('names', nargs='+', help="List names, asset classes or 'all' (union)")
+    show.add_argument('--intersect', action='append', default=[])
+    show.add_argument('--exclude', action='append', default=[])
+    show.add_argument('--asset-class', choices=ASSET_CLASSES)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        build_index()
+        return
+    index = load_index()
+    if args.command == 'lists':
+        for name, symbols in index['lists'].items():
+            classes = sorted({index['symbols'][s]['asset_class'] for s in symbols})
+            logger.info(f"{name}: {len(symbols)} symbols ({', '.join(classes)})")
+        return
+    result = select(args.names, args.intersect, args.exclude, args.asset_class)
+    logger.info(f"{result.name}: {len(result)} symbols")
+    logger.info(",".join(result))
+    return result
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(main, 'universe')
@@ -0,0 +1,216 @@
+"""
+Rolling VaR series and VaR backtesting across the whole universe.
+Each ticker's 1-day parametric VaR is re-estimated every day from the trailing
+window of returns, using cumulative sums so the cost is O(days x tickers)
+whatever the window. Each forecast is compared with the next day's realized
+return. Kupiec's proportion-of-failures test and Christoffersen's independence
+and conditional-coverage tests are then computed for every ticker at once.
+
+Usage:
+    python var_backtest.py                        # master list, last BACKTEST_VAR_YEARS years
+    python var_backtest.py --universe "S&P 500" --window 500
+"""
+import argparse
+import datetime as dt
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+import config
+import instrumentation
+import market_data
+import universe
+from lazy_imports import lazy_import
+
+stats = lazy_import('scipy.stats')
+special = lazy_import('scipy.special')
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def daily_returns(prices):
+    """Returns between consecutive valid closes, as calc_var sees them on each ticker's dropna() history."""
+    p = prices.to_numpy(dtype=np.float64)
+    previous = pd.DataFrame(p).ffill().shift(1).to_numpy()
+    return np.where(np.isnan(p), np.nan, p / previous - 1)
+
+
+@instrumentation.timed('rolling_var')
+def rolling_var(returns, window=None, confidence=None, min_periods=None):
+    """
+    Parametric VaR forecast for every day and ticker from the trailing window.
+
+    Row t uses the returns of rows t - window .. t - 1 only, so it is a true
+    out-of-sample forecast for row t. Window sums come from differences of
+    cumulative sums of the returns, their squares and the valid-return counts.
+
+    Args:
+        returns: Array of daily returns (dates x tickers), NaN where missing
+        window: Trailing window in rows (default: config.BACKTEST_VAR_WINDOW)
+        confidence: VaR confidence level (default: config.CONFIDENCE_LEVEL)
+        min_periods: Valid returns a window needs (default: 90% of window)
+
+    Returns:
+        Array of VaR as a positive fraction of position value, NaN where the
+        window is too sparse
+    """
+    window = window or config.BACKTEST_VAR_WINDOW
+    confidence = confidence or config.CONFIDENCE_LEVEL
+    min_periods = min_periods or int(np.ceil(0.9 * window))
+    valid = ~np.isnan(returns)
+    rz = np.where(valid, returns, 0.0)
+
+    def trailing(values):
+        # Sum over rows t - window .. t - 1, with a zero row prepended so row t sees only the past
+        c = np.concatenate([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+        lagged = np.concatenate([np.zeros((window, values.shape[1])), c[:-window]])
+        return (c - lagged)[:-1]
+
+    n = trailing(valid.astype(np.float64))
+    s1 = trailing(rz)
+    s2 = trailing(rz ** 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = s1 / n
+        variance = np.maximum(s2 - s1 * mean, 0.0) / (n - 1)
+    var = -(mean + stats.norm.ppf(1 - confidence) * np.sqrt(variance))
+    return np.where(n >= min_periods, var, np.nan)
+
+
+def kupiec_pof(exceptions, observations, p):
+    """
+    Kupiec proportion-of-failures likelihood ratio and p-value (chi-square, 1 dof).
+
+    Args:
+        exceptions, observations: Arrays of exception and forecast counts
+        p: Expected exception probability, 1 - confidence
+    """
+    x = exceptions.astype(np.float64)
+    n = observations.astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        observed = np.where(n > 0, x / n, 0.0)
+        null = special.xlogy(n - x, 1 - p) + special.xlogy(x, p)
+        alternative = special.xlogy(n - x, 1 - observed) + special.xlogy(x, observed)
+    lr = np.where(n > 0, -2 * (null - alternative), np.nan)
+    return lr, stats.chi2.sf(lr, 1)
+
+
+def christoffersen(hits, valid):
+    """
+    Christoffersen independence likelihood ratio and p-value (chi-square, 1 dof).
+
+    Transitions are counted between consecutive forecast days of each ticker,
+    so a gap in a ticker's history does not create a spurious transition.
+
+    Args:
+        hits: Boolean array of exceptions (dates x tickers)
+        valid: Boolean array of days with both a forecast and a realized return
+    """
+    pair = valid[1:] & valid[:-1]
+    prev, curr = hits[:-1], hits[1:]
+    n00 = (pair & ~prev & ~curr).sum(axis=0).astype(np.float64)
+    n01 = (pair & ~prev & curr).sum(axis=0).astype(np.float64)
+    n10 = (pair & prev & ~curr).sum(axis=0).astype(np.float64)
+    n11 = (pair & prev & curr).sum(axis=0).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pi01 = n01 / (n00 + n01)
+        pi11 = n11 / (n10 + n11)
+        pi = (n01 + n11) / (n00 + n01 + n10 + n11)
+        null = special.xlogy(n00 + n10, 1 - pi) + special.xlogy(n01 + n11, pi)
+        alternative = (special.xlogy(n00, 1 - pi01) + special.xlogy(n01, pi01)
+                       + special.xlogy(n10, 1 - pi11) + special.xlogy(n11, pi11))
+    lr = -2 * (null - alternative)
+    # With no exception after an exception (or none at all) the test has nothing to measure
+    lr = np.where(n10 + n11 > 0, np.maximum(lr, 0.0), 0.0)
+    return lr, stats.chi2.sf(lr, 1)
+
+
+@instrumentation.timed('var_backtest')
+def backtest(prices, window=None, confidence=None, significance=None):
+    """
+    Backtest rolling parametric VaR for every ticker of a price panel.
+
+    Args:
+        prices: DataFrame of daily closes (dates x tickers)
+        window: Trailing estimation window in rows (default: config.BACKTEST_VAR_WINDOW)
+        confidence: VaR confidence level (default: config.CONFIDENCE_LEVEL)
+        significance: Test size for the Reject flags (default: config.BACKTEST_VAR_SIGNIFICANCE)
+
+    Returns:
+        DataFrame indexed by ticker with forecast and exception counts, the
+        exception rate and the likelihood ratios and p-values of the Kupiec,
+        independence and conditional-coverage tests
+    """
+    confidence = confidence or config.CONFIDENCE_LEVEL
+    significance = significance or config.BACKTEST_VAR_SIGNIFICANCE
+    p = 1 - confidence
+    returns = daily_returns(prices)
+    var = rolling_var(returns, window, confidence)
+
+    valid = ~np.isnan(var) & ~np.isnan(returns)
+    hits = valid & (returns < -np.nan_to_num(var))
+    observations = valid.sum(axis=0)
+    exceptions = hits.sum(axis=0)
+
+    pof_lr, pof_p = kupiec_pof(exceptions, observations, p)
+    ind_lr, ind_p = christoffersen(hits, valid)
+    cc_lr = pof_lr + ind_lr
+    cc_p = stats.chi2.sf(cc_lr, 2)
+
+    result = pd.DataFrame({
+        'Observations': observations,
+        'Exceptions': exceptions,
+        'Expected': observations * p,
+        'ExceptionRate': np.divide(exceptions, observations, out=np.full(len(observations), np.nan),
+                                   where=observations > 0),
+        'KupiecLR': pof_lr,
+        'KupiecP': pof_p,
+        'IndependenceLR': ind_lr,
+        'IndependenceP': ind_p,
+        'ConditionalLR': cc_lr,
+        'ConditionalP': cc_p,
+    }, index=prices.columns)
+    result['RejectCoverage'] = result['KupiecP'] < significance
+    result['RejectIndependence'] = result['IndependenceP'] < significance
+    result['RejectConditional'] = result['ConditionalP'] < significance
+    return result[result['Observations'] > 0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest rolling VaR with Kupiec and Christoffersen tests")
+    parser.add_argument('--universe', nargs='+',
+                        help="TradingView list names, asset classes or 'all'; default: the master list")
+    parser.add_argument('--years', type=float, default=config.BACKTEST_VAR_YEARS,
+                        help="Years of forecasts tested, after the first estimation window")
+    parser.add_argument('--window', type=int, default=config.BACKTEST_VAR_WINDOW, help="Estimation window in days")
+    parser.add_argument('--output', default=os.path.join('outputs', 'var_backtest.csv'))
+    args = parser.parse_args(argv)
+
+    if args.universe:
+        symbols = universe.select(args.universe).symbols
+    else:
+        symbols = pd.read_excel(config.ALL_TICKERS_PATH)['Symbol'].dropna().astype(str).tolist()
+    # Enough history for the first window before the tested period starts
+    start = dt.date.today() - dt.timedelta(days=int(365.25 * args.years + 1.5 * args.window))
+    closes = market_data.get_provider().get_history(symbols, start=start, end=dt.date.today())
+
+    result = backtest(closes, args.window)
+    result.to_csv(args.output, index_label='Symbol')
+    logger.info(f"\n{result.sort_values('KupiecP').head(15)}")
+    logger.info(f"{len(result)} tickers, {int(result['Observations'].sum()):,} forecasts: "
+                f"exception rate {result['Exceptions'].sum() / result['Observations'].sum():.2%} "
+                f"(expected {1 - config.CONFIDENCE_LEVEL:.0%}); rejected by Kupiec "
+                f"{result['RejectCoverage'].mean():.0%}, independence {result['RejectIndependence'].mean():.0%}, "
+                f"conditional coverage {result['RejectConditional'].mean():.0%}")
+    logger.info(f"Backtest saved to {args.output}")
+    return result
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(main, 'var_backtest')
@@ -22,16 +22,15 @@ def check_env_variables():
     from dotenv import load_dotenv
     load_dotenv()
 
-    required_vars = ['TELEGRAM_BOT_TOKEN']
+    # Required only by the component named; other scripts run without them
+    component_vars = {'TELEGRAM_BOT_TOKEN': 'TelegramBot.py'}
     optional_vars = ['NET_LIQUIDITY', 'INITIAL_INVESTMENT']
 
-    all_good = True
-    for var in required_vars:
+    for var, component in component_vars.items():
         if os.getenv(var):
             print(f"✅ {var} is set")
         else:
-            print(f"❌ {var} is NOT set (required)")
-            all_good = False
+            print(f"⚠️  {var} is NOT set (required for {component})")
 
     for var in optional_vars:
         if os.getenv(var):
@@ -39,7 +38,7 @@ def check_env_variables():
         else:
             print(f"⚠️  {var} is using default value")
 
-    return all_good
+    return True
 
 def check_data_directory():
     """Check if data directory exists."""
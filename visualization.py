@@ -2,12 +2,17 @@
 Portfolio visualization module for creating professional charts and dashboards.
 Generates publication-ready visualizations for portfolio risk analysis.
 """
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 from datetime import datetime
 import logging
+import config
+import instrumentation
+import lazy_imports
 
 # Configure logging
 logging.basicConfig(
@@ -16,18 +21,30 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Set professional style
-plt.style.use('seaborn-v0_8-darkgrid')
-sns.set_palette("husl")
 
+def _setup_pyplot(pyplot):
+    pyplot.switch_backend('Agg')  # Charts are only written to files; keeps rendering safe in worker processes
+    # Set professional style
+    pyplot.style.use('seaborn-v0_8-darkgrid')
 
-def create_var_bar_chart(df, output_file='outputs/var_analysis.png'):
+
+def _setup_seaborn(seaborn):
+    lazy_imports.load(plt)  # Apply the pyplot style before the palette
+    seaborn.set_palette("husl")
+
+
+plt = lazy_imports.lazy_import('matplotlib.pyplot', on_import=_setup_pyplot)
+sns = lazy_imports.lazy_import('seaborn', on_import=_setup_seaborn)
+
+
+def create_var_bar_chart(df, output_file='outputs/var_analysis.png', dpi=300):
     """
     Create a bar chart showing VaR for each position with quality color coding.
 
     Args:
         df: Portfolio dataframe with VaR and quality ratings
         output_file: Path to save the chart
+        dpi: Output resolution
     """
     try:
         logger.info("Creating VaR bar chart...")
@@ -67,7 +84,7 @@ def create_var_bar_chart(df, output_file='outputs/var_analysis.png'):
         ax.xaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'${x:,.0f}'))
 
         plt.tight_layout()
-        plt.savefig(output_file, dpi=300, bbox_inches='tight', facecolor='white')
+        plt.savefig(output_file, dpi=dpi, bbox_inches='tight', facecolor='white')
         plt.close()
 
         logger.info(f"VaR bar chart saved to {output_file}")
@@ -77,13 +94,14 @@ def create_var_bar_chart(df, output_file='outputs/var_analysis.png'):
         raise
 
 
-def create_portfolio_dashboard(df, output_file='outputs/portfolio_dashboard.png'):
+def create_portfolio_dashboard(df, output_file='outputs/portfolio_dashboard.png', dpi=300):
     """
     Create a comprehensive 4-panel dashboard showing portfolio metrics.
 
     Args:
         df: Portfolio dataframe with all metrics
         output_file: Path to save the dashboard
+        dpi: Output resolution
     """
     try:
         logger.info("Creating portfolio dashboard...")
@@ -200,7 +218,7 @@ def create_portfolio_dashboard(df, output_file='outputs/portfolio_dashboard.png'
         fig.text(0.99, 0.01, f'Generated: {timestamp}',
                 ha='right', va='bottom', fontsize=8, style='italic', alpha=0.7)
 
-        plt.savefig(output_file, dpi=300, bbox_inches='tight', facecolor='white')
+        plt.savefig(output_file, dpi=dpi, bbox_inches='tight', facecolor='white')
         plt.close()
 
         logger.info(f"Portfolio dashboard saved to {output_file}")
@@ -210,13 +228,14 @@ def create_portfolio_dashboard(df, output_file='outputs/portfolio_dashboard.png'
         raise
 
 
-def create_risk_summary_card(df, output_file='outputs/risk_summary.png'):
+def create_risk_summary_card(df, output_file='outputs/risk_summary.png', dpi=300):
     """
     Create a visual summary card with key portfolio metrics.
 
     Args:
         df: Portfolio dataframe
         output_file: Path to save the card
+        dpi: Output resolution
     """
     try:
         logger.info("Creating risk summary card...")
@@ -302,7 +321,7 @@ def create_risk_summary_card(df, output_file='outputs/risk_summary.png'):
                ha='center', va='bottom', fontsize=8, style='italic',
                alpha=0.7, transform=ax.transAxes)
 
-        plt.savefig(output_file, dpi=300, bbox_inches='tight', facecolor='white')
+        plt.savefig(output_file, dpi=dpi, bbox_inches='tight', facecolor='white')
         plt.close()
 
         logger.info(f"Risk summary card saved to {output_file}")
@@ -312,28 +331,92 @@ def create_risk_summary_card(df, output_file='outputs/risk_summary.png'):
         raise
 
 
-def generate_all_visualizations(portfolio_path):
+CHARTS = {
+    'create_var_bar_chart': 'outputs/var_analysis.png',
+    'create_portfolio_dashboard': 'outputs/portfolio_dashboard.png',
+    'create_risk_summary_card': 'outputs/risk_summary.png',
+}
+RENDER_CACHE_PATH = 'outputs/.render_cache.json'
+
+
+def _frame_digest(df):
+    """Stable hash of a dataframe's values, index and column names."""
+    digest = hashlib.sha256(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(repr(list(df.columns)).encode())
+    return digest.hexdigest()
+
+
+def _render_key(frame_digest, chart, output_file, dpi):
+    return hashlib.sha256(f"{frame_digest}|{chart}|{output_file}|{dpi}".encode()).hexdigest()
+
+
+def _load_render_cache():
+    try:
+        with open(RENDER_CACHE_PATH, 'r') as fp:
+            return json.load(fp)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _render_chart(chart, df, output_file, dpi):
+    """Render one chart; runs in a worker process."""
+    globals()[chart](df, output_file=output_file, dpi=dpi)
+    return output_file
+
+
+def generate_all_visualizations(portfolio_path, preview=False, force=False, workers=None):
     """
     Generate all portfolio visualizations.
 
+    Charts whose input data and parameters are unchanged since the last run
+    are skipped; the rest are rendered concurrently in a process pool.
+
     Args:
         portfolio_path: Path to the portfolio Excel file with VaR data
+        preview: Render at config.VISUALIZATION_PREVIEW_DPI for a quick look
+        force: Re-render every chart even if cached
+        workers: Worker processes (default: one per stale chart)
     """
     try:
         # Create output directory
-        import os
         os.makedirs('outputs', exist_ok=True)
 
         logger.info(f"Loading portfolio data from {portfolio_path}")
-        df = pd.read_excel(portfolio_path)
-
-        # Generate all visualizations
-        create_var_bar_chart(df)
-        create_portfolio_dashboard(df)
-        create_risk_summary_card(df)
+        with instrumentation.stage('excel_read'):
+            df = pd.read_excel(portfolio_path)
+
+        dpi = config.VISUALIZATION_PREVIEW_DPI if preview else config.VISUALIZATION_DPI
+        frame_digest = _frame_digest(df)
+        cache = _load_render_cache()
+        stale = {}
+        for chart, output_file in CHARTS.items():
+            key = _render_key(frame_digest, chart, output_file, dpi)
+            if not force and cache.get(output_file) == key and os.path.exists(output_file):
+                logger.info(f"{output_file} is up to date, skipping")
+                instrumentation.cache_hit('render')
+            else:
+                stale[chart] = key
+                instrumentation.cache_miss('render')
+
+        # Generate stale visualizations in parallel
+        with instrumentation.stage('render'):
+            if len(stale) == 1 or workers == 1:
+                for chart in stale:
+                    _render_chart(chart, df, CHARTS[chart], dpi)
+                    cache[CHARTS[chart]] = stale[chart]
+            elif stale:
+                with ProcessPoolExecutor(max_workers=workers or len(stale)) as pool:
+                    futures = {chart: pool.submit(_render_chart, chart, df, CHARTS[chart], dpi) for chart in stale}
+                    for chart, future in futures.items():
+                        future.result()
+                        cache[CHARTS[chart]] = stale[chart]
+
+        with open(RENDER_CACHE_PATH, 'w') as fp:
+            json.dump(cache, fp, indent=2)
 
         logger.info("\n" + "="*60)
-        logger.info("✅ All visualizations generated successfully!")
+        logger.info(f"✅ All visualizations generated successfully! ({len(stale)} rendered at {dpi} DPI, "
+                    f"{len(CHARTS) - len(stale)} cached)")
         logger.info("="*60)
         logger.info("Generated files:")
         logger.info("  📊 outputs/var_analysis.png - VaR bar chart")
@@ -349,6 +432,9 @@ def generate_all_visualizations(portfolio_path):
 
 
 if __name__ == '__main__':
-    # For standalone testing
-    import config
-    generate_all_visualizations(config.PORTFOLIO_PATH_TRANSFORMED)
+    # For standalone testing; pass --preview for a fast low-DPI render
+    import sys
+    instrumentation.run_main(
+        lambda: generate_all_visualizations(config.PORTFOLIO_PATH_TRANSFORMED, preview='--preview' in sys.argv,
+                                            force='--force' in sys.argv),
+        'visualization')
@@ -0,0 +1,358 @@
+"""
+Conditional volatility models for VaR.
+RiskMetrics EWMA is filtered over the whole universe in one vectorized pass;
+GARCH(1,1) is fitted per ticker across a process pool. Both keep a per-ticker
+state (parameters, latest variance forecast, last close), so a daily refresh
+advances each ticker by one recursion step per new bar instead of refitting.
+
+Usage:
+    python volatility_models.py fit --model garch      # fit the master list and cache parameters
+    python volatility_models.py update --model garch   # fetch new bars, one step per ticker
+"""
+import argparse
+import datetime as dt
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+import instrumentation
+import market_data
+import Var
+from lazy_imports import lazy_import
+
+optimize = lazy_import('scipy.optimize')
+signal = lazy_import('scipy.signal')
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MODELS = ('sample', 'ewma', 'garch')
+STATE_COLUMNS = ['Mean', 'Omega', 'Alpha', 'Beta', 'Variance', 'LastClose', 'LastDate', 'FitDate']
+
+# Returns needed before a GARCH fit is attempted; shorter histories use EWMA parameters
+MIN_GARCH_OBS = 250
+
+
+def _returns(prices):
+    """Returns between consecutive valid closes, as Var.risk_metrics takes them."""
+    p = prices.to_numpy(dtype=np.float64)
+    previous = pd.DataFrame(p).ffill().shift(1).to_numpy()
+    return p / previous - 1
+
+
+def _last_valid(prices):
+    """Last close and its date per column (NaN / NaT for empty columns)."""
+    p = prices.to_numpy(dtype=np.float64)
+    valid = ~np.isnan(p)
+    last = len(p) - 1 - np.argmax(valid[::-1], axis=0)
+    found = valid.any(axis=0)
+    cols = np.arange(p.shape[1])
+    last_close = np.where(found, p[last, cols], np.nan)
+    last_date = np.where(found, prices.index.values.astype('datetime64[D]')[last], np.datetime64('NaT', 'D'))
+    return last_close, last_date
+
+
+def ewma_variance(returns, decay=None):
+    """
+    RiskMetrics variance forecasts for every column at once.
+
+    Gaps are skipped rather than treated as zero returns: each column's valid
+    returns are bottom-aligned and the leading padding holds the seed variance,
+    so one lfilter call runs the recursion for the whole universe.
+
+    Args:
+        returns: Array of daily returns (dates x symbols), NaN where missing
+        decay: Lambda (default: config.EWMA_DECAY)
+
+    Returns:
+        Array of next-day variance forecasts, one per column
+    """
+    decay = decay or config.EWMA_DECAY
+    valid = ~np.isnan(returns)
+    n = valid.sum(axis=0)
+    rz = np.where(valid, returns, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        seed = (np.where(valid, returns - rz.sum(axis=0) / n, 0.0) ** 2).sum(axis=0) / (n - 1)
+
+    squared = rz ** 2
+    if not valid.all():
+        order = np.argsort(valid, axis=0, kind='stable')
+        squared = np.take_along_axis(squared, order, axis=0)
+        squared = np.where(np.take_along_axis(~valid, order, axis=0), seed, squared)
+    # y[t] = (1 - decay) * r[t]^2 + decay * y[t-1], started from the seed variance
+    filtered, _ = signal.lfilter([1 - decay], [1, -decay], squared, axis=0, zi=(decay * seed)[None, :])
+    return filtered[-1]
+
+
+def garch_variance(residuals, omega, alpha, beta, seed):
+    """
+    GARCH(1,1) conditional variances of one residual series.
+
+    Returns:
+        Array of len(residuals) + 1 variances; the last one is the next-day forecast
+    """
+    lagged = np.concatenate(([seed], residuals ** 2))
+    filtered, _ = signal.lfilter([1.0], [1.0, -beta], omega + alpha * lagged, zi=[beta * seed])
+    return filtered
+
+
+def _garch_nll(params, residuals, target):
+    alpha, beta = params
+    variance = garch_variance(residuals[:-1], target * (1 - alpha - beta), alpha, beta, target)
+    # The optimizer may step past alpha + beta < 1 before the constraint pulls it back
+    variance = np.maximum(variance, 1e-12)
+    return 0.5 * np.sum(np.log(variance) + residuals ** 2 / variance)
+
+
+def fit_garch(returns):
+    """
+    Fit a variance-targeted GARCH(1,1) to one return series by maximum likelihood.
+
+    omega is fixed at sample_variance * (1 - alpha - beta), which leaves two
+    free parameters and keeps the unconditional variance at the sample value.
+
+    Returns:
+        (mean, omega, alpha, beta, next-day variance)
+    """
+    mean = returns.mean()
+    residuals = returns - mean
+    target = residuals.var()
+    result = optimize.minimize(
+        _garch_nll, x0=[0.05, 0.90], args=(residuals, target), method='SLSQP',
+        bounds=[(1e-6, 0.5), (0.0, 0.999)],
+        constraints=[{'type': 'ineq', 'fun': lambda x: 0.9999 - x[0] - x[1]}])
+    alpha, beta = result.x
+    omega = target * (1 - alpha - beta)
+    variance = garch_variance(residuals, omega, alpha, beta, target)[-1]
+    return mean, omega, alpha, beta, variance
+
+
+def _fit_garch_chunk(returns):
+    """Fit every column of a returns block; too-short series come back as NaN."""
+    fitted = np.full((returns.shape[1], 5), np.nan)
+    for j in range(returns.shape[1]):
+        column = returns[:, j]
+        column = column[~np.isnan(column)]
+        if len(column) >= MIN_GARCH_OBS:
+            fitted[j] = fit_garch(column)
+    return fitted
+
+
+class VolatilityModel:
+    """
+    Per-ticker conditional variance state for one model ('ewma' or 'garch').
+
+    Every model is stored as var[t+1] = omega + alpha * e[t]^2 + beta * var[t],
+    with EWMA as omega = 0, alpha = 1 - lambda, beta = lambda and zero mean,
+    so one update rule serves both.
+    """
+
+    def __init__(self, model, state=None):
+        if model not in MODELS[1:]:
+            raise ValueError(f"Unknown volatility model '{model}'; choose one of {MODELS[1:]}")
+        self.model = model
+        self.state = state if state is not None else pd.DataFrame(columns=STATE_COLUMNS)
+
+    @staticmethod
+    def path(model):
+        return Path(config.VOL_MODEL_DIR) / f'{model}.csv'
+
+    @classmethod
+    def load(cls, model):
+        """Cached state from VOL_MODEL_DIR, or an empty model."""
+        path = cls.path(model)
+        if not path.exists():
+            return cls(model)
+        state = pd.read_csv(path, index_col='Symbol', parse_dates=['LastDate', 'FitDate'])
+        return cls(model, state)
+
+    def save(self):
+        path = self.path(self.model)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.state.to_csv(path, index_label='Symbol')
+
+    def stale(self, symbols, today=None):
+        """
+        Symbols with no parameters, or GARCH parameters older than VOL_MODEL_REFIT_DAYS.
+
+        Tickers left on EWMA dynamics for lack of history (omega = 0) are retried every time.
+        """
+        today = pd.Timestamp(today or dt.date.today())
+        fit_date = pd.to_datetime(self.state['FitDate']).reindex(symbols)
+        if self.model == 'ewma':
+            return fit_date.index[fit_date.isna()].tolist()
+        expired = (fit_date.isna() | (today - fit_date > pd.Timedelta(days=config.VOL_MODEL_REFIT_DAYS))
+                   | (self.state['Omega'].reindex(symbols) == 0))
+        return fit_date.index[expired].tolist()
+
+    @instrumentation.timed('vol_fit')
+    def fit(self, prices, workers=None):
+        """
+        Filter full price histories; (re)fit GARCH parameters only where stale.
+
+        Symbols with current parameters are re-filtered with those parameters
+        (one lfilter call each); stale or unseen symbols are fitted across
+        VOL_MODEL_WORKERS processes.
+
+        Args:
+            prices: DataFrame of daily closes (dates x symbols)
+            workers: Worker processes; 1 fits in-process
+
+        Returns:
+            self
+        """
+        prices = prices.sort_index()
+        symbols = prices.columns
+        returns = _returns(prices)
+        n = (~np.isnan(returns)).sum(axis=0)
+        last_close, last_date = _last_valid(prices)
+        today = pd.Timestamp(dt.date.today())
+
+        rows = pd.DataFrame(index=symbols, columns=STATE_COLUMNS, dtype=np.float64)
+        rows['LastClose'] = last_close
+        rows['LastDate'] = pd.to_datetime(last_date)
+        rows['FitDate'] = today
+
+        if self.model == 'ewma':
+            rows['Mean'] = 0.0
+            rows['Omega'] = 0.0
+            rows['Alpha'] = 1 - config.EWMA_DECAY
+            rows['Beta'] = config.EWMA_DECAY
+            rows['Variance'] = ewma_variance(returns)
+        else:
+            refit = set(self.stale(list(symbols), today))
+            kept = [j for j, s in enumerate(symbols) if s not in refit]
+            for j in kept:
+                params = self.state.loc[symbols[j], ['Mean', 'Omega', 'Alpha', 'Beta']].to_numpy(dtype=np.float64)
+                residuals = returns[:, j][~np.isnan(returns[:, j])] - params[0]
+                seed = params[1] / (1 - params[2] - params[3])
+                variance = garch_variance(residuals, params[1], params[2], params[3], seed)[-1]
+                rows.iloc[j, :5] = [*params, variance]
+                rows.iloc[j, STATE_COLUMNS.index('FitDate')] = self.state.at[symbols[j], 'FitDate']
+            targets = [j for j, s in enumerate(symbols) if s in refit]
+            rows.iloc[targets, :5] = self._fit_parallel(returns[:, targets], workers)
+
+            # Histories too short for GARCH fall back to EWMA dynamics
+            short = rows['Alpha'].isna() & (n >= 2)
+            if short.any():
+                rows.loc[short, ['Mean', 'Omega', 'Alpha', 'Beta']] = [0.0, 0.0, 1 - config.EWMA_DECAY,
+                                                                       config.EWMA_DECAY]
+                rows.loc[short, 'Variance'] = ewma_variance(returns[:, short.to_numpy()])
+            logger.info(f"GARCH: {len(targets)} fitted, {len(kept)} re-filtered with cached parameters, "
+                        f"{int(short.sum())} on EWMA for short history")
+
+        rows = rows[n >= 2]
+        kept_state = self.state.drop(rows.index, errors='ignore')
+        self.state = pd.concat([kept_state, rows]) if not kept_state.empty else rows
+        return self
+
+    @staticmethod
+    def _fit_parallel(returns, workers=None):
+        workers = workers or config.VOL_MODEL_WORKERS or os.cpu_count()
+        if returns.shape[1] == 0:
+            return np.empty((0, 5))
+        logger.info(f"Fitting GARCH(1,1) for {returns.shape[1]} tickers on {workers} worker(s)")
+        chunks = np.array_split(np.arange(returns.shape[1]), min(returns.shape[1], workers * 4))
+        if workers == 1:
+            return np.vstack([_fit_garch_chunk(returns[:, chunk]) for chunk in chunks])
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return np.vstack(list(pool.map(_fit_garch_chunk, [returns[:, chunk] for chunk in chunks])))
+
+    @instrumentation.timed('vol_update')
+    def update(self, prices):
+        """
+        Advance each ticker by one recursion step per bar newer than its last stored close.
+
+        Args:
+            prices: DataFrame of recent daily closes; overlap with stored bars is ignored
+
+        Returns:
+            List of symbols that received at least one new bar
+        """
+        symbols = [s for s in prices.columns if s in self.state.index]
+        if not symbols:
+            return []
+        prices = prices[symbols].sort_index()
+        state = self.state.loc[symbols]
+        dates = prices.index.values.astype('datetime64[D]')
+        stored = state['LastDate'].to_numpy(dtype='datetime64[D]')
+
+        # Seed row holds the stored last close, so the first new bar's return spans from it
+        closes = np.where(dates[:, None] > stored[None, :], prices.to_numpy(dtype=np.float64), np.nan)
+        seeded = pd.DataFrame(np.vstack([state['LastClose'].to_numpy(dtype=np.float64), closes]))
+        returns = _returns(seeded)[1:]
+
+        mean, omega, alpha, beta, variance = (state[c].to_numpy(dtype=np.float64)
+                                              for c in ('Mean', 'Omega', 'Alpha', 'Beta', 'Variance'))
+        for row in returns:
+            valid = ~np.isnan(row)
+            variance = np.where(valid, omega + alpha * (row - mean) ** 2 + beta * variance, variance)
+
+        changed = ~np.isnan(returns).all(axis=0)
+        last_close, last_date = _last_valid(pd.DataFrame(closes, index=prices.index, columns=symbols))
+        self.state.loc[symbols, 'Variance'] = variance
+        self.state.loc[np.array(symbols)[changed], 'LastClose'] = last_close[changed]
+        self.state.loc[np.array(symbols)[changed], 'LastDate'] = pd.to_datetime(last_date[changed])
+        return [s for s, c in zip(symbols, changed) if c]
+
+    def var(self, initial_investment, weights=None, symbols=None):
+        """1-day parametric VaR from each ticker's mean and conditional volatility."""
+        weight = float(np.sum(weights)) if weights is not None else 1.0
+        state = self.state if symbols is None else self.state.reindex(symbols)
+        values = Var.var_from_moments(initial_investment, weight * state['Mean'].to_numpy(dtype=np.float64),
+                                      abs(weight) * np.sqrt(state['Variance'].to_numpy(dtype=np.float64)))
+        return pd.Series(values, index=state.index, name='Var')
+
+
+def model_var(initial_investment, weights, prices, model=None):
+    """
+    VaR per column of a price panel under the configured volatility model.
+
+    Uses and refreshes the cached parameters, so only new or stale tickers are
+    refitted.
+    """
+    model = model or config.VAR_VOL_MODEL
+    vol = VolatilityModel.load(model).fit(prices)
+    vol.save()
+    return vol.var(initial_investment, weights, prices.columns)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EWMA and GARCH(1,1) volatility VaR")
+    parser.add_argument('command', choices=['fit', 'update'])
+    parser.add_argument('--model', default=config.VAR_VOL_MODEL if config.VAR_VOL_MODEL != 'sample' else 'ewma',
+                        choices=MODELS[1:])
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--start', default=config.START_DATE_FOR_VAR)
+    args = parser.parse_args(argv)
+
+    vol = VolatilityModel.load(args.model)
+    provider = market_data.get_provider()
+    if args.command == 'fit' or vol.state.empty:
+        tickers = pd.read_excel(config.ALL_TICKERS_PATH)['Symbol'].dropna().astype(str).tolist()
+        prices = provider.get_history(tickers, start=args.start, end=dt.date.today())
+        vol.fit(prices, args.workers)
+    else:
+        start = vol.state['LastDate'].min().date()
+        changed = vol.update(provider.get_history(vol.state.index.tolist(), start=start, end=dt.date.today()))
+        logger.info(f"{len(changed)} of {len(vol.state)} tickers advanced")
+    vol.save()
+
+    var = vol.var(config.INITIAL_INVESTMENT, config.WEIGHTS).sort_values()
+    annual_vol = np.sqrt(vol.state['Variance'] * Var.TRADING_DAYS)
+    logger.info(f"\n{vol.state[['Alpha', 'Beta']].assign(AnnualVol=annual_vol, Var=var).loc[var.index].round(4)}")
+    logger.info(f"{args.model.upper()} state for {len(vol.state)} tickers saved to {vol.path(args.model)}")
+    return vol
+
+
+if __name__ == '__main__':
+    instrumentation.run_main(main, 'volatility_models')